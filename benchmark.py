@@ -0,0 +1,373 @@
+"""
+Benchmarks every stage of the pipeline (parsing, resolving patterns, featurizing, fitting every classifier and
+labeling rows) on synthetic spreadsheets of any size. Results are written as JSON, and are compared against a saved
+baseline so that a stage getting slower between commits is caught.
+
+The synthetic rows look like the ones from the spreadsheets: prices are drawn from the game's own patterns (see
+forecaster), some prices are missing or aren't numbers, and the pattern labels are written in all of the ways
+people write them, typos included.
+
+Example: python benchmark.py --sizes 1k 100k 1M
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import typing as tp
+
+import numpy as np
+
+import forecaster
+import utility
+from bulk_parser import parse_values_bulk, get_layout, SheetLayout
+from classifiers import CLASSIFIER_GETTERS
+from constants import RANDOM_STATE, MIN_NUM_PRICES
+from get_data import parse_row
+from island_week_data import IslandWeekBatch
+
+BENCHMARK_DIR: str = os.path.join('.', 'benchmarks')
+BASELINE_FILEPATH: str = os.path.join(BENCHMARK_DIR, 'baseline.json')
+
+# The most rows each stage is run on, since some are far too slow to run on millions of rows.
+# The timings are per row, so the stages are still comparable across sizes.
+STAGE_ROW_LIMITS: tp.Dict[str, int] = {
+    'parse_row': 200000,
+    'get_pattern': 200000,
+    'fit Linear SVM': 20000,
+    'fit RBF SVM': 5000,
+    'fit Naive Bayes': 1000000,
+    'fit Random Forest': 50000,
+}
+
+# The number of rows parsed at a time by the parse_values_bulk stage.
+PARSE_CHUNK_SIZE: int = 50000
+
+# Ways the labels of each pattern are written in the spreadsheets, not counting typos.
+_pattern_labels: tp.List[tp.List[str]] = [
+    ['Decreasing', 'decreasing', 'D', 'dec'],
+    ['Random', 'Fluctuating', 'fluctuating', 'R', 'rd'],
+    ['Large Spike', 'Big Spike', 'high spike', 'BIIIIIG SPIKE', 'LS', 'bs'],
+    ['Small Spike', 'small spike', 'smol spike', 'SS', 'gentle'],
+]
+_junk_labels: tp.List[str] = ['', '', '', '?', 'idk', 'N/A']
+_junk_prices: tp.List[str] = ['', '?', '~100', 'n/a', '1oo']
+
+
+def _add_typo(label: str, rng: np.random.Generator) -> str:
+    if len(label) < 2:
+        return label
+    position: int = int(rng.integers(len(label)))
+    return label[:position] + chr(int(rng.integers(ord('a'), ord('z') + 1))) + label[position + 1:]
+
+
+def _draw_labels(pattern_indexes: np.ndarray, messy_rate: float, rng: np.random.Generator) -> tp.List[str]:
+    labels: tp.List[str] = []
+    for pattern_index, roll in zip(pattern_indexes, rng.random(len(pattern_indexes))):
+        if roll < messy_rate / 2:
+            labels.append(_junk_labels[int(rng.integers(len(_junk_labels)))])
+            continue
+        options: tp.List[str] = _pattern_labels[pattern_index]
+        label: str = options[int(rng.integers(len(options)))]
+        labels.append(_add_typo(label, rng) if roll < messy_rate else label)
+    return labels
+
+
+def generate_sheet_rows(n_rows: int, is_community_data: bool = True, islands_per_week: int = 500,
+                        missing_rate: float = 0.3, messy_rate: float = 0.2, chunk_size: int = 50000,
+                        seed: int = RANDOM_STATE) -> tp.Iterator[tp.List[str]]:
+    """
+    Generates rows of cell values shaped like the ones from one of the spreadsheets, a chunk at a time,
+    so that even millions of rows never have to be held in memory at once.
+    :param n_rows: The number of island-weeks to generate. An empty row is added between every week.
+    :param is_community_data: Whether to lay the rows out like the community spreadsheet or the personal one.
+    :param islands_per_week: The number of islands in every week. The same islands show up every week.
+    :param missing_rate: The chance of each price being left out.
+    :param messy_rate: The chance of each pattern label being junk or having a typo.
+    :param chunk_size: The number of rows generated at a time.
+    :param seed: The seed of the random number generator, so the same rows are generated every time.
+    :return: A generator of the rows.
+    """
+    rng: np.random.Generator = np.random.default_rng(seed)
+    layout: SheetLayout = get_layout(is_community_data)
+    tables = forecaster.PATTERN_TABLES
+    parameterizations_by_pattern: tp.List[np.ndarray] = [np.flatnonzero(tables.pattern_indexes == i)
+                                                         for i in range(len(forecaster.FORECAST_PATTERNS))]
+    priors_by_pattern: tp.List[np.ndarray] = [np.exp(tables.log_priors[indexes])
+                                              for indexes in parameterizations_by_pattern]
+    transitions: np.ndarray = np.cumsum(forecaster.TRANSITION_PROBABILITIES, axis=1)
+
+    for start in range(0, n_rows, chunk_size):
+        n: int = min(chunk_size, n_rows - start)
+        purchase_prices: np.ndarray = rng.integers(90, 111, n)
+        previous_patterns: np.ndarray = rng.choice(len(forecaster.FORECAST_PATTERNS), n,
+                                                   p=forecaster.STATIONARY_PROBABILITIES)
+        current_patterns: np.ndarray = (rng.random((n, 1)) > transitions[previous_patterns]).sum(axis=1)
+        parameterizations: np.ndarray = np.zeros(n, dtype=int)
+        for pattern_index, indexes in enumerate(parameterizations_by_pattern):
+            has_pattern: np.ndarray = current_patterns == pattern_index
+            parameterizations[has_pattern] = rng.choice(indexes, int(has_pattern.sum()),
+                                                        p=priors_by_pattern[pattern_index])
+
+        rates: np.ndarray = rng.uniform(tables.low_rates[parameterizations], tables.high_rates[parameterizations])
+        prices: np.ndarray = (np.ceil(rates * purchase_prices.reshape(-1, 1)) -
+                              tables.offsets[parameterizations]).astype(int)
+        price_cells: np.ndarray = prices.astype(str).astype(object)
+        price_cells[rng.random(prices.shape) < missing_rate] = ''
+        is_junk: np.ndarray = rng.random(prices.shape) < missing_rate / 20
+        price_cells[is_junk] = rng.choice(_junk_prices, int(is_junk.sum()))
+        purchase_cells: np.ndarray = purchase_prices.astype(str).astype(object)
+        purchase_cells[rng.random(n) < 0.005] = ''
+        current_labels: tp.List[str] = _draw_labels(current_patterns, messy_rate, rng)
+        previous_labels: tp.List[str] = _draw_labels(previous_patterns, messy_rate, rng)
+
+        for i in range(n):
+            row_num: int = start + i
+            if row_num > 0 and row_num % islands_per_week == 0:
+                yield []
+            island_num: int = row_num % islands_per_week
+            row: tp.List[str] = [''] * layout.width
+            row[layout.owner_col] = f'owner{island_num}'
+            if layout.island_col is not None:
+                row[layout.island_col] = f'island{island_num}'
+            row[layout.purchase_col] = purchase_cells[i]
+            row[layout.first_price_col:layout.current_pattern_col] = price_cells[i]
+            row[layout.current_pattern_col] = current_labels[i]
+            row[layout.previous_pattern_col] = previous_labels[i]
+            # Like the Sheets API, empty cells at the end of a row are left out.
+            while row and row[-1] == '':
+                row.pop()
+            yield row
+
+
+class StageResult(tp.NamedTuple):
+    seconds: float
+    n_rows: int
+
+    @property
+    def seconds_per_row(self) -> float:
+        return self.seconds / max(self.n_rows, 1)
+
+    def to_dict(self) -> tp.Dict[str, float]:
+        return {'seconds': self.seconds, 'n_rows': self.n_rows,
+                'rows_per_second': self.n_rows / self.seconds if self.seconds > 0 else float('inf')}
+
+
+def _time(func: tp.Callable[[], tp.Any], repeat: int, setup: tp.Union[None, tp.Callable[[], tp.Any]] = None) -> float:
+    """
+    :return: The fastest of repeat runs of func, in seconds. setup is run (untimed) before every run.
+    """
+    best: float = float('inf')
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start: float = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _limit(stage: str, n_rows: int) -> int:
+    return min(n_rows, STAGE_ROW_LIMITS.get(stage, n_rows))
+
+
+def run_benchmarks(n_rows: int, repeat: int = 3, is_community_data: bool = True,
+                   classifiers: tp.Iterable[str] = tuple(CLASSIFIER_GETTERS.keys()),
+                   quiet: bool = True) -> tp.Dict[str, StageResult]:
+    """
+    Times every stage of the pipeline on n_rows synthetic island-weeks.
+    :param n_rows: The number of island-weeks to generate.
+    :param repeat: The number of times each stage is run. The fastest run is kept.
+    :param is_community_data: Whether to generate and parse rows like the community spreadsheet or the personal one.
+    :param classifiers: The names of the classifiers to time the fitting of.
+    :param quiet: If false, prints every stage as it finishes.
+    :return: The result of every stage by its name.
+    """
+    results: tp.Dict[str, StageResult] = {}
+
+    def record(stage: str, seconds: float, n: int):
+        results[stage] = StageResult(seconds, n)
+        if not quiet:
+            print(f'{n_rows:>10} {stage:<28} {seconds:10.4f}s {results[stage].seconds_per_row * 1e6:10.3f}us/row')
+
+    n: int = _limit('parse_row', n_rows)
+    values: tp.List[tp.List[str]] = [row for row in generate_sheet_rows(n, is_community_data) if row]
+    record('parse_row', _time(lambda: [parse_row(row, 0, is_community_data=is_community_data) for row in values],
+                              repeat, setup=utility.get_pattern_resolver.cache_clear), n)
+
+    n = _limit('get_pattern', n_rows)
+    layout: SheetLayout = get_layout(is_community_data)
+    labels: tp.List[str] = [row[layout.current_pattern_col] if len(row) > layout.current_pattern_col else ''
+                            for row in values[:n]]
+    del values
+    # Starts with a new resolver every run, so building it and filling its cache is part of the time.
+    record('get_pattern', _time(lambda: [utility.get_pattern(label) for label in labels], repeat,
+                                setup=utility.get_pattern_resolver.cache_clear), n)
+
+    # Only parsing is timed, a chunk at a time as the rows are generated, so the rows never all sit in memory.
+    utility.get_pattern_resolver.cache_clear()
+    batches: tp.List[IslandWeekBatch] = []
+    seconds: float = 0.0
+    week_num: int = 0
+    rows: tp.Iterator[tp.List[str]] = generate_sheet_rows(n_rows, is_community_data)
+    while True:
+        chunk: tp.List[tp.List[str]] = list(itertools.islice(rows, PARSE_CHUNK_SIZE))
+        if not chunk:
+            break
+        start: float = time.perf_counter()
+        chunk_batch, report = parse_values_bulk(chunk, is_community_data, start_week=week_num)
+        seconds += time.perf_counter() - start
+        batches.append(chunk_batch)
+        week_num += report.n_separators
+    record('parse_values_bulk', seconds, n_rows)
+    batch: IslandWeekBatch = IslandWeekBatch.concatenate(batches)
+    del batches
+
+    record('get_all_data', _time(lambda: utility.get_all_data(batch, MIN_NUM_PRICES), repeat), len(batch))
+    x, _, y = utility.get_all_data(batch, MIN_NUM_PRICES)
+    y = y.ravel()
+
+    fitted: tp.Dict[str, tp.Any] = {}
+    for name in classifiers:
+        stage: str = f'fit {name}'
+        n = _limit(stage, len(x))
+        _, model, _ = CLASSIFIER_GETTERS[name]()
+        record(stage, _time(lambda: model.fit(x[:n], y[:n]), repeat), n)
+        fitted[name] = model
+    del x, y
+
+    if fitted:
+        name: str = 'Random Forest' if 'Random Forest' in fitted else next(iter(fitted))
+        # Every run populates a fresh copy of the batch. Only the one being timed is kept, so the repeats don't add
+        # up to several copies of the batch in memory.
+        copies: tp.List[IslandWeekBatch] = []
+
+        def copy_batch():
+            copies.clear()
+            copies.append(batch[np.arange(len(batch))])
+
+        record('populate_current_pattern',
+               _time(lambda: utility.populate_current_pattern(copies[-1], fitted[name]), repeat, setup=copy_batch),
+               len(batch))
+        del copies
+    return results
+
+
+def get_environment() -> tp.Dict[str, tp.Any]:
+    """
+    :return: What the benchmarks were run on, saved with the results since timings only compare on the same machine.
+    """
+    import sklearn
+    try:
+        commit: tp.Union[None, str] = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                                     check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'sklearn': sklearn.__version__, 'machine': platform.machine(),
+            'cpu_count': os.cpu_count()}
+
+
+def save_benchmarks(results: tp.Dict[int, tp.Dict[str, StageResult]], filepath: str):
+    os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+    with open(filepath, 'w') as f:
+        json.dump({'environment': get_environment(),
+                   'sizes': {str(n_rows): {stage: result.to_dict() for stage, result in stages.items()}
+                             for n_rows, stages in results.items()}}, f, indent=2)
+
+
+def load_benchmarks(filepath: str) -> tp.Dict[int, tp.Dict[str, StageResult]]:
+    with open(filepath, 'r') as f:
+        sizes: tp.Dict[str, tp.Dict[str, tp.Dict[str, float]]] = json.load(f)['sizes']
+    return {int(n_rows): {stage: StageResult(result['seconds'], int(result['n_rows']))
+                          for stage, result in stages.items()}
+            for n_rows, stages in sizes.items()}
+
+
+class Regression(tp.NamedTuple):
+    n_rows: int
+    stage: str
+    baseline_seconds_per_row: float
+    seconds_per_row: float
+
+    @property
+    def slowdown(self) -> float:
+        return self.seconds_per_row / self.baseline_seconds_per_row
+
+    def __str__(self):
+        return f'{self.stage} at {self.n_rows} rows is {self.slowdown:.2f}x slower ' + \
+               f'({self.baseline_seconds_per_row * 1e6:.3f} -> {self.seconds_per_row * 1e6:.3f} us/row)'
+
+
+def compare_benchmarks(results: tp.Dict[int, tp.Dict[str, StageResult]],
+                       baseline: tp.Dict[int, tp.Dict[str, StageResult]], threshold: float = 0.25,
+                       min_seconds: float = 0.01) -> tp.List[Regression]:
+    """
+    Finds the stages that got slower than the baseline. Only stages run at the same size in both are compared.
+    :param results: The new results.
+    :param baseline: The results to compare against.
+    :param threshold: How much slower (as a fraction) a stage has to be to count. Default is 25%.
+    :param min_seconds: Stages faster than this in both are too noisy to compare and are skipped.
+    :return: Every stage that got slower.
+    """
+    regressions: tp.List[Regression] = []
+    for n_rows, stages in results.items():
+        for stage, result in stages.items():
+            old: tp.Union[None, StageResult] = baseline.get(n_rows, {}).get(stage)
+            if old is None or max(old.seconds, result.seconds) < min_seconds:
+                continue
+            if result.seconds_per_row > old.seconds_per_row * (1 + threshold):
+                regressions.append(Regression(n_rows, stage, old.seconds_per_row, result.seconds_per_row))
+    return regressions
+
+
+def parse_size(size: str) -> int:
+    """
+    Parses sizes like 1000, 10k, or 2.5M.
+    """
+    multipliers: tp.Dict[str, int] = {'k': 1000, 'm': 1000 ** 2}
+    suffix: str = size[-1].lower()
+    if suffix in multipliers:
+        return int(float(size[:-1]) * multipliers[suffix])
+    return int(size)
+
+
+def main(args: tp.Union[None, tp.List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline on synthetic data and compare against a '
+                                                 'baseline. Exits with 1 if any stage got slower.')
+    parser.add_argument('--sizes', nargs='+', type=parse_size, default=[1000, 10000, 100000],
+                        help='The numbers of island-weeks to benchmark, such as 1k 100k 10M.')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--classifiers', nargs='*', default=list(CLASSIFIER_GETTERS.keys()),
+                        choices=list(CLASSIFIER_GETTERS.keys()))
+    parser.add_argument('--personal', action='store_true', help='Generate rows like the personal spreadsheet.')
+    parser.add_argument('--output', default=os.path.join(BENCHMARK_DIR, 'latest.json'))
+    parser.add_argument('--baseline', default=BASELINE_FILEPATH)
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='Save the results as the new baseline instead of comparing against it.')
+    parser.add_argument('--threshold', type=float, default=0.25)
+    parsed = parser.parse_args(args)
+
+    results: tp.Dict[int, tp.Dict[str, StageResult]] = {
+        n_rows: run_benchmarks(n_rows, parsed.repeat, not parsed.personal, parsed.classifiers, quiet=False)
+        for n_rows in parsed.sizes}
+    save_benchmarks(results, parsed.output)
+
+    if parsed.update_baseline or not os.path.exists(parsed.baseline):
+        save_benchmarks(results, parsed.baseline)
+        print(f'Saved the baseline to {parsed.baseline}')
+        return 0
+
+    regressions: tp.List[Regression] = compare_benchmarks(results, load_benchmarks(parsed.baseline), parsed.threshold)
+    for regression in regressions:
+        print(f'REGRESSION: {regression}')
+    if not regressions:
+        print('No stage got slower than the baseline.')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
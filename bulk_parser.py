@@ -0,0 +1,260 @@
+"""
+Parses the raw cell values of the spreadsheets in bulk. Instead of going row by row, whole columns of prices,
+purchase prices, and patterns are converted at once, and the rows that can't be parsed are collected into
+a report rather than printed.
+"""
+import itertools
+import typing as tp
+
+import numpy as np
+
+import instrumentation
+import utility
+from island_week_data import IslandWeekBatch, N_PRICES
+
+
+class SheetLayout(tp.NamedTuple):
+    """
+    Which columns of a spreadsheet hold which values. The island column is None if the sheet doesn't have one.
+    """
+    owner_col: int
+    island_col: tp.Union[None, int]
+    purchase_col: int
+    first_price_col: int
+
+    @property
+    def current_pattern_col(self) -> int:
+        return self.first_price_col + N_PRICES
+
+    @property
+    def previous_pattern_col(self) -> int:
+        return self.current_pattern_col + 1
+
+    @property
+    def width(self) -> int:
+        return self.previous_pattern_col + 1
+
+
+COMMUNITY_LAYOUT: SheetLayout = SheetLayout(owner_col=0, island_col=1, purchase_col=2, first_price_col=3)
+PERSONAL_LAYOUT: SheetLayout = SheetLayout(owner_col=0, island_col=None, purchase_col=1, first_price_col=4)
+
+
+class RejectedRow(tp.NamedTuple):
+    row_index: int
+    week_num: int
+    reason: str
+    row: tp.List[str]
+
+
+class ParseReport:
+    """
+    Summary of a bulk parse: how many rows were seen, how many were parsed, and why the others were rejected.
+    """
+
+    def __init__(self):
+        self.n_rows: int = 0
+        self.n_separators: int = 0
+        self.n_parsed: int = 0
+        self.rejected: tp.List[RejectedRow] = []
+
+    @property
+    def n_rejected(self) -> int:
+        return len(self.rejected)
+
+    def reason_counts(self) -> tp.Dict[str, int]:
+        counts: tp.Dict[str, int] = {}
+        for rejected_row in self.rejected:
+            counts[rejected_row.reason] = counts.get(rejected_row.reason, 0) + 1
+        return counts
+
+    def merge(self, other: 'ParseReport') -> 'ParseReport':
+        self.n_rows += other.n_rows
+        self.n_separators += other.n_separators
+        self.n_parsed += other.n_parsed
+        self.rejected.extend(other.rejected)
+        return self
+
+    def __str__(self):
+        reasons: str = ', '.join([f'{reason} ({count})' for reason, count in self.reason_counts().items()])
+        return f'Parsed {self.n_parsed}/{self.n_rows - self.n_separators} rows over {self.n_separators} week separators.' + \
+               (f' Rejected: {reasons}' if reasons else '')
+
+
+def get_layout(is_community_data: bool) -> SheetLayout:
+    return COMMUNITY_LAYOUT if is_community_data else PERSONAL_LAYOUT
+
+
+# The longest cell that is converted to a number in bulk. Longer ones (which are never valid prices) are checked one
+# at a time, so that they don't make every cell of the chunk as wide as them.
+MAX_NUMBER_LENGTH: int = 16
+
+_max_number: int = np.iinfo(np.int32).max
+
+
+def _to_grid(values: tp.List[tp.List[str]], width: int) -> np.ndarray:
+    # Kept as Python strings. A column only becomes a fixed width array when it's needed, so one long cell (like a
+    # comment) only makes its own column wider.
+    grid: np.ndarray = np.empty((len(values), width), dtype=object)
+    if len(values) > 0:
+        grid[:] = [row[:width] + [''] * (width - len(row)) for row in values]
+    return grid
+
+
+def _to_strings(cells: np.ndarray) -> np.ndarray:
+    return np.asarray(cells.tolist(), dtype=str).reshape(cells.shape)
+
+
+def _get_lengths(cells: np.ndarray) -> np.ndarray:
+    return np.fromiter(map(len, cells.ravel()), dtype=np.int64, count=cells.size).reshape(cells.shape)
+
+
+class _Numbers(tp.NamedTuple):
+    numbers: np.ndarray
+    is_decimal: np.ndarray
+    is_digit: np.ndarray
+    is_out_of_range: np.ndarray
+
+
+def _parse_numbers(cells: np.ndarray) -> _Numbers:
+    """
+    Converts the cells that are made of decimal digits to integers.
+    :param cells: Object array of strings.
+    :return: The numbers (0 where a cell isn't one or is too large for an int32), which cells are decimal digits,
+    which are digits to str.isdigit (like "²"), and which are decimal digits too large for an int32.
+    """
+    is_long: np.ndarray = _get_lengths(cells) > MAX_NUMBER_LENGTH
+    strings: np.ndarray = _to_strings(np.where(is_long, '', cells) if is_long.any() else cells)
+    is_decimal: np.ndarray = np.char.isdecimal(strings)
+    is_digit: np.ndarray = np.char.isdigit(strings)
+    numbers: np.ndarray = np.zeros(cells.shape, dtype=np.int64)
+    numbers[is_decimal] = strings[is_decimal].astype(np.int64)
+    is_out_of_range: np.ndarray = numbers > _max_number
+
+    for i in zip(*np.nonzero(is_long)):
+        cell: str = cells[i]
+        is_decimal[i], is_digit[i] = cell.isdecimal(), cell.isdigit()
+        if is_decimal[i]:
+            # Could still be a small number with a lot of leading zeros.
+            number: int = int(cell)
+            is_out_of_range[i] = number > _max_number
+            numbers[i] = 0 if is_out_of_range[i] else number
+    numbers[is_out_of_range] = 0
+    return _Numbers(numbers.astype(np.int32), is_decimal, is_digit, is_out_of_range)
+
+
+def _parse_purchase_prices(column: np.ndarray) -> tp.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Converts a column of purchase prices to integers.
+    :return: A tuple of the purchase prices, a mask of which ones could not be converted, and a mask of which ones
+    are too large (or small) for an int32.
+    """
+    parsed: _Numbers = _parse_numbers(column)
+    purchase_prices: np.ndarray = parsed.numbers
+    out_of_range: np.ndarray = parsed.is_out_of_range
+
+    # Anything else (like " 100" or "-5") is rare enough to go through int() one at a time.
+    failed: np.ndarray = np.zeros(column.shape[0], dtype=bool)
+    for i in np.flatnonzero(~parsed.is_decimal):
+        try:
+            purchase_price: int = int(column[i])
+        except ValueError:
+            failed[i] = True
+            continue
+        if -_max_number <= purchase_price <= _max_number:
+            purchase_prices[i] = purchase_price
+        else:
+            out_of_range[i] = True
+    return purchase_prices, failed, out_of_range
+
+
+@instrumentation.timed()
+def parse_values_bulk(values: tp.List[tp.List[str]], is_community_data: bool = True, start_week: int = 0,
+                      row_offset: int = 0) -> tp.Tuple[IslandWeekBatch, ParseReport]:
+    """
+    Parses a grid of raw cell values from one of the spreadsheets.
+    :param values: The rows of cell values, with the weeks separated by empty rows.
+    :param is_community_data: Whether the values are from the community spreadsheet or the personal one.
+    :param start_week: The week number of the first row in values.
+    :param row_offset: The index of the first row in values within the whole sheet. Only used for the report.
+    :return: A tuple of the parsed rows and the report of the parse.
+    """
+    layout: SheetLayout = get_layout(is_community_data)
+    report: ParseReport = ParseReport()
+    report.n_rows = len(values)
+
+    is_separator: np.ndarray = np.fromiter((not any(row) for row in values), dtype=bool, count=len(values))
+    report.n_separators = int(is_separator.sum())
+    week_nums: np.ndarray = start_week + np.cumsum(is_separator, dtype=np.int32)
+    row_lengths: np.ndarray = np.fromiter((len(row) for row in values), dtype=np.int32, count=len(values))
+
+    grid: np.ndarray = _to_grid(values, layout.width)
+    purchase_prices, bad_purchase, purchase_out_of_range = _parse_purchase_prices(grid[:, layout.purchase_col])
+
+    parsed_prices: _Numbers = _parse_numbers(grid[:, layout.first_price_col:layout.current_pattern_col])
+    prices: np.ndarray = parsed_prices.numbers
+    # Cells like "²" are digits to str.isdigit but can't be made into an int.
+    bad_prices: np.ndarray = (parsed_prices.is_digit & ~parsed_prices.is_decimal).any(axis=1)
+
+    reasons: tp.List[tp.Tuple[np.ndarray, str]] = [
+        (row_lengths <= layout.purchase_col, 'Row is too short.'),
+        (_get_lengths(grid[:, layout.purchase_col]) < 1, 'Purchase price is empty.'),
+        (bad_purchase, 'Purchase price is not a number.'),
+        (purchase_out_of_range, 'Purchase price is out of range.'),
+        (bad_prices, 'Price is not a number.'),
+        (parsed_prices.is_out_of_range.any(axis=1), 'Price is out of range.'),
+    ]
+    rejected: np.ndarray = np.zeros(len(values), dtype=bool)
+    for mask, reason in reasons:
+        new_rejects: np.ndarray = mask & ~rejected & ~is_separator
+        report.rejected.extend([RejectedRow(row_offset + int(i), int(week_nums[i]), reason, values[i])
+                                for i in np.flatnonzero(new_rejects)])
+        rejected |= new_rejects
+    report.rejected.sort(key=lambda r: r.row_index)
+
+    keep: np.ndarray = ~rejected & ~is_separator
+    report.n_parsed = int(keep.sum())
+    island_names: np.ndarray = _to_strings(grid[keep, layout.island_col]) if layout.island_col is not None else \
+        np.full(report.n_parsed, '')
+    batch: IslandWeekBatch = IslandWeekBatch(
+        _to_strings(grid[keep, layout.owner_col]), island_names, week_nums[keep], prices[keep], purchase_prices[keep],
+        utility.resolve_pattern_codes(_to_strings(grid[keep, layout.previous_pattern_col])),
+        utility.resolve_pattern_codes(_to_strings(grid[keep, layout.current_pattern_col])))
+    instrumentation.count('rows parsed', report.n_parsed)
+    instrumentation.count('rows rejected', report.n_rejected)
+    return batch, report
+
+
+def iter_parse_chunks(rows: tp.Iterable[tp.List[str]], is_community_data: bool = True, chunk_size: int = 50000,
+                      start_week: int = 0) -> tp.Iterator[tp.Tuple[IslandWeekBatch, ParseReport]]:
+    """
+    Parses a stream of rows in chunks so the whole sheet never has to be held as lists of strings at once.
+    :param rows: Any iterable of rows of cell values, such as a generator that downloads the sheet piece by piece.
+    :param is_community_data: Whether the rows are from the community spreadsheet or the personal one.
+    :param chunk_size: The number of rows to parse at a time.
+    :param start_week: The week number of the first row.
+    :return: A generator of the parsed rows and the report of each chunk.
+    """
+    iterator: tp.Iterator[tp.List[str]] = iter(rows)
+    week_num: int = start_week
+    row_offset: int = 0
+    while True:
+        chunk: tp.List[tp.List[str]] = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        batch, report = parse_values_bulk(chunk, is_community_data, start_week=week_num, row_offset=row_offset)
+        week_num += report.n_separators
+        row_offset += len(chunk)
+        yield batch, report
+
+
+def parse_stream(rows: tp.Iterable[tp.List[str]], is_community_data: bool = True, chunk_size: int = 50000,
+                 start_week: int = 0) -> tp.Tuple[IslandWeekBatch, ParseReport]:
+    """
+    Parses a stream of rows chunk by chunk and joins the results.
+    """
+    batches: tp.List[IslandWeekBatch] = []
+    report: ParseReport = ParseReport()
+    for batch, chunk_report in iter_parse_chunks(rows, is_community_data, chunk_size, start_week):
+        batches.append(batch)
+        report.merge(chunk_report)
+    return IslandWeekBatch.concatenate(batches), report
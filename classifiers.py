@@ -1,14 +1,17 @@
+"""
+The classifiers that get trained, with the hyperparameters to search over. sklearn takes seconds to import, so each
+getter only imports the parts of it that it needs.
+"""
 import numpy as np
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.naive_bayes import GaussianNB
-from sklearn.pipeline import make_pipeline
-from sklearn.preprocessing import MinMaxScaler
-from sklearn.svm import SVC, LinearSVC
 
 from constants import RANDOM_STATE, SVM_ITERATIONS, N_JOBS
 
 
 def get_linear_svm_classifier():
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import MinMaxScaler
+    from sklearn.svm import LinearSVC
+
     params = {'linearsvc__C': np.arange(0.125, 0.375, .025),
               'linearsvc__fit_intercept': [True, False],
               'linearsvc__tol': np.arange(.000001, .00001, .000005)}
@@ -20,6 +23,10 @@ def get_linear_svm_classifier():
 
 
 def get_rbf_svm_classifier():
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import MinMaxScaler
+    from sklearn.svm import SVC
+
     params = {
         'svc__gamma': ['scale', 'auto'],
         'svc__shrinking': [True, False],
@@ -33,6 +40,8 @@ def get_rbf_svm_classifier():
 
 
 def get_naive_bayes_classifier():
+    from sklearn.naive_bayes import GaussianNB
+
     params = {
         'var_smoothing': np.arange(10 ** -12, 10 ** -10, 5 * 10 ** - 12)
     }
@@ -40,6 +49,8 @@ def get_naive_bayes_classifier():
 
 
 def get_random_forest_classifier():
+    from sklearn.ensemble import RandomForestClassifier
+
     params = {
         'ccp_alpha': np.arange(.01, .03, .005),
         'max_features': ['auto', None, 'sqrt'],
@@ -47,3 +58,16 @@ def get_random_forest_classifier():
         'n_estimators': list(range(50, 150, 10))
     }
     return 'Random Forest', RandomForestClassifier(random_state=RANDOM_STATE, n_jobs=N_JOBS), params
+
+
+# Every classifier that gets trained, by the name it is saved and reported under.
+CLASSIFIER_GETTERS = {
+    'Linear SVM': get_linear_svm_classifier,
+    'RBF SVM': get_rbf_svm_classifier,
+    'Naive Bayes': get_naive_bayes_classifier,
+    'Random Forest': get_random_forest_classifier,
+}
+
+
+def get_all_classifiers():
+    return [getter() for getter in CLASSIFIER_GETTERS.values()]
@@ -27,3 +27,23 @@ MODEL_FILEPATH: str = join('.', 'models')
 N_JOBS: int = -1
 
 RESULTS_SAVE_PATH: str = join('.', 'results')
+
+SNAPSHOT_FILEPATH: str = join('.', 'snapshots')
+
+# The largest amount of memory (in bytes, going by the size of the model files) of loaded models to keep around.
+MODEL_CACHE_BYTES: int = 512 * 1024 ** 2
+
+MODEL_MANIFEST_FILENAME: str = 'manifest.json'
+
+# The number of rows a model predicts at a time when labeling many rows.
+PREDICTION_CHUNK_SIZE: int = 8192
+
+RESULTS_DB_PATH: str = join(RESULTS_SAVE_PATH, 'results.sqlite3')
+
+FEATURE_CACHE_FILEPATH: str = join('.', 'feature_cache')
+
+# The most space (in bytes) the cached feature matrices can take up.
+FEATURE_CACHE_BYTES: int = 2 * 1024 ** 3
+
+# Where `main.py worker` listens for commands by default.
+WORKER_SOCKET_PATH: str = join('.', '.acnh_worker.sock')
@@ -0,0 +1,185 @@
+"""
+Caches the feature matrices made by utility.get_all_data and utility.get_perfect_data on disk, so featurizing the
+same data again (in the next notebook cell, the next session, or another worker) just memory maps the saved arrays.
+
+Entries are keyed by a hash of the price and pattern arrays of the rows along with how they were featurized, so a
+change to the data or the parameters never gives back stale features. The cache directory is kept under a size
+limit by deleting the least recently used entries.
+"""
+import hashlib
+import json
+import os
+import typing as tp
+
+import numpy as np
+
+import instrumentation
+import utility
+from constants import MIN_NUM_PRICES, FEATURE_CACHE_FILEPATH, FEATURE_CACHE_BYTES
+from island_week_data import IslandWeekBatch
+
+# Bump whenever featurization changes so that old entries are never used again.
+FEATURE_CACHE_VERSION: int = 1
+
+_array_names: tp.Tuple[str, ...] = ('x', 'y', 'indexes')
+
+# The columns of a batch that the features depend on.
+_hashed_columns: tp.Tuple[str, ...] = ('prices', 'purchase_prices', 'previous_pattern_codes', 'current_pattern_codes')
+
+
+def hash_batch(batch: IslandWeekBatch) -> str:
+    """
+    :return: A hash of everything in the batch that its features depend on.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    for column in _hashed_columns:
+        array: np.ndarray = np.ascontiguousarray(getattr(batch, column))
+        digest.update(f'{column}:{array.dtype.str}:{array.shape}'.encode())
+        digest.update(array.data)
+    return digest.hexdigest()
+
+
+def get_key(batch: IslandWeekBatch, is_perfect: bool, min_prices: int, regression: bool) -> str:
+    params: str = json.dumps({'version': FEATURE_CACHE_VERSION, 'is_perfect': is_perfect,
+                              'min_prices': None if is_perfect else min_prices, 'regression': regression},
+                             sort_keys=True)
+    return hashlib.blake2b(f'{hash_batch(batch)}:{params}'.encode(), digest_size=20).hexdigest()
+
+
+class FeatureCache:
+    """
+    A directory of cached feature matrices. Safe to share between processes: entries are written to temporary
+    files and moved into place, so readers only ever see complete arrays.
+    """
+
+    def __init__(self, cache_dir: str = FEATURE_CACHE_FILEPATH, max_bytes: int = FEATURE_CACHE_BYTES):
+        """
+        :param cache_dir: The directory the arrays are kept in.
+        :param max_bytes: The most space the cached arrays can take up before the least recently used are deleted.
+        """
+        self.cache_dir: str = cache_dir
+        self.max_bytes: int = max_bytes
+
+    def _get_path(self, key: str, name: str) -> str:
+        return os.path.join(self.cache_dir, f'{key}_{name}.npy')
+
+    def load(self, key: str) -> tp.Union[None, tp.Tuple[np.ndarray, ...]]:
+        """
+        :return: The read only, memory mapped x, y, and row indexes of the entry, or None if it isn't cached.
+        """
+        paths: tp.List[str] = [self._get_path(key, name) for name in _array_names]
+        try:
+            arrays: tp.Tuple[np.ndarray, ...] = tuple(np.load(path, mmap_mode='r') for path in paths)
+        except (FileNotFoundError, ValueError):
+            return None
+        # Marks the entry as recently used for eviction.
+        for path in paths:
+            os.utime(path)
+        return arrays
+
+    def save(self, key: str, x: np.ndarray, y: np.ndarray, indexes: np.ndarray):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # The indexes are written last, since an entry only counts once all of its arrays are there.
+        for name, array in zip(_array_names, (x, y, indexes)):
+            path: str = self._get_path(key, name)
+            temp_path: str = f'{path}.{os.getpid()}.tmp'
+            with open(temp_path, 'wb') as f:
+                np.save(f, array)
+            os.replace(temp_path, path)
+        self.evict()
+
+    def get_entries(self) -> tp.List[tp.Tuple[str, int, float]]:
+        """
+        :return: The key, total size in bytes, and last time used of every entry, least recently used first.
+        """
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries: tp.Dict[str, tp.List[float]] = {}
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith('.npy'):
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, filename))
+            size_and_time: tp.List[float] = entries.setdefault(filename.rsplit('_', 1)[0], [0, 0.0])
+            size_and_time[0] += stat.st_size
+            size_and_time[1] = max(size_and_time[1], stat.st_mtime)
+        return sorted([(key, int(size), used) for key, (size, used) in entries.items()], key=lambda e: e[2])
+
+    def evict(self, max_bytes: tp.Union[None, int] = None) -> tp.List[str]:
+        """
+        Deletes the least recently used entries until the cache fits in max_bytes (the cache's limit by default).
+        :return: The keys of the deleted entries.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries: tp.List[tp.Tuple[str, int, float]] = self.get_entries()
+        total: int = sum(size for _, size, _ in entries)
+        evicted: tp.List[str] = []
+        for key, size, _ in entries:
+            if total <= max_bytes:
+                break
+            for name in _array_names:
+                try:
+                    os.remove(self._get_path(key, name))
+                except FileNotFoundError:
+                    pass
+            total -= size
+            evicted.append(key)
+        return evicted
+
+    def clear(self):
+        self.evict(max_bytes=0)
+
+    def get_data(self, rows: utility.RowsType, is_perfect: bool = False, min_prices: int = MIN_NUM_PRICES,
+                 regression: bool = False) -> tp.Tuple[np.ndarray, utility.RowsType, np.ndarray]:
+        """
+        Featurizes the rows like utility.get_all_data and utility.get_perfect_data, going through the cache.
+        :param rows: Either a list of IslandWeekData or an IslandWeekBatch.
+        :param is_perfect: If true, only uses the rows with every price and both patterns, like get_perfect_data.
+        :param min_prices: The fewest prices a row can have to be used. Not used if is_perfect is true.
+        :param regression: If true, the features are from to_numpy_regression instead of to_numpy.
+        :return: A tuple of the features, the rows that were used, and their current patterns. The arrays are read only.
+        """
+        batch: IslandWeekBatch = utility.as_batch(rows)
+        key: str = get_key(batch, is_perfect, min_prices, regression)
+        cached: tp.Union[None, tp.Tuple[np.ndarray, ...]] = self.load(key)
+        if cached is not None:
+            instrumentation.count('feature cache hits')
+            x, y, indexes = cached
+        else:
+            instrumentation.count('feature cache misses')
+            indexes = np.flatnonzero(batch.is_perfect() if is_perfect else batch.is_valid(min_prices))
+            selected: IslandWeekBatch = batch[indexes]
+            x = selected.to_numpy_regression() if regression else selected.to_numpy()
+            y = selected.get_current_patterns()
+            self.save(key, x, y, indexes)
+            x, y, indexes = self.load(key) or (x, y, indexes)
+        mask: np.ndarray = np.zeros(len(batch), dtype=bool)
+        mask[indexes] = True
+        return x, utility._select_rows(rows, mask), y
+
+
+_default_cache: tp.Union[None, FeatureCache] = None
+
+
+def get_feature_cache() -> FeatureCache:
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = FeatureCache()
+    return _default_cache
+
+
+@instrumentation.timed()
+def get_all_data(rows: utility.RowsType, min_prices: int = MIN_NUM_PRICES,
+                 regression: bool = False) -> tp.Tuple[np.ndarray, utility.RowsType, np.ndarray]:
+    """
+    The same as utility.get_all_data, but cached.
+    """
+    return get_feature_cache().get_data(rows, False, min_prices, regression)
+
+
+@instrumentation.timed()
+def get_perfect_data(rows: utility.RowsType,
+                     regression: bool = False) -> tp.Tuple[np.ndarray, utility.RowsType, np.ndarray]:
+    """
+    The same as utility.get_perfect_data, but cached.
+    """
+    return get_feature_cache().get_data(rows, True, regression=regression)
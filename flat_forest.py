@@ -0,0 +1,219 @@
+"""
+Compiles a trained random forest into a handful of flat NumPy arrays so it can score rows without going through
+sklearn. Every tree's nodes are laid end to end in the same arrays (the feature and threshold each node splits on,
+its children, and for leaves the class distribution), and all of the trees are walked at once for every row.
+
+The scores are exactly the ones sklearn gives: the features are compared as float32 like sklearn's trees do, the
+trees' probabilities are added up in the same order, and nothing is validated per call, which is most of sklearn's
+time for a single row. The arrays are saved with model_format, so loading a compiled forest memory maps them.
+"""
+import typing as tp
+
+import numpy as np
+
+import instrumentation
+import utility
+from model_format import save_compact, load_compact
+
+# How many rows are walked through the trees at a time. Small enough that the (row, tree) work arrays stay in cache.
+FLAT_FOREST_CHUNK_SIZE: int = 512
+
+# How many levels are walked between dropping the (row, tree) pairs that have reached a leaf.
+_LEVELS_PER_CHECK: int = 4
+
+_array_names: tp.Tuple[str, ...] = ('features', 'thresholds', 'children', 'leaf_indexes', 'leaf_values', 'roots',
+                                    'classes_')
+
+
+class FlatForest:
+    """
+    A random forest classifier as flat arrays. Has the predict, predict_proba and classes_ of the forest it was
+    compiled from, so it can be used in its place, such as in utility.predict_patterns or
+    IslandWeekData.predict_current_pattern.
+    """
+
+    def __init__(self, features: np.ndarray, thresholds: np.ndarray, children: np.ndarray, leaf_indexes: np.ndarray,
+                 leaf_values: np.ndarray, roots: np.ndarray, classes: np.ndarray, n_features: int, max_depth: int):
+        """
+        Use from_forest to compile a forest rather than making one directly.
+        :param features: The feature every node splits on. 0 for leaves.
+        :param thresholds: The threshold every node splits on. A row goes left if its feature is at most this.
+        :param children: The left then right child of every node, one after the other (so the right child of node i
+        is at 2 * i + 1). Leaves are their own children.
+        :param leaf_indexes: The row of leaf_values of every leaf, -1 for the other nodes.
+        :param leaf_values: The class probabilities of every leaf.
+        :param roots: The root node of every tree.
+        :param classes: The labels of the classes, in the order of the probabilities.
+        :param n_features: How many features the forest was trained with.
+        :param max_depth: The depth of the deepest tree.
+        """
+        self.features: np.ndarray = features
+        self.thresholds: np.ndarray = thresholds
+        self.children: np.ndarray = children
+        self.leaf_indexes: np.ndarray = leaf_indexes
+        self.leaf_values: np.ndarray = leaf_values
+        self.roots: np.ndarray = roots
+        self.classes_: np.ndarray = classes
+        self.n_features_in_: int = n_features
+        self.max_depth: int = max_depth
+
+    @classmethod
+    def from_forest(cls, forest) -> 'FlatForest':
+        """
+        Compiles a trained forest.
+        :param forest: A fitted RandomForestClassifier (or ExtraTreesClassifier) with a single output, such as the ones
+        from classifiers.get_random_forest_classifier.
+        """
+        if not hasattr(forest, 'estimators_'):
+            raise ValueError('The forest has to be trained before it can be compiled.')
+        if forest.n_outputs_ != 1:
+            raise ValueError('Only forests with a single output can be compiled.')
+
+        trees = [estimator.tree_ for estimator in forest.estimators_]
+        n_nodes: np.ndarray = np.array([tree.node_count for tree in trees], dtype=np.int64)
+        roots: np.ndarray = np.concatenate([[0], np.cumsum(n_nodes)[:-1]])
+        n_classes: int = len(forest.classes_)
+
+        features: tp.List[np.ndarray] = []
+        thresholds: tp.List[np.ndarray] = []
+        children: tp.List[np.ndarray] = []
+        leaf_indexes: tp.List[np.ndarray] = []
+        leaf_values: tp.List[np.ndarray] = []
+        n_leaves: int = 0
+        for tree, root in zip(trees, roots):
+            nodes: np.ndarray = np.arange(tree.node_count) + root
+            is_leaf: np.ndarray = tree.children_left < 0
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(np.where(is_leaf, 0.0, tree.threshold))
+            children.append(np.column_stack([np.where(is_leaf, nodes, tree.children_left + root),
+                                             np.where(is_leaf, nodes, tree.children_right + root)]).ravel())
+            leaf_index: np.ndarray = np.full(tree.node_count, -1, dtype=np.int64)
+            leaf_index[is_leaf] = np.arange(n_leaves, n_leaves + is_leaf.sum())
+            leaf_indexes.append(leaf_index)
+            n_leaves += int(is_leaf.sum())
+
+            # Newer versions of sklearn keep the class fractions in the tree, which predict_proba gives back as is.
+            # Older ones keep the counts, which predict_proba normalizes like this, so the values are identical.
+            values: np.ndarray = tree.value[is_leaf, 0, :n_classes].astype(np.float64)
+            normalizer: np.ndarray = values.sum(axis=1)[:, np.newaxis]
+            if not np.allclose(normalizer, 1.0):
+                normalizer[normalizer == 0.0] = 1.0
+                values = values / normalizer
+            leaf_values.append(values)
+
+        # sklearn compares the float32 features to float64 thresholds. A float32 is at most a threshold exactly when
+        # it's at most the largest float32 that is, so the thresholds are rounded down to that to halve their size.
+        thresholds_64: np.ndarray = np.concatenate(thresholds)
+        thresholds_32: np.ndarray = thresholds_64.astype(np.float32)
+        thresholds_32 = np.where(thresholds_32 > thresholds_64, np.nextafter(thresholds_32, np.float32(-np.inf)),
+                                 thresholds_32)
+
+        index_dtype = np.int32 if 2 * n_nodes.sum() < np.iinfo(np.int32).max else np.int64
+        feature_dtype = np.int16 if forest.n_features_in_ < np.iinfo(np.int16).max else np.int32
+        return cls(np.concatenate(features).astype(feature_dtype), thresholds_32,
+                   np.concatenate(children).astype(index_dtype), np.concatenate(leaf_indexes).astype(index_dtype),
+                   np.concatenate(leaf_values), roots.astype(index_dtype), np.array(forest.classes_),
+                   int(forest.n_features_in_), max(tree.max_depth for tree in trees))
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        :return: How much memory the arrays of the forest take up.
+        """
+        return sum(getattr(self, name).nbytes for name in _array_names)
+
+    def apply(self, x: np.ndarray) -> np.ndarray:
+        """
+        :param x: Feature matrix of shape (n_rows, n_features), or a single row.
+        :return: Matrix of shape (n_rows, n_trees) with the row of leaf_values every row ends up at in every tree.
+        """
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        if x.ndim == 1:
+            x = x.reshape(1, -1)
+        n_pairs: int = x.shape[0] * self.n_trees
+        flat_x: np.ndarray = x.ravel()
+        # Walks every (row, tree) pair down one level at a time. Leaves are their own children, so pairs can keep
+        # walking after reaching one, and every few levels the pairs that have are set aside if there are enough.
+        nodes: np.ndarray = np.tile(self.roots, x.shape[0])
+        row_starts: np.ndarray = np.repeat(np.arange(0, x.size, x.shape[1], dtype=nodes.dtype), self.n_trees)
+        pairs: tp.Union[None, np.ndarray] = None
+        leaf_indexes: np.ndarray = np.empty(n_pairs, dtype=self.leaf_indexes.dtype)
+        for depth in range(0, self.max_depth, _LEVELS_PER_CHECK):
+            for _ in range(min(_LEVELS_PER_CHECK, self.max_depth - depth)):
+                goes_right: np.ndarray = flat_x.take(row_starts + self.features.take(nodes)) > \
+                    self.thresholds.take(nodes)
+                nodes = self.children.take(2 * nodes + goes_right)
+            leaf_index: np.ndarray = self.leaf_indexes.take(nodes)
+            is_leaf: np.ndarray = leaf_index >= 0
+            if 2 * np.count_nonzero(is_leaf) >= len(nodes):
+                if pairs is None:
+                    pairs = np.arange(n_pairs)
+                leaf_indexes[pairs[is_leaf]] = leaf_index[is_leaf]
+                is_walking: np.ndarray = ~is_leaf
+                pairs, nodes, row_starts = pairs[is_walking], nodes[is_walking], row_starts[is_walking]
+                if len(nodes) == 0:
+                    break
+        if pairs is None:
+            return self.leaf_indexes.take(nodes).reshape(x.shape[0], self.n_trees)
+        leaf_indexes[pairs] = self.leaf_indexes.take(nodes)
+        return leaf_indexes.reshape(x.shape[0], self.n_trees)
+
+    def _predict_proba_chunk(self, x: np.ndarray) -> np.ndarray:
+        # Summing over the first axis adds the trees' probabilities one tree after another, in the same order as
+        # sklearn, so the sums come out exactly the same.
+        return self.leaf_values.take(self.apply(x).T, axis=0).sum(axis=0) / self.n_trees
+
+    def predict_proba(self, x: np.ndarray, chunk_size: int = FLAT_FOREST_CHUNK_SIZE) -> np.ndarray:
+        """
+        :param x: Feature matrix of shape (n_rows, n_features), or a single row. It isn't checked, so it must not have
+        any NaNs.
+        :param chunk_size: How many rows are walked through the trees at a time.
+        :return: The class probabilities of every row, ordered like classes_.
+        """
+        if x.ndim == 1:
+            x = x.reshape(1, -1)
+        if x.shape[0] <= chunk_size:
+            return self._predict_proba_chunk(x)
+        return np.vstack([self._predict_proba_chunk(x[start:start + chunk_size])
+                          for start in range(0, x.shape[0], chunk_size)])
+
+    def predict(self, x: np.ndarray) -> np.ndarray:
+        return self.classes_.take(np.argmax(self.predict_proba(x), axis=1))
+
+    def save(self, file_path: str, metadata: tp.Union[None, tp.Dict[str, tp.Any]] = None) -> str:
+        """
+        Saves the forest in the compact format of model_format.
+        """
+        return save_compact(self, file_path, metadata=metadata)
+
+
+def load_flat_forest(file_path: str, use_mmap: bool = True) -> FlatForest:
+    """
+    Loads a forest saved with FlatForest.save. With use_mmap, the arrays are read from the file as they're needed.
+    """
+    forest, _ = load_compact(file_path, use_mmap=use_mmap)
+    if not isinstance(forest, FlatForest):
+        raise ValueError(f'{file_path} is not a compiled forest.')
+    return forest
+
+
+@instrumentation.timed()
+def compile_saved_model(filename: str) -> tp.Tuple[str, str]:
+    """
+    Compiles a random forest from the models directory and saves it next to it as a Flat model (Flat Random Forest
+    for a Random Forest), with the same hyperparameters and score in the model registry.
+    :param filename: The filename of the forest in the models directory.
+    :return: A tuple of the path to the compiled model and its filename.
+    """
+    registry = utility.get_registry()
+    record = next((r for r in registry.records() if r.filename == filename), None)
+    if record is None:
+        raise FileNotFoundError(f'{filename} is not in the model registry.')
+    flat_forest: FlatForest = FlatForest.from_forest(registry.load(filename, use_cache=False))
+    return utility.save_model(f'Flat{record.name}', flat_forest, params=record.params, score=record.score,
+                              min_num_prices=record.min_num_prices, compact=True)
+
@@ -0,0 +1,226 @@
+"""
+Forecaster built on how the game itself generates turnip prices. Each of the four patterns is enumerated into every
+one of its parameterizations (the lengths of its phases or where its spike starts), and each parameterization is
+turned into the range of rates every half-day's price can be drawn from. Every island-week's known prices are then
+scored against every parameterization at once, giving the posterior of each pattern (using the previous pattern's
+transition probabilities as the prior) and the smallest and largest price still possible for each half-day.
+
+The rates within a decreasing phase are correlated in the game (each is the last one minus a small random amount).
+Here each step only gets the widest range it could have, so the ranges are never too narrow, just a little loose.
+
+The game's generation was reverse engineered by Ninji: https://gist.github.com/Treeki/85be14d297c80c8b3c0a76375743325b
+"""
+import math
+import typing as tp
+
+import numpy as np
+
+from island_week_data import IslandWeekBatch, TurnipPattern, N_PRICES
+
+# The order of the pattern columns in the posterior.
+FORECAST_PATTERNS: tp.List[TurnipPattern] = [TurnipPattern.DECREASING, TurnipPattern.RANDOM,
+                                              TurnipPattern.HIGH_SPIKE, TurnipPattern.SMALL_SPIKE]
+FORECAST_PATTERN_CODES: np.ndarray = np.asarray([p.value[1] for p in FORECAST_PATTERNS])
+
+# The chance of each pattern (columns) given last week's pattern (rows), both in the order of FORECAST_PATTERNS.
+TRANSITION_PROBABILITIES: np.ndarray = np.asarray([
+    [0.05, 0.25, 0.45, 0.25],
+    [0.15, 0.20, 0.30, 0.35],
+    [0.20, 0.50, 0.05, 0.25],
+    [0.15, 0.45, 0.25, 0.15],
+])
+
+
+def _stationary_distribution(transitions: np.ndarray) -> np.ndarray:
+    eigenvalues, eigenvectors = np.linalg.eig(transitions.T)
+    stationary: np.ndarray = np.real(eigenvectors[:, np.argmin(np.abs(eigenvalues - 1))])
+    return stationary / stationary.sum()
+
+
+# The prior used when last week's pattern isn't known.
+STATIONARY_PROBABILITIES: np.ndarray = _stationary_distribution(TRANSITION_PROBABILITIES)
+
+
+class _Phase(tp.NamedTuple):
+    """
+    Some half-days of a pattern. Decreasing phases start at a rate in [low, high] and drop by
+    [min_step, max_step] every half-day, the other phases draw every rate from [low, high].
+    """
+    length: int
+    low: float
+    high: float
+    min_step: float = 0.0
+    max_step: float = 0.0
+    offset: int = 0
+
+
+def _high(length: int) -> _Phase:
+    return _Phase(length, 0.9, 1.4)
+
+
+def _decreasing(length: int, low: float, high: float, min_step: float = 0.03, max_step: float = 0.05) -> _Phase:
+    return _Phase(length, low, high, min_step, max_step)
+
+
+def _random_parameterizations() -> tp.Iterator[tp.Tuple[float, tp.List[_Phase]]]:
+    for decreasing_length_1 in [2, 3]:
+        for high_length_1 in range(7):
+            for high_length_3 in range(7 - high_length_1):
+                yield 1 / 2 * 1 / 7 * 1 / (7 - high_length_1), [
+                    _high(high_length_1),
+                    _decreasing(decreasing_length_1, 0.6, 0.8, 0.04, 0.1),
+                    _high(7 - high_length_1 - high_length_3),
+                    _decreasing(5 - decreasing_length_1, 0.6, 0.8, 0.04, 0.1),
+                    _high(high_length_3)]
+
+
+def _high_spike_parameterizations() -> tp.Iterator[tp.Tuple[float, tp.List[_Phase]]]:
+    for spike_start in range(1, 8):
+        yield 1 / 7, [_decreasing(spike_start, 0.85, 0.9),
+                      _Phase(1, 0.9, 1.4), _Phase(1, 1.4, 2.0), _Phase(1, 2.0, 6.0), _Phase(1, 1.4, 2.0),
+                      _Phase(1, 0.9, 1.4),
+                      _Phase(N_PRICES - spike_start - 5, 0.4, 0.9)]
+
+
+def _decreasing_parameterizations() -> tp.Iterator[tp.Tuple[float, tp.List[_Phase]]]:
+    yield 1.0, [_decreasing(N_PRICES, 0.85, 0.9)]
+
+
+def _small_spike_parameterizations() -> tp.Iterator[tp.Tuple[float, tp.List[_Phase]]]:
+    for spike_start in range(8):
+        yield 1 / 8, [_decreasing(spike_start, 0.4, 0.9),
+                      _high(2),
+                      # The half-days around the peak are drawn between 1.4 and the peak's rate, minus a bell.
+                      _Phase(1, 1.4, 2.0, offset=1), _Phase(1, 1.4, 2.0), _Phase(1, 1.4, 2.0, offset=1),
+                      _decreasing(N_PRICES - spike_start - 5, 0.4, 0.9)]
+
+
+class _PatternTables(tp.NamedTuple):
+    low_rates: np.ndarray
+    high_rates: np.ndarray
+    offsets: np.ndarray
+    pattern_indexes: np.ndarray
+    log_priors: np.ndarray
+
+
+def build_pattern_tables() -> _PatternTables:
+    """
+    Enumerates every parameterization of every pattern into tables of shape (n_parameterizations, 12) with the
+    lowest rate, highest rate, and the offset subtracted from the price of every half-day.
+    """
+    generators = [_decreasing_parameterizations, _random_parameterizations, _high_spike_parameterizations,
+                  _small_spike_parameterizations]
+    low_rates, high_rates, offsets, pattern_indexes, log_priors = [], [], [], [], []
+    for pattern_index, generator in enumerate(generators):
+        for probability, phases in generator():
+            lows, highs, phase_offsets = [], [], []
+            for phase in phases:
+                for step in range(phase.length):
+                    lows.append(max(phase.low - phase.max_step * step, 0.0))
+                    highs.append(phase.high - phase.min_step * step)
+                    phase_offsets.append(phase.offset)
+            assert len(lows) == N_PRICES
+            low_rates.append(lows)
+            high_rates.append(highs)
+            offsets.append(phase_offsets)
+            pattern_indexes.append(pattern_index)
+            log_priors.append(math.log(probability))
+    return _PatternTables(np.asarray(low_rates), np.asarray(high_rates), np.asarray(offsets),
+                          np.asarray(pattern_indexes), np.asarray(log_priors))
+
+
+PATTERN_TABLES: _PatternTables = build_pattern_tables()
+
+
+class Forecast(tp.NamedTuple):
+    posterior: np.ndarray
+    """Probability of each pattern, shape (n_rows, 4), columns ordered like FORECAST_PATTERNS."""
+    pattern_codes: np.ndarray
+    """The code of the most likely pattern of each row."""
+    min_prices: np.ndarray
+    """The smallest possible price of each half-day, shape (n_rows, 12). Known prices are their own bounds."""
+    max_prices: np.ndarray
+    """The largest possible price of each half-day, shape (n_rows, 12)."""
+    is_consistent: np.ndarray
+    """Whether the known prices of the row fit at least one parameterization exactly (False usually means a typo)."""
+
+    @property
+    def patterns(self) -> tp.List[TurnipPattern]:
+        return [TurnipPattern.from_code(code) for code in self.pattern_codes]
+
+
+class TurnipForecaster:
+    def __init__(self, chunk_size: int = 2048, outlier_likelihood: float = 1e-6, min_weight: float = 1e-4):
+        """
+        :param chunk_size: The number of rows scored at once. Memory use is about chunk_size * 900 floats.
+        :param outlier_likelihood: The likelihood given to a price outside of a parameterization's range, so that a single typo doesn't rule out the real pattern.
+        :param min_weight: Parameterizations with less than this fraction of a row's posterior don't count towards its price bounds.
+        """
+        self.chunk_size: int = chunk_size
+        self.outlier_likelihood: float = outlier_likelihood
+        self.min_weight: float = min_weight
+        self.tables: _PatternTables = PATTERN_TABLES
+        self._pattern_one_hot: np.ndarray = np.eye(len(FORECAST_PATTERNS))[self.tables.pattern_indexes]
+
+    def get_log_priors(self, previous_pattern_codes: np.ndarray) -> np.ndarray:
+        """
+        :return: The log prior of every parameterization for every row, shape (n_rows, n_parameterizations).
+        """
+        previous_indexes: np.ndarray = np.searchsorted(FORECAST_PATTERN_CODES, previous_pattern_codes)
+        is_known: np.ndarray = np.isin(previous_pattern_codes, FORECAST_PATTERN_CODES)
+        pattern_priors: np.ndarray = np.where(is_known.reshape(-1, 1),
+                                              TRANSITION_PROBABILITIES[np.clip(previous_indexes, 0, 3)],
+                                              STATIONARY_PROBABILITIES.reshape(1, -1))
+        return np.log(pattern_priors[:, self.tables.pattern_indexes]) + self.tables.log_priors.reshape(1, -1)
+
+    def _forecast_chunk(self, prices: np.ndarray, base_prices: np.ndarray,
+                        previous_pattern_codes: np.ndarray) -> tp.Tuple[np.ndarray, ...]:
+        base: np.ndarray = base_prices.astype(float).reshape(-1, 1, 1)
+        # Shapes are (n_rows, n_parameterizations, 12).
+        low_prices: np.ndarray = np.ceil(self.tables.low_rates * base - 1e-9) - self.tables.offsets
+        high_prices: np.ndarray = np.ceil(self.tables.high_rates * base - 1e-9) - self.tables.offsets
+        known: np.ndarray = (prices != 0)[:, np.newaxis, :]
+        observed: np.ndarray = prices[:, np.newaxis, :]
+
+        in_range: np.ndarray = (observed >= low_prices) & (observed <= high_prices)
+        likelihoods: np.ndarray = np.where(in_range, 1.0 / (high_prices - low_prices + 1), 0.0) + \
+            self.outlier_likelihood
+        log_likelihoods: np.ndarray = np.where(known, np.log(likelihoods), 0.0).sum(axis=2)
+        is_exact: np.ndarray = (in_range | ~known).all(axis=2)
+
+        log_weights: np.ndarray = log_likelihoods + self.get_log_priors(previous_pattern_codes)
+        weights: np.ndarray = np.exp(log_weights - log_weights.max(axis=1, keepdims=True))
+        weights /= weights.sum(axis=1, keepdims=True)
+        posterior: np.ndarray = weights @ self._pattern_one_hot
+
+        counts: np.ndarray = (weights >= self.min_weight)[:, :, np.newaxis]
+        min_prices: np.ndarray = np.where(counts, low_prices, np.inf).min(axis=1)
+        max_prices: np.ndarray = np.where(counts, high_prices, -np.inf).max(axis=1)
+        min_prices = np.where(prices != 0, prices, min_prices)
+        max_prices = np.where(prices != 0, prices, max_prices)
+        return posterior, min_prices.astype(np.int32), max_prices.astype(np.int32), is_exact.any(axis=1)
+
+    def forecast(self, rows) -> Forecast:
+        """
+        Scores every row against every parameterization of every pattern.
+        :param rows: A list of IslandWeekData or an IslandWeekBatch.
+        :return: The forecast of every row.
+        """
+        batch: IslandWeekBatch = rows if isinstance(rows, IslandWeekBatch) else IslandWeekBatch.from_rows(rows)
+        chunks = [self._forecast_chunk(batch.prices[start:start + self.chunk_size],
+                                       batch.purchase_prices[start:start + self.chunk_size],
+                                       batch.previous_pattern_codes[start:start + self.chunk_size])
+                  for start in range(0, len(batch), self.chunk_size)]
+        if not chunks:
+            empty: np.ndarray = np.zeros((0, N_PRICES), dtype=np.int32)
+            return Forecast(np.zeros((0, len(FORECAST_PATTERNS))), np.zeros(0, dtype=int), empty, empty,
+                            np.zeros(0, dtype=bool))
+        posterior, min_prices, max_prices, is_consistent = [np.concatenate(parts) for parts in zip(*chunks)]
+        return Forecast(posterior, FORECAST_PATTERN_CODES[posterior.argmax(axis=1)], min_prices, max_prices,
+                        is_consistent)
+
+    def predict_proba(self, rows) -> np.ndarray:
+        return self.forecast(rows).posterior
+
+    def predict(self, rows) -> np.ndarray:
+        return self.forecast(rows).pattern_codes
@@ -7,14 +7,17 @@ import os.path
 import pickle
 import typing as tp
 
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-
-# Only perform read only operations on the spreadsheet.
+import instrumentation
 import utility
-from constants import *
-from island_week_data import IslandWeekData, TurnipPattern
+from bulk_parser import parse_values_bulk
+# Only perform read only operations on the spreadsheet.
+from constants import SCOPES, MADDOX_KNIGHT_SPREADSHEET_ID, MADDOX_KNIGHT_CELL_RANGE, PERSONAL_SPREADSHEET_ID, \
+    PERSONAL_CELL_RANGE, SNAPSHOT_FILEPATH
+from island_week_data import IslandWeekData, TurnipPattern, IslandWeekBatch
+from snapshot import SheetSnapshot, range_from_row, is_separator_row
+
+# Bump whenever parsing changes so that parsed snapshots get reparsed from their raw values.
+PARSER_VERSION: int = 2
 
 
 def get_api_key(filepath: str) -> str:
@@ -22,6 +25,7 @@ def get_api_key(filepath: str) -> str:
         return f.readline().strip()
 
 
+@instrumentation.timed('sheets.credentials')
 def get_credentials(filepath: str, cached_location: str = 'token.pickle'):
     """
     Gets the credentials at the provided location. Reads the cached_location for previous credentials.
@@ -30,6 +34,10 @@ def get_credentials(filepath: str, cached_location: str = 'token.pickle'):
     :param cached_location: The filepath to the pickled file storing previous credentials from previous runs of the application.
     :return: The credentials accepted by the Google API Service.
     """
+    # The Google libraries are slow to import, so they are only imported once they're needed.
+    from google.auth.transport.requests import Request
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
     # A lot of this code is from https://developers.google.com/sheets/api/quickstart/python
     credentials = None
     # The file token.pickle stores the user's access and refresh tokens, and is
@@ -52,12 +60,58 @@ def get_credentials(filepath: str, cached_location: str = 'token.pickle'):
     return credentials
 
 
-def get_raw_data(service, get_community_data: bool = True) -> tp.List:
-    sheet = service.spreadsheets()
+def get_sheet_location(get_community_data: bool = True) -> tp.Tuple[str, str]:
     spreadsheet_id: str = MADDOX_KNIGHT_SPREADSHEET_ID if get_community_data else PERSONAL_SPREADSHEET_ID
     cell_range: str = MADDOX_KNIGHT_CELL_RANGE if get_community_data else PERSONAL_CELL_RANGE
-    result = sheet.values().get(spreadsheetId=spreadsheet_id, range=cell_range).execute()
-    return result.get('values', [])
+    return spreadsheet_id, cell_range
+
+
+def get_raw_data(service, get_community_data: bool = True, start_row: int = 1) -> tp.List:
+    """
+    Downloads the raw cell values of one of the spreadsheets.
+    :param service: The Google Sheets API service (or a snapshot.FakeSheetsService).
+    :param get_community_data: If true (default) gets the community spreadsheet, gets the personal one otherwise.
+    :param start_row: The first (1-based) row of the sheet to get. Default is 1, the entire sheet.
+    :return: The rows of cell values.
+    """
+    sheet = service.spreadsheets()
+    spreadsheet_id, cell_range = get_sheet_location(get_community_data)
+    with instrumentation.span('sheets.fetch', start_row=start_row):
+        result = sheet.values().get(spreadsheetId=spreadsheet_id, range=range_from_row(cell_range, start_row)).execute()
+    values: tp.List = result.get('values', [])
+    instrumentation.count('sheet rows downloaded', len(values))
+    return values
+
+
+def iter_raw_data(service, get_community_data: bool = True, start_row: int = 1,
+                  rows_per_request: int = 50000) -> tp.Iterator[tp.List[str]]:
+    """
+    Downloads the raw cell values of one of the spreadsheets a block of rows at a time, so that the whole sheet
+    doesn't have to be held in memory. Goes well with bulk_parser.iter_parse_chunks.
+    :param service: The Google Sheets API service (or a snapshot.FakeSheetsService).
+    :param get_community_data: If true (default) gets the community spreadsheet, gets the personal one otherwise.
+    :param start_row: The first (1-based) row of the sheet to get.
+    :param rows_per_request: The number of rows to ask for in each request.
+    :return: A generator of the rows of cell values.
+    """
+    sheet = service.spreadsheets()
+    spreadsheet_id, cell_range = get_sheet_location(get_community_data)
+    # The API leaves out empty rows at the end of a block, which would lose week separators between blocks.
+    # The missing rows are only given back once the next block shows that the sheet keeps going. An entirely empty
+    # block looks the same as the end of the sheet, so a run of empty rows as long as a block ends the download.
+    n_missing_rows: int = 0
+    while True:
+        block_range: str = range_from_row(cell_range, start_row, start_row + rows_per_request - 1)
+        with instrumentation.span('sheets.fetch', start_row=start_row):
+            block: tp.List[tp.List[str]] = sheet.values().get(spreadsheetId=spreadsheet_id,
+                                                              range=block_range).execute().get('values', [])
+        instrumentation.count('sheet rows downloaded', len(block))
+        if not block:
+            return
+        yield from [[] for _ in range(n_missing_rows)]
+        yield from block
+        n_missing_rows = rows_per_request - len(block)
+        start_row += rows_per_request
 
 
 def parse_community_row(row: tp.List[str], week_number: int, quiet: bool = True) -> tp.Union[None, IslandWeekData]:
@@ -131,9 +185,28 @@ def parse_personal_row(row: tp.List[str], week_number: int, quiet: bool = True)
 def parse_row(row: tp.List[str], week_number: int, quiet: bool = True,
               is_community_data: bool = True) -> tp.Union[None, IslandWeekData]:
     if is_community_data:
-        return parse_community_row(row, week_number, quiet=quiet)
+        parsed: tp.Union[None, IslandWeekData] = parse_community_row(row, week_number, quiet=quiet)
     else:
-        return parse_personal_row(row, week_number, quiet=quiet)
+        parsed = parse_personal_row(row, week_number, quiet=quiet)
+    instrumentation.count('rows parsed' if parsed is not None else 'rows rejected')
+    return parsed
+
+
+@instrumentation.timed()
+def parse_values(values: tp.List[tp.List[str]], get_community_data: bool = True, quiet: bool = True,
+                 start_week: int = 0) -> IslandWeekBatch:
+    """
+    Parses the raw cell values of one of the spreadsheets.
+    :param values: The rows of cell values.
+    :param get_community_data: Whether the values are from the community spreadsheet or the personal one.
+    :param quiet: If false, prints a report of the rows that could not be parsed.
+    :param start_week: The week number of the first row in values.
+    :return: The rows that could be parsed.
+    """
+    batch, report = parse_values_bulk(values, is_community_data=get_community_data, start_week=start_week)
+    if not quiet:
+        print(report)
+    return batch
 
 
 def get_data(service, get_community_data=True, quiet: bool = True):
@@ -141,26 +214,80 @@ def get_data(service, get_community_data=True, quiet: bool = True):
 
     if not output:
         print('No community data found.')
-        return []
+        return IslandWeekBatch.empty()
 
-    structured_data: tp.List[IslandWeekData] = []
-    week_num: int = 0
+    return parse_values(output, get_community_data=get_community_data, quiet=quiet)
 
-    for row in output:
-        if all([len(cell) < 1 for cell in row]):
-            week_num += 1
-        else:
-            parsed_row: tp.Union[None, IslandWeekData] = parse_row(row, week_num, is_community_data=get_community_data,
-                                                                   quiet=quiet)
-            if parsed_row:
-                structured_data.append(parsed_row)
-    return structured_data
 
+@instrumentation.timed()
+def get_snapshot_data(service, get_community_data: bool = True, quiet: bool = True,
+                      snapshot_dir: str = SNAPSHOT_FILEPATH, full_refresh: bool = False) -> IslandWeekBatch:
+    """
+    Gets the parsed data of one of the spreadsheets through its local snapshot.
+    Only the rows from the last (possibly unfinished) week of the snapshot onwards are downloaded and parsed,
+    everything before it is reused from the snapshot.
+    :param service: The Google Sheets API service. If None, the snapshot is used as is without going online.
+    :param get_community_data: If true (default) gets the community spreadsheet, gets the personal one otherwise.
+    :param quiet: If false, prints the rows that could not be parsed.
+    :param snapshot_dir: The directory the snapshots are kept in.
+    :param full_refresh: If true, downloads and parses the entire spreadsheet again.
+    :return: The parsed rows of the spreadsheet.
+    """
+    snapshot: SheetSnapshot = SheetSnapshot(*get_sheet_location(get_community_data), snapshot_dir=snapshot_dir)
+    has_snapshot: bool = snapshot.has_values() and not full_refresh
+
+    if service is None:
+        if not has_snapshot:
+            raise FileNotFoundError(f'There is no snapshot at {snapshot.values_path} to work offline from.')
+        cached_batch: tp.Union[None, IslandWeekBatch] = snapshot.load_batch(PARSER_VERSION)
+        if cached_batch is None:
+            cached_batch = parse_values(snapshot.load_values(), get_community_data, quiet)
+            snapshot.save_batch(cached_batch, PARSER_VERSION)
+        return cached_batch
+
+    cached_values: tp.List[tp.List[str]] = snapshot.load_values() if has_snapshot else []
+    separators: tp.List[int] = [i for i, row in enumerate(cached_values) if is_separator_row(row)]
+    # Everything up to and including the last separator is a finished week, the rest gets downloaded again.
+    n_kept_rows: int = separators[-1] + 1 if separators else 0
+    start_week: int = len(separators)
+
+    kept_batch: tp.Union[None, IslandWeekBatch] = snapshot.load_batch(PARSER_VERSION) if n_kept_rows > 0 else None
+    if kept_batch is None:
+        kept_batch = parse_values(cached_values[:n_kept_rows], get_community_data, quiet)
+    else:
+        kept_batch = kept_batch[kept_batch.week_nums < start_week]
+
+    new_values: tp.List[tp.List[str]] = get_raw_data(service, get_community_data=get_community_data,
+                                                     start_row=n_kept_rows + 1)
+    new_batch: IslandWeekBatch = parse_values(new_values, get_community_data, quiet, start_week=start_week)
+
+    batch: IslandWeekBatch = kept_batch + new_batch
+    snapshot.save_values(cached_values[:n_kept_rows] + new_values)
+    snapshot.save_batch(batch, PARSER_VERSION)
+    return batch
+
+
+@instrumentation.timed()
+def get_structured_data(offline: bool = False, use_snapshot: bool = True, full_refresh: bool = False):
+    """
+    Gets the parsed data from both the community spreadsheet and the personal one.
+    :param offline: If true, only the local snapshots are used and nothing is downloaded.
+    :param use_snapshot: If true (default), goes through the local snapshots and only downloads new weeks.
+    :param full_refresh: If true, the snapshots are downloaded and parsed again from scratch.
+    :return: The parsed rows of both spreadsheets as an IslandWeekBatch. It can be iterated, indexed, and added to
+    lists like the list of IslandWeekData this used to return; use its to_rows() for an actual list.
+    """
+    if offline:
+        return get_snapshot_data(None) + get_snapshot_data(None, get_community_data=False)
+
+    from googleapiclient.discovery import build
 
-def get_structured_data():
     credentials = get_credentials('resources/credentials.json')
     service = build('sheets', 'v4', credentials=credentials)
 
+    if use_snapshot:
+        return get_snapshot_data(service, full_refresh=full_refresh) + \
+               get_snapshot_data(service, get_community_data=False, full_refresh=full_refresh)
     return get_data(service) + get_data(service, get_community_data=False)
 
 
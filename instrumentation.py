@@ -0,0 +1,313 @@
+"""
+Timers, counters and peak memory for the stages of the pipeline, turned on by setting the ACNH_TRACE environment
+variable before running (ACNH_TRACE=1, or ACNH_TRACE=path/to/trace.json to choose where the trace goes).
+
+When it's off, timed gives back the function it decorates untouched and span, count and add_counter_source do
+nothing, so the instrumented code runs as if it wasn't. When it's on, every span is recorded in the Chrome trace
+format, which chrome://tracing, Perfetto and speedscope show as a flame graph, and the trace is written out when
+the program exits. `python instrumentation.py <trace file>` prints how long each stage took.
+
+Every span records the most memory that was allocated at once while it ran, over what was allocated when it started,
+using tracemalloc (which is only started when tracing is on, and makes allocations slower). tracemalloc counts the
+whole process, so the peak of a span includes what other threads allocated while it ran: the peaks are only the
+span's own for spans that run while no other thread is allocating. Python 3.8 can't reset tracemalloc's peak, so there
+a span only gets a peak if it raised the highest peak of the process so far.
+
+Counters and spans are only kept per process, so workers of a process pool aren't included.
+"""
+import atexit
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import typing as tp
+import weakref
+
+from constants import RESULTS_SAVE_PATH
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where peak memory just isn't recorded.
+    resource = None
+
+TRACE_ENV_VAR: str = 'ACNH_TRACE'
+DEFAULT_TRACE_FILEPATH: str = os.path.join(RESULTS_SAVE_PATH, 'trace.json')
+
+_trace_setting: str = os.environ.get(TRACE_ENV_VAR, '').strip()
+ENABLED: bool = _trace_setting.lower() not in {'', '0', 'false', 'no', 'off'}
+TRACE_FILEPATH: str = _trace_setting if ENABLED and _trace_setting.lower().endswith('.json') else \
+    DEFAULT_TRACE_FILEPATH
+
+_null_span: contextlib.nullcontext = contextlib.nullcontext()
+
+
+def get_peak_memory_mb() -> tp.Union[None, float]:
+    """
+    :return: The most memory (resident set size) the process has used so far in megabytes, or None if unknown.
+    """
+    if resource is None:
+        return None
+    peak: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes.
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+# tracemalloc.reset_peak was added in Python 3.9.
+_can_reset_peak: bool = hasattr(tracemalloc, 'reset_peak')
+
+
+class _MemoryPeak:
+    """
+    The allocations of a span that is still running: how much was allocated when it started, and the most that has
+    been allocated at once since (or, without reset_peak, the highest peak of the process when it started).
+    """
+    __slots__ = ('start', 'peak')
+
+    def __init__(self, start: int, peak: int):
+        self.start: int = start
+        self.peak: int = peak
+
+
+class Tracer:
+    """
+    Records spans and counters. Safe to use from multiple threads.
+    """
+
+    def __init__(self):
+        self.events: tp.List[tp.Dict[str, tp.Any]] = []
+        self.counters: tp.Dict[str, float] = {}
+        # Weak references, so that adding a counter source doesn't keep its object alive.
+        self.counter_sources: tp.List[weakref.ref] = []
+        self._lock: threading.Lock = threading.Lock()
+        # The spans of every thread that are still running.
+        self._memory_peaks: tp.List[_MemoryPeak] = []
+        self._start: float = time.perf_counter()
+
+    def now_us(self) -> float:
+        return (time.perf_counter() - self._start) * 1e6
+
+    def add_span(self, name: str, start_us: float, end_us: float, args: tp.Dict[str, tp.Any]):
+        event: tp.Dict[str, tp.Any] = {'name': name, 'ph': 'X', 'ts': start_us, 'dur': end_us - start_us,
+                                       'pid': os.getpid(), 'tid': threading.get_ident(), 'args': args}
+        with self._lock:
+            self.events.append(event)
+
+    def start_memory_peak(self) -> tp.Union[None, _MemoryPeak]:
+        """
+        Starts tracking the peak allocations of a span. tracemalloc only keeps a single peak, so before it's reset the
+        peak so far is handed to every span that is running, in any thread, and each keeps the largest it was given.
+        :return: What end_memory_peak needs, or None if tracemalloc isn't tracing.
+        """
+        if not tracemalloc.is_tracing():
+            return None
+        with self._lock:
+            current, peak = tracemalloc.get_traced_memory()
+            if not _can_reset_peak:
+                return _MemoryPeak(current, peak)
+            self._hand_out_peak(peak)
+            memory_peak: _MemoryPeak = _MemoryPeak(current, current)
+            self._memory_peaks.append(memory_peak)
+            return memory_peak
+
+    def end_memory_peak(self, memory_peak: tp.Union[None, _MemoryPeak]) \
+            -> tp.Tuple[tp.Union[None, float], tp.Union[None, float]]:
+        """
+        :param memory_peak: What start_memory_peak gave back for the span.
+        :return: The peak allocations of the span that is ending over what was allocated when it started, and how
+        much more is allocated than when it started, both in megabytes. The peak is None if it isn't known, and both
+        are None if tracemalloc isn't tracing.
+        """
+        if memory_peak is None or not tracemalloc.is_tracing():
+            return None, None
+        with self._lock:
+            current, peak = tracemalloc.get_traced_memory()
+            if _can_reset_peak:
+                self._hand_out_peak(peak)
+                self._memory_peaks.remove(memory_peak)
+                span_peak: tp.Union[None, int] = memory_peak.peak
+            else:
+                # The peak of the process is only the span's if the span raised it.
+                span_peak = peak if peak > memory_peak.peak else None
+        allocated_mb: float = (current - memory_peak.start) / 1024 ** 2
+        if span_peak is None:
+            return None, allocated_mb
+        return (span_peak - memory_peak.start) / 1024 ** 2, allocated_mb
+
+    def _hand_out_peak(self, peak: int):
+        for memory_peak in self._memory_peaks:
+            memory_peak.peak = max(memory_peak.peak, peak)
+        tracemalloc.reset_peak()
+
+    def add_counter_source(self, source: tp.Callable[[], tp.Dict[str, float]]):
+        reference: weakref.ref = weakref.WeakMethod(source) if hasattr(source, '__self__') else weakref.ref(source)
+        with self._lock:
+            self.counter_sources.append(reference)
+
+    def count(self, name: str, n: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def get_counters(self) -> tp.Dict[str, float]:
+        """
+        :return: The counters, including the ones read from the counter sources.
+        """
+        with self._lock:
+            counters: tp.Dict[str, float] = dict(self.counters)
+            self.counter_sources = [reference for reference in self.counter_sources if reference() is not None]
+            sources: tp.List[tp.Callable[[], tp.Dict[str, float]]] = [reference() for reference in self.counter_sources]
+        for source in sources:
+            if source is None:
+                continue
+            for name, value in source().items():
+                counters[name] = counters.get(name, 0) + value
+        return counters
+
+    def to_chrome_trace(self) -> tp.Dict[str, tp.Any]:
+        counters: tp.Dict[str, float] = self.get_counters()
+        with self._lock:
+            events: tp.List[tp.Dict[str, tp.Any]] = list(self.events)
+        events.append({'name': 'counters', 'ph': 'C', 'ts': self.now_us(), 'pid': os.getpid(), 'args': counters})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms',
+                'otherData': {'counters': counters, 'peak_memory_mb': get_peak_memory_mb(), 'argv': sys.argv}}
+
+    def write(self, filepath: str = TRACE_FILEPATH) -> str:
+        os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+        with open(filepath, 'w') as f:
+            json.dump(self.to_chrome_trace(), f)
+        return filepath
+
+
+class _Span:
+    __slots__ = ('name', 'args', 'start_us', 'memory_peak')
+
+    def __init__(self, name: str, args: tp.Dict[str, tp.Any]):
+        self.name: str = name
+        self.args: tp.Dict[str, tp.Any] = args
+
+    def __enter__(self):
+        self.memory_peak: tp.Union[None, _MemoryPeak] = tracer.start_memory_peak()
+        self.start_us: float = tracer.now_us()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        end_us: float = tracer.now_us()
+        self.args['peak_allocated_mb'], self.args['allocated_mb'] = tracer.end_memory_peak(self.memory_peak)
+        if exc_type is not None:
+            self.args['exception'] = exc_type.__name__
+        tracer.add_span(self.name, self.start_us, end_us, self.args)
+        return False
+
+
+tracer: Tracer = Tracer()
+
+
+def span(name: str, **args):
+    """
+    Times a block of code: `with span('fetch', rows=10): ...`. The args are saved with the span.
+    """
+    return _Span(name, args) if ENABLED else _null_span
+
+
+def timed(name: tp.Union[None, str] = None):
+    """
+    Decorator that times every call of a function as a span, named after the function unless a name is given.
+    Does nothing at all when tracing is off.
+    """
+
+    def decorator(func: tp.Callable) -> tp.Callable:
+        if not ENABLED:
+            return func
+        span_name: str = name or f'{func.__module__}.{func.__qualname__}'
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Span(span_name, {}):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name: str, n: float = 1):
+    """
+    Adds n to the counter of the given name.
+    """
+    if ENABLED:
+        tracer.count(name, n)
+
+
+def add_counter_source(source: tp.Callable[[], tp.Dict[str, float]]):
+    """
+    Adds a function whose counters are read when the trace is written, for things that already count themselves,
+    like the hits of a cache. Only a weak reference to it is kept (to its object, for a method), so it stops being
+    read once nothing else uses it, and a function made just to be a source, like a lambda, is never read.
+    """
+    if ENABLED:
+        tracer.add_counter_source(source)
+
+
+def summarize(events: tp.List[tp.Dict[str, tp.Any]]) -> tp.List[tp.Dict[str, tp.Any]]:
+    """
+    Totals the spans of a trace by name.
+    :param events: The trace events, as in the traceEvents of a written trace.
+    :return: For every name, the number of calls, the total, self (not in any span inside of it) and largest times in seconds, and the most memory allocated by a call. Sorted by total time.
+    """
+    spans: tp.List[tp.Dict[str, tp.Any]] = [e for e in events if e.get('ph') == 'X']
+    self_times: tp.List[float] = [e['dur'] for e in spans]
+    # Spans within the same thread nest, so each one's time is taken out of the self time of the one around it.
+    for tid in {e['tid'] for e in spans}:
+        stack: tp.List[int] = []
+        for i in sorted((i for i, e in enumerate(spans) if e['tid'] == tid),
+                        key=lambda i: (spans[i]['ts'], -spans[i]['dur'])):
+            while stack and spans[stack[-1]]['ts'] + spans[stack[-1]]['dur'] <= spans[i]['ts']:
+                stack.pop()
+            if stack:
+                self_times[stack[-1]] -= spans[i]['dur']
+            stack.append(i)
+
+    stages: tp.Dict[str, tp.Dict[str, tp.Any]] = {}
+    for event, self_time in zip(spans, self_times):
+        stage: tp.Dict[str, tp.Any] = stages.setdefault(event['name'], {'name': event['name'], 'calls': 0,
+                                                                          'total_s': 0.0, 'self_s': 0.0,
+                                                                          'max_s': 0.0, 'peak_allocated_mb': None})
+        stage['calls'] += 1
+        stage['total_s'] += event['dur'] / 1e6
+        stage['self_s'] += self_time / 1e6
+        stage['max_s'] = max(stage['max_s'], event['dur'] / 1e6)
+        peak: tp.Union[None, float] = event.get('args', {}).get('peak_allocated_mb')
+        if peak is not None:
+            stage['peak_allocated_mb'] = max(stage['peak_allocated_mb'] or 0.0, peak)
+    return sorted(stages.values(), key=lambda s: -s['total_s'])
+
+
+def format_summary(trace: tp.Dict[str, tp.Any]) -> str:
+    lines: tp.List[str] = [f'{"stage":<50} {"calls":>7} {"total s":>10} {"self s":>10} {"max s":>10} {"peak MB":>9}']
+    for stage in summarize(trace['traceEvents']):
+        peak: str = f'{stage["peak_allocated_mb"]:9.1f}' if stage['peak_allocated_mb'] is not None else f'{"":>9}'
+        lines.append(f'{stage["name"][-50:]:<50} {stage["calls"]:>7} {stage["total_s"]:10.3f} '
+                     f'{stage["self_s"]:10.3f} {stage["max_s"]:10.3f} {peak}')
+    counters: tp.Dict[str, float] = trace.get('otherData', {}).get('counters', {})
+    if counters:
+        lines.append('')
+        lines.extend(f'{name:<50} {value:>10g}' for name, value in sorted(counters.items()))
+    return '\n'.join(lines)
+
+
+def _write_at_exit():
+    filepath: str = tracer.write()
+    print(f'Wrote the trace to {filepath}', file=sys.stderr)
+
+
+if ENABLED:
+    tracemalloc.start()
+    atexit.register(_write_at_exit)
+
+if __name__ == '__main__':
+    with open(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_TRACE_FILEPATH, 'r') as trace_file:
+        print(format_summary(json.load(trace_file)))
@@ -0,0 +1,168 @@
+"""
+Links every island's weeks together. The owners and island names in the spreadsheets are free text, so they are
+normalized before being used as the key of an island, then every row gets the row of its island's previous week
+through a single hash lookup. From that, missing previous patterns are filled in from the current pattern of the
+week before, and the prices and patterns of earlier weeks are turned into features.
+"""
+import re
+import typing as tp
+
+import numpy as np
+
+import utility
+from island_week_data import IslandWeekBatch, TurnipPattern, NO_PATTERN_CODE, MISSING_PRICE_FEATURE
+
+_not_alphanumeric: re.Pattern = re.compile(r'[^0-9a-z]+')
+
+_populated_codes: tp.List[int] = [TurnipPattern.DECREASING.value[1], TurnipPattern.RANDOM.value[1],
+                                  TurnipPattern.HIGH_SPIKE.value[1], TurnipPattern.SMALL_SPIKE.value[1]]
+
+
+def normalize_name(name: str) -> str:
+    """
+    Normalizes an owner or island name so that the same one written slightly differently ("Bob's Isle " and
+    "bobs isle") still matches.
+    """
+    return _not_alphanumeric.sub('', str(name).casefold())
+
+
+def _normalize_column(column: np.ndarray) -> tp.List[str]:
+    # Names repeat every week, so each distinct one is only normalized once.
+    normalized: tp.Dict[str, str] = {}
+    return [normalized[name] if name in normalized else normalized.setdefault(name, normalize_name(name))
+            for name in column.tolist()]
+
+
+class IslandHistory:
+    """
+    An index of the weeks of every island in a batch. The index keeps (and fills in) the batch it was built from
+    rather than a copy of it.
+    """
+
+    def __init__(self, rows: utility.RowsType):
+        """
+        Builds the index in time linear in the number of rows.
+        :param rows: Either a list of IslandWeekData or an IslandWeekBatch.
+        """
+        self.batch: IslandWeekBatch = utility.as_batch(rows)
+        self.island_keys: tp.Dict[tp.Tuple[str, str], int] = {}
+        self.island_ids: np.ndarray = np.fromiter(
+            (self.island_keys.setdefault(key, len(self.island_keys))
+             for key in zip(_normalize_column(self.batch.owners), _normalize_column(self.batch.island_names))),
+            dtype=np.int64, count=len(self.batch))
+
+        # The parser gives every separator row a week number of its own, so consecutive separators leave gaps in the
+        # week numbers with no rows at all. Weeks are numbered by the week numbers that have rows instead, so the week
+        # before is the last one that has any.
+        week_nums, self.week_indexes = np.unique(self.batch.week_nums, return_inverse=True)
+        self.week_indexes = self.week_indexes.reshape(-1).astype(np.int64)
+        # Packs (island, week) into a single integer so finding the row of any island's week is one dict lookup.
+        self._week_span: int = len(week_nums) + 1
+        week_keys: np.ndarray = self.island_ids * self._week_span + self.week_indexes
+        # If an island shows up more than once in a week, its first row is the one that's used.
+        self._rows_by_week: tp.Dict[int, int] = dict(zip(week_keys[::-1].tolist(),
+                                                         range(len(self.batch) - 1, -1, -1)))
+        self.n_duplicates: int = len(self.batch) - len(self._rows_by_week)
+        self.previous_rows: np.ndarray = np.fromiter((self._rows_by_week.get(key, -1)
+                                                      for key in (week_keys - 1).tolist()),
+                                                     dtype=np.int64, count=len(self.batch))
+
+        # Rows grouped by island and ordered by week, with where each island's rows start.
+        self._order: np.ndarray = np.lexsort((self.batch.week_nums, self.island_ids))
+        self._island_starts: np.ndarray = np.concatenate([[0], np.cumsum(np.bincount(self.island_ids,
+                                                                                     minlength=self.n_islands))])
+
+    def __len__(self) -> int:
+        return len(self.batch)
+
+    @property
+    def n_islands(self) -> int:
+        return len(self.island_keys)
+
+    def get_island_id(self, owner: str, island_name: str = '') -> int:
+        """
+        :return: The id of the island, or -1 if it isn't in the index.
+        """
+        return self.island_keys.get((normalize_name(owner), normalize_name(island_name)), -1)
+
+    def get_island_rows(self, owner: str, island_name: str = '') -> np.ndarray:
+        """
+        :return: The indexes into the batch of every week of the island, ordered by week.
+        """
+        island_id: int = self.get_island_id(owner, island_name)
+        if island_id < 0:
+            return np.zeros(0, dtype=np.int64)
+        return self._order[self._island_starts[island_id]:self._island_starts[island_id + 1]]
+
+    def get_island_history(self, owner: str, island_name: str = '') -> IslandWeekBatch:
+        return self.batch[self.get_island_rows(owner, island_name)]
+
+    def get_lagged_rows(self, lag: int) -> np.ndarray:
+        """
+        :return: The index of the row from lag weeks before every row of the same island, or -1 where there isn't one.
+        """
+        rows: np.ndarray = np.arange(len(self.batch))
+        for _ in range(lag):
+            rows = np.where(rows >= 0, self.previous_rows[rows], -1)
+        return rows
+
+    def backfill_previous_patterns(self) -> int:
+        """
+        Fills in the previous pattern of every row that doesn't have one with the current pattern of the same island's
+        previous week, when that week is in the batch and its pattern is known. Changes the batch in place.
+        :return: The number of rows that were filled in.
+        """
+        previous_codes: np.ndarray = np.where(self.previous_rows >= 0,
+                                              self.batch.current_pattern_codes[self.previous_rows], NO_PATTERN_CODE)
+        to_fill: np.ndarray = ~np.isin(self.batch.previous_pattern_codes, _populated_codes) & \
+            np.isin(previous_codes, _populated_codes)
+        self.batch.previous_pattern_codes[to_fill] = previous_codes[to_fill]
+        return int(to_fill.sum())
+
+    def get_lagged_prices(self, n_lags: int = 1) -> np.ndarray:
+        """
+        :return: Integer array of shape (n_rows, n_lags, 12) with the prices of the island in each of the n_lags weeks before every row (the first being the week right before). 0 means missing, same as in the batch.
+        """
+        lagged: np.ndarray = np.zeros((len(self.batch), n_lags, self.batch.prices.shape[1]),
+                                      dtype=self.batch.prices.dtype)
+        for lag in range(1, n_lags + 1):
+            rows: np.ndarray = self.get_lagged_rows(lag)
+            has_week: np.ndarray = rows >= 0
+            lagged[has_week, lag - 1] = self.batch.prices[rows[has_week]]
+        return lagged
+
+    def get_lagged_patterns(self, n_lags: int = 1) -> np.ndarray:
+        """
+        :return: Integer array of shape (n_rows, n_lags) with the current pattern codes of the island in each of the n_lags weeks before every row. NO_PATTERN_CODE where the week isn't in the batch.
+        """
+        lagged: np.ndarray = np.full((len(self.batch), n_lags), NO_PATTERN_CODE, dtype=np.int64)
+        for lag in range(1, n_lags + 1):
+            rows: np.ndarray = self.get_lagged_rows(lag)
+            has_week: np.ndarray = rows >= 0
+            lagged[has_week, lag - 1] = self.batch.current_pattern_codes[rows[has_week]]
+        return lagged
+
+    def to_numpy_sequence(self, n_lags: int = 1) -> np.ndarray:
+        """
+        Featurizes every row along with the weeks before it.
+        :return: Matrix of shape (n_rows, 12 * (n_lags + 1) + n_lags): the features of to_numpy, the same features for each earlier week (relative to that week's own purchase price), then the pattern code of each earlier week.
+        """
+        features: tp.List[np.ndarray] = [self.batch.to_numpy()]
+        for lag in range(1, n_lags + 1):
+            rows: np.ndarray = self.get_lagged_rows(lag)
+            has_week: np.ndarray = rows >= 0
+            lagged: np.ndarray = np.full(features[0].shape, MISSING_PRICE_FEATURE)
+            lagged[has_week] = self.batch[rows[has_week]].to_numpy()
+            features.append(lagged)
+        features.append(self.get_lagged_patterns(n_lags).astype(float))
+        return np.hstack(features)
+
+
+def backfill_previous_patterns(rows: utility.RowsType) -> IslandWeekBatch:
+    """
+    Fills in the missing previous patterns of the rows from the weeks before them. See IslandHistory.
+    :return: The rows as an IslandWeekBatch with the previous patterns filled in.
+    """
+    history: IslandHistory = IslandHistory(rows)
+    history.backfill_previous_patterns()
+    return history.batch
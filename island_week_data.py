@@ -15,6 +15,39 @@ class TurnipPattern(Enum):
     def __repr__(self):
         return self.value[0]
 
+    @classmethod
+    def from_code(cls, code: int) -> 'TurnipPattern':
+        """
+        Gets the pattern whose numeric code (the second item of its value) is the provided code.
+        :param code: The numeric code of the pattern, such as the ones stored in the label arrays.
+        :return: The TurnipPattern with that code.
+        """
+        return _patterns_by_code[int(code)]
+
+
+_patterns_by_code: tp.Dict[int, TurnipPattern] = {p.value[1]: p for p in TurnipPattern}
+
+# Code used in pattern arrays for a pattern that was never set (None).
+NO_PATTERN_CODE: int = -2
+
+# The number of half-days in a week that turnips can be sold.
+N_PRICES: int = 12
+
+# The value used in place of a missing price when featurizing a week.
+MISSING_PRICE_FEATURE: float = 10 ** -5
+
+
+def pattern_to_code(pattern: tp.Union[None, TurnipPattern]) -> int:
+    return NO_PATTERN_CODE if pattern is None else pattern.value[1]
+
+
+# Codes of the patterns that don't count as populated.
+_unpopulated_codes: tp.FrozenSet[int] = frozenset({TurnipPattern.EMPTY.value[1], TurnipPattern.UNKNOWN.value[1]})
+
+
+def code_to_pattern(code: int) -> tp.Union[None, TurnipPattern]:
+    return None if code == NO_PATTERN_CODE else TurnipPattern.from_code(code)
+
 
 class IslandWeekData:
     """
@@ -54,7 +87,7 @@ class IslandWeekData:
         :param model: The classifier that provides multiple patterns with their confidences.
         :return: The predicted current pattern.
         """
-        self.current_pattern = model.predict(self.to_numpy())[0]
+        self.current_pattern = TurnipPattern.from_code(model.predict(self.to_numpy().reshape(1, -1))[0])
         return self
 
     def get_pattern_modifier(self) -> float:
@@ -80,3 +113,234 @@ class IslandWeekData:
     def has_patterns_populated(self) -> bool:
         return (self.current_pattern not in {TurnipPattern.EMPTY, TurnipPattern.UNKNOWN}) and \
                (self.previous_pattern not in {TurnipPattern.EMPTY, TurnipPattern.UNKNOWN})
+
+
+class IslandWeekRow:
+    """
+    A lightweight view of a single row inside of an IslandWeekBatch. Behaves like an IslandWeekData
+    but reads and writes directly from the batch's arrays.
+    """
+    __slots__ = ('_batch', '_index')
+
+    def __init__(self, batch: 'IslandWeekBatch', index: int):
+        self._batch: IslandWeekBatch = batch
+        self._index: int = index
+
+    @property
+    def owner(self) -> str:
+        return self._batch.owners[self._index]
+
+    @property
+    def island_name(self) -> str:
+        return self._batch.island_names[self._index]
+
+    @property
+    def week_num(self) -> int:
+        return int(self._batch.week_nums[self._index])
+
+    @property
+    def prices(self) -> tp.List[tp.Union[None, int]]:
+        return [int(p) if p else None for p in self._batch.prices[self._index]]
+
+    @property
+    def purchase_price(self) -> int:
+        return int(self._batch.purchase_prices[self._index])
+
+    @property
+    def previous_pattern(self) -> tp.Union[None, TurnipPattern]:
+        return code_to_pattern(self._batch.previous_pattern_codes[self._index])
+
+    @previous_pattern.setter
+    def previous_pattern(self, pattern: tp.Union[None, TurnipPattern]):
+        self._batch.previous_pattern_codes[self._index] = pattern_to_code(pattern)
+
+    @property
+    def current_pattern(self) -> tp.Union[None, TurnipPattern]:
+        return code_to_pattern(self._batch.current_pattern_codes[self._index])
+
+    @current_pattern.setter
+    def current_pattern(self, pattern: tp.Union[None, TurnipPattern]):
+        self._batch.current_pattern_codes[self._index] = pattern_to_code(pattern)
+
+    def __str__(self):
+        return str(self.to_island_week_data())
+
+    def to_island_week_data(self) -> IslandWeekData:
+        return IslandWeekData(self.owner, self.island_name, self.week_num, self.prices, self.purchase_price,
+                              self.previous_pattern, self.current_pattern)
+
+    def predict_current_pattern(self, model):
+        self.current_pattern = TurnipPattern.from_code(model.predict(self.to_numpy().reshape(1, -1))[0])
+        return self
+
+    def get_pattern_modifier(self) -> float:
+        if not self.has_patterns_populated():
+            return 5.0 / 4.0
+        return float(self._batch.previous_pattern_codes[self._index]) / 4.0
+
+    def to_numpy(self):
+        # Reads only this row, so going through every row of a batch stays linear.
+        prices: np.ndarray = self._batch.prices[self._index]
+        return np.where(prices != 0, prices - float(self._batch.purchase_prices[self._index]), MISSING_PRICE_FEATURE)
+
+    def to_numpy_regression(self):
+        return self.to_numpy() * self.get_pattern_modifier()
+
+    def is_valid(self, min_prices: int) -> bool:
+        return int(np.count_nonzero(self._batch.prices[self._index])) >= min_prices
+
+    def is_perfect(self) -> bool:
+        return bool(self._batch.prices[self._index].all()) and self.has_patterns_populated()
+
+    def has_patterns_populated(self) -> bool:
+        return int(self._batch.current_pattern_codes[self._index]) not in _unpopulated_codes and \
+               int(self._batch.previous_pattern_codes[self._index]) not in _unpopulated_codes
+
+
+class IslandWeekBatch:
+    """
+    Columnar store for many weeks of island data. All prices are kept in a single integer matrix
+    (0 where the price is missing) alongside parallel arrays for the rest of the fields, so that
+    validation and featurization are done in one vectorized pass instead of once per row.
+    """
+    _columns: tp.Tuple[str, ...] = ('owners', 'island_names', 'week_nums', 'prices', 'purchase_prices',
+                                    'previous_pattern_codes', 'current_pattern_codes')
+
+    def __init__(self, owners: np.ndarray, island_names: np.ndarray, week_nums: np.ndarray, prices: np.ndarray,
+                 purchase_prices: np.ndarray, previous_pattern_codes: np.ndarray, current_pattern_codes: np.ndarray):
+        """
+        Initializes the batch from already built columns. All of the columns must have the same length.
+        :param owners: Object array with the owner of each row.
+        :param island_names: Object array with the island name of each row.
+        :param week_nums: Integer array with the spreadsheet week of each row.
+        :param prices: Integer matrix of shape (n_rows, 12) with the prices of each row. 0 means missing.
+        :param purchase_prices: Integer array with the Sunday purchase price of each row.
+        :param previous_pattern_codes: Integer array with the code of the previous pattern of each row.
+        :param current_pattern_codes: Integer array with the code of the current pattern of each row.
+        """
+        self.owners: np.ndarray = np.asarray(owners, dtype=object)
+        self.island_names: np.ndarray = np.asarray(island_names, dtype=object)
+        self.week_nums: np.ndarray = np.asarray(week_nums, dtype=np.int32)
+        self.prices: np.ndarray = np.asarray(prices, dtype=np.int32).reshape(-1, N_PRICES)
+        self.purchase_prices: np.ndarray = np.asarray(purchase_prices, dtype=np.int32)
+        self.previous_pattern_codes: np.ndarray = np.asarray(previous_pattern_codes, dtype=np.int8)
+        self.current_pattern_codes: np.ndarray = np.asarray(current_pattern_codes, dtype=np.int8)
+
+    @classmethod
+    def empty(cls) -> 'IslandWeekBatch':
+        return cls(np.empty(0, dtype=object), np.empty(0, dtype=object), np.empty(0, dtype=np.int32),
+                   np.zeros((0, N_PRICES), dtype=np.int32), np.empty(0, dtype=np.int32),
+                   np.empty(0, dtype=np.int8), np.empty(0, dtype=np.int8))
+
+    @classmethod
+    def from_rows(cls, rows: tp.Iterable[tp.Union[IslandWeekData, IslandWeekRow]]) -> 'IslandWeekBatch':
+        """
+        Builds a batch out of individual rows.
+        :param rows: The IslandWeekData (or row views) to copy into the batch.
+        :return: The batch containing all of the rows in the same order.
+        """
+        rows = list(rows)
+        prices: np.ndarray = np.zeros((len(rows), N_PRICES), dtype=np.int32)
+        for i, row in enumerate(rows):
+            row_prices: tp.List[int] = [p if p else 0 for p in row.prices[:N_PRICES]]
+            prices[i, :len(row_prices)] = row_prices
+        return cls(np.asarray([row.owner for row in rows], dtype=object),
+                   np.asarray([row.island_name for row in rows], dtype=object),
+                   np.asarray([row.week_num for row in rows], dtype=np.int32),
+                   prices,
+                   np.asarray([row.purchase_price for row in rows], dtype=np.int32),
+                   np.asarray([pattern_to_code(row.previous_pattern) for row in rows], dtype=np.int8),
+                   np.asarray([pattern_to_code(row.current_pattern) for row in rows], dtype=np.int8))
+
+    @classmethod
+    def concatenate(cls, batches: tp.Sequence['IslandWeekBatch']) -> 'IslandWeekBatch':
+        if len(batches) == 0:
+            return cls.empty()
+        return cls(*[np.concatenate([getattr(b, column) for b in batches]) for column in cls._columns])
+
+    def __len__(self) -> int:
+        return self.week_nums.shape[0]
+
+    def __getitem__(self, item):
+        """
+        An integer gives a row view, while a slice, index array, or boolean mask gives a new batch.
+        """
+        if isinstance(item, (int, np.integer)):
+            index: int = int(item)
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError(f'Row {item} is out of range for a batch of {len(self)} rows.')
+            return IslandWeekRow(self, index)
+        return IslandWeekBatch(*[getattr(self, column)[item] for column in self._columns])
+
+    def __iter__(self) -> tp.Iterator[IslandWeekRow]:
+        return (IslandWeekRow(self, i) for i in range(len(self)))
+
+    def __add__(self, other):
+        if isinstance(other, list):
+            other = IslandWeekBatch.from_rows(other)
+        if not isinstance(other, IslandWeekBatch):
+            return NotImplemented
+        return IslandWeekBatch.concatenate([self, other])
+
+    def __radd__(self, other):
+        if isinstance(other, list):
+            return IslandWeekBatch.from_rows(other) + self
+        return NotImplemented
+
+    def save(self, filepath: str, **metadata):
+        """
+        Saves the batch to an uncompressed .npz file.
+        :param filepath: Where the batch should be saved.
+        :param metadata: Extra scalar values to store next to the columns, such as a version number.
+        """
+        columns: tp.Dict[str, np.ndarray] = {column: getattr(self, column) for column in self._columns}
+        columns['owners'] = columns['owners'].astype(str)
+        columns['island_names'] = columns['island_names'].astype(str)
+        np.savez(filepath, **columns, **{f'meta_{k}': np.asarray(v) for k, v in metadata.items()})
+
+    @classmethod
+    def load(cls, filepath: str) -> tp.Tuple['IslandWeekBatch', tp.Dict[str, tp.Any]]:
+        """
+        Loads a batch saved with IslandWeekBatch.save.
+        :param filepath: The .npz file the batch was saved to.
+        :return: A tuple of the batch and the metadata saved with it.
+        """
+        with np.load(filepath) as data:
+            batch: IslandWeekBatch = cls(*[data[column] for column in cls._columns])
+            metadata: tp.Dict[str, tp.Any] = {k[len('meta_'):]: data[k].item() for k in data.files
+                                             if k.startswith('meta_')}
+        return batch, metadata
+
+    def to_rows(self) -> tp.List[IslandWeekData]:
+        return [row.to_island_week_data() for row in self]
+
+    def known_prices(self) -> np.ndarray:
+        return self.prices != 0
+
+    def n_known_prices(self) -> np.ndarray:
+        return np.count_nonzero(self.prices, axis=1)
+
+    def get_current_patterns(self) -> np.ndarray:
+        return self.current_pattern_codes.astype(int).reshape(-1, 1)
+
+    def get_pattern_modifiers(self) -> np.ndarray:
+        return np.where(self.has_patterns_populated(), self.previous_pattern_codes / 4.0, 5.0 / 4.0)
+
+    def to_numpy(self) -> np.ndarray:
+        return np.where(self.known_prices(), self.prices - self.purchase_prices.reshape(-1, 1).astype(float),
+                        MISSING_PRICE_FEATURE)
+
+    def to_numpy_regression(self) -> np.ndarray:
+        return self.to_numpy() * self.get_pattern_modifiers().reshape(-1, 1)
+
+    def is_valid(self, min_prices: int) -> np.ndarray:
+        return self.n_known_prices() >= min_prices
+
+    def is_perfect(self) -> np.ndarray:
+        return self.known_prices().all(axis=1) & self.has_patterns_populated()
+
+    def has_patterns_populated(self) -> np.ndarray:
+        unpopulated: tp.List[int] = list(_unpopulated_codes)
+        return ~np.isin(self.current_pattern_codes, unpopulated) & ~np.isin(self.previous_pattern_codes, unpopulated)
@@ -1,4 +1,427 @@
+"""
+Command line entry point for the whole project.
+
+    python main.py fetch [--full-refresh]             Download the new weeks of both spreadsheets into the snapshots.
+    python main.py train [--classifiers ...]           Train, test and save classifiers, then save the results.
+    python main.py sweep [scheduler arguments]         Run the parallel training sweep (see scheduler.py).
+    python main.py predict --purchase-price 100 --prices 90 85 - ...
+                                                       Predict the pattern of a week with a saved model.
+    python main.py report [--metric f1]                Summarize the results of a training run.
+    python main.py worker                              Keep the data and models loaded and run commands sent to it.
+    python main.py startup-check                       Check how long each command takes to start.
+
+Every command only imports what it needs, so that a prediction doesn't pay for the Google API client or sklearn
+before it has to. Running any command with --worker sends it to a running worker instead, which skips the start up
+and loading costs entirely.
+"""
+import argparse
+import contextlib
+import functools
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import typing as tp
+
+from constants import MIN_NUM_PRICES, WORKER_SOCKET_PATH
+
+# The number of half-day prices in a week, the same as island_week_data.N_PRICES, which isn't imported just for it.
+N_PRICES: int = 12
+
+# The modules each command imports before doing any work, and the most time (in seconds) that can take.
+COMMAND_MODULES: tp.Dict[str, tp.List[str]] = {
+    'fetch': ['get_data'],
+    'train': ['get_data', 'feature_cache', 'classifiers', 'trainer'],
+    'sweep': ['scheduler'],
+    'predict': ['utility', 'forecaster'],
+    'report': ['results_store'],
+}
+COLD_START_BUDGETS_S: tp.Dict[str, float] = {
+    'fetch': 0.75,
+    'train': 5.0,
+    'sweep': 0.75,
+    'predict': 0.75,
+    'report': 0.25,
+}
+# Modules that are too slow to import for commands that don't use them.
+HEAVY_MODULES: tp.List[str] = ['sklearn', 'googleapiclient', 'google_auth_oauthlib', 'pandas']
+# The heavy modules that each command does need.
+COMMAND_HEAVY_MODULES: tp.Dict[str, tp.List[str]] = {'train': ['sklearn']}
+# The options that take a path, which are made absolute before a command is sent to the worker.
+PATH_OPTIONS: tp.Set[str] = {'--input', '--model-file', '--sweep-dir'}
+
+
+@functools.lru_cache(maxsize=None)
+def _load_rows(offline: bool):
+    # Kept for the life of the process, which only matters for workers, where it's cleared by fetch.
+    from get_data import get_structured_data
+    return get_structured_data(offline=offline)
+
+
+@functools.lru_cache(maxsize=8)
+def _load_model_file(path: str, modified_time: float):
+    # The modified time is part of the key so that a worker picks up a model file that was written over.
+    from model_format import load_model_file
+    return load_model_file(path)
+
+
+def fetch(args: argparse.Namespace) -> int:
+    from get_data import get_structured_data
+
+    batch = get_structured_data(full_refresh=args.full_refresh)
+    _load_rows.cache_clear()
+    print(f'{len(batch)} island-weeks over {len(set(batch.week_nums.tolist()))} weeks.')
+    return 0
+
+
+def train(args: argparse.Namespace) -> int:
+    import feature_cache
+    import utility
+    from classifiers import CLASSIFIER_GETTERS
+    from trainer import train_all_classifiers
+
+    x, _, y = feature_cache.get_all_data(_load_rows(args.offline), args.min_prices)
+    history = train_all_classifiers(x, y, args.train_size, save_models=not args.no_save,
+                                    classifiers=[CLASSIFIER_GETTERS[name]() for name in args.classifiers],
+                                    min_num_prices=args.min_prices, quiet=True, search=args.search)
+    for result in history:
+        print(f'{result["classifier"]}: {result["n_wrong"]}/{result["n_tests"]} wrong, f1 {result["f1"]:.4f}')
+    utility.save_results(history)
+    return 0
+
+
+def sweep(args: argparse.Namespace) -> int:
+    import scheduler
+
+    scheduler.main(args.extra_args)
+    return 0
+
+
+def _price(value: str) -> tp.Union[None, int]:
+    """
+    The type of --prices, where -, x or an empty string is a missing price.
+    """
+    if value in {'-', 'x', ''}:
+        return None
+    if not (value.isascii() and value.isdigit()) or int(value) == 0:
+        raise argparse.ArgumentTypeError(f'invalid price: {value!r} (use - for a missing price)')
+    return int(value)
+
+
+def _read_weeks(args: argparse.Namespace) -> tp.List[tp.Dict[str, tp.Any]]:
+    if args.input is not None:
+        with (contextlib.nullcontext(sys.stdin) if args.input == '-' else open(args.input, 'r')) as f:
+            weeks = json.load(f)
+        return weeks['weeks'] if isinstance(weeks, dict) and 'weeks' in weeks else \
+            weeks if isinstance(weeks, list) else [weeks]
+    # parse_args has already checked that there's a purchase price and at most 12 prices.
+    prices: tp.List[tp.Union[None, int]] = list(args.prices)
+    return [{'prices': prices + [None] * (N_PRICES - len(prices)), 'purchase_price': args.purchase_price,
+             'previous_pattern': args.previous_pattern}]
+
+
+def predict(args: argparse.Namespace) -> int:
+    import utility
+
+    try:
+        batch = utility.weeks_to_batch(_read_weeks(args))
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        # The same errors the server answers with a 400, such as an --input file with a week missing its prices.
+        print(f'Invalid weeks: {type(e).__name__}: {e}', file=sys.stderr)
+        return 2
+    if args.forecaster:
+        from forecaster import TurnipForecaster, FORECAST_PATTERNS
+
+        forecast = TurnipForecaster().forecast(batch)
+        for i, pattern in enumerate(forecast.patterns):
+            print(json.dumps({'pattern': repr(pattern), 'consistent': bool(forecast.is_consistent[i]),
+                              'probabilities': {repr(p): round(float(forecast.posterior[i, j]), 4)
+                                                for j, p in enumerate(FORECAST_PATTERNS)},
+                              'min_prices': forecast.min_prices[i].tolist(),
+                              'max_prices': forecast.max_prices[i].tolist()}))
+        return 0
+
+    if args.model_file is not None:
+        model = _load_model_file(os.path.abspath(args.model_file), os.path.getmtime(args.model_file))
+    else:
+        filename: str = utility.get_best_model_filename(args.model) if args.best else \
+            utility.get_most_recent_model_filename(args.model)
+        model = utility.load_model(filename)
+    patterns, confidences = utility.predict_patterns(batch, model)
+    for i, pattern in enumerate(patterns):
+        print(json.dumps({'pattern': repr(pattern),
+                          'confidence': None if confidences is None else round(float(confidences[i]), 4)}))
+    return 0
+
+
+def report(args: argparse.Namespace) -> int:
+    from results_store import ResultsStore
+
+    store = ResultsStore()
+    try:
+        run_id = args.run_id or store.latest_run_id()
+        if run_id is None:
+            print('There are no results yet.')
+            return 1
+        groups = store.aggregate(args.metric, group_by=args.group_by, how=args.how, run_id=run_id)
+    finally:
+        store.close()
+    print(f'{args.how} {args.metric} of {run_id}')
+    columns: tp.List[str] = list(args.group_by) + [args.metric]
+    print('  '.join(f'{c:>16}' for c in columns))
+    for group in groups:
+        print('  '.join(f'{group[c]:>16.4f}' if isinstance(group[c], float) else f'{str(group[c]):>16}'
+                        for c in columns))
+    return 0
+
+
+def _measure_cold_start(command: str) -> tp.Dict[str, tp.Any]:
+    code: str = ('import importlib, json, sys, time\n'
+                 'start = time.perf_counter()\n'
+                 'import main\n'
+                 f'for module in main.COMMAND_MODULES[{command!r}]:\n'
+                 '    importlib.import_module(module)\n'
+                 'print(json.dumps({"seconds": time.perf_counter() - start,\n'
+                 '                  "heavy": [m for m in main.HEAVY_MODULES if m in sys.modules]}))\n')
+    output: str = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                 cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def startup_check(args: argparse.Namespace) -> int:
+    """
+    Imports what each command needs in a fresh interpreter and checks it against the command's budget, and that
+    no heavy module the command doesn't need got imported along the way.
+    """
+    unknown: tp.List[str] = [command for command in args.commands if command not in COMMAND_MODULES]
+    if unknown:
+        print(f'Unknown commands: {", ".join(unknown)}', file=sys.stderr)
+        return 2
+    n_failed: int = 0
+    for command in args.commands or list(COMMAND_MODULES.keys()):
+        runs: tp.List[tp.Dict[str, tp.Any]] = [_measure_cold_start(command) for _ in range(args.repeat)]
+        seconds: float = min(run['seconds'] for run in runs)
+        unneeded: tp.List[str] = [m for m in runs[0]['heavy'] if m not in COMMAND_HEAVY_MODULES.get(command, [])]
+        is_ok: bool = seconds <= COLD_START_BUDGETS_S[command] and not unneeded
+        n_failed += not is_ok
+        print(f'{command:<8} {seconds:7.3f}s / {COLD_START_BUDGETS_S[command]:5.2f}s budget '
+              f'{"ok" if is_ok else "OVER"}{" (imports " + ", ".join(unneeded) + ")" if unneeded else ""}')
+    return 1 if n_failed else 0
+
+
+class Worker:
+    """
+    Runs commands sent over a Unix socket inside of one long lived process, so the imports, the data and the
+    loaded models (kept by the model registry) are reused from one command to the next.
+    One command runs at a time. Each request is a line of JSON with the command's arguments (and what to give it
+    as stdin), and the reply is a line of JSON with its exit code and output.
+    """
+
+    def __init__(self, socket_path: str = WORKER_SOCKET_PATH):
+        self.socket_path: str = socket_path
+
+    def handle(self, request: tp.Dict[str, tp.Any]) -> tp.Dict[str, tp.Any]:
+        argv: tp.List[str] = request['argv']
+        if argv and argv[0] in {'worker', 'startup-check'}:
+            return {'exit_code': 2, 'stdout': '', 'stderr': f'{argv[0]} can not be sent to a worker.\n'}
+        stdout, stderr = io.StringIO(), io.StringIO()
+        worker_stdin = sys.stdin
+        # The command reads the client's stdin, not the worker's.
+        sys.stdin = io.StringIO(request.get('stdin') or '')
+        try:
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                try:
+                    exit_code: int = run(argv)
+                except SystemExit as e:
+                    exit_code = e.code if isinstance(e.code, int) else 1
+                except Exception as e:
+                    print(f'{type(e).__name__}: {e}', file=sys.stderr)
+                    exit_code = 1
+        finally:
+            sys.stdin = worker_stdin
+        return {'exit_code': exit_code, 'stdout': stdout.getvalue(), 'stderr': stderr.getvalue()}
+
+    def handle_connection(self, connection: socket.socket):
+        with connection, connection.makefile('rwb') as stream:
+            line: bytes = stream.readline()
+            if not line:
+                return
+            try:
+                request: tp.Dict[str, tp.Any] = json.loads(line)
+                if not isinstance(request, dict) or not isinstance(request.get('argv'), list):
+                    raise ValueError('The request has to be an object with an argv list.')
+            except ValueError as e:
+                reply: tp.Dict[str, tp.Any] = {'exit_code': 2, 'stdout': '', 'stderr': f'Bad request: {e}\n'}
+            else:
+                reply = self.handle(request)
+            stream.write(json.dumps(reply).encode() + b'\n')
+            stream.flush()
+
+    def serve(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        server: socket.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        server.listen()
+        print(f'Worker listening on {self.socket_path}', file=sys.stderr)
+        try:
+            while True:
+                connection, _ = server.accept()
+                # A client going away (or anything else going wrong with one request) mustn't stop the worker.
+                try:
+                    self.handle_connection(connection)
+                except Exception as e:
+                    print(f'Request failed: {type(e).__name__}: {e}', file=sys.stderr)
+        finally:
+            server.close()
+            os.remove(self.socket_path)
+
+
+def worker(args: argparse.Namespace) -> int:
+    Worker(args.socket).serve()
+    return 0
+
+
+def _get_worker_argv(argv: tp.List[str]) -> tp.List[str]:
+    """
+    Makes the paths in the arguments absolute, since the worker may be running in another directory.
+    """
+    worker_argv: tp.List[str] = []
+    is_path: bool = False
+    for arg in argv:
+        option, has_value, value = arg.partition('=')
+        if is_path and arg != '-':
+            arg = os.path.abspath(arg)
+        elif option in PATH_OPTIONS and has_value and value != '-':
+            arg = f'{option}={os.path.abspath(value)}'
+        is_path = arg in PATH_OPTIONS
+        worker_argv.append(arg)
+    return worker_argv
+
+
+def send_to_worker(argv: tp.List[str], socket_path: str = WORKER_SOCKET_PATH,
+                   stdin: tp.Union[None, str] = None) -> tp.Union[None, int]:
+    """
+    Runs a command in the worker listening at socket_path, printing its output.
+    :param argv: The command and its arguments.
+    :param socket_path: Where the worker is listening.
+    :param stdin: What the command reads from stdin.
+    :return: The exit code of the command, or None if no worker is listening.
+    """
+    client: socket.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        client.close()
+        return None
+    with client, client.makefile('rwb') as stream:
+        stream.write(json.dumps({'argv': _get_worker_argv(argv), 'stdin': stdin}).encode() + b'\n')
+        stream.flush()
+        reply: tp.Dict[str, tp.Any] = json.loads(stream.readline())
+    sys.stdout.write(reply['stdout'])
+    sys.stderr.write(reply['stderr'])
+    return reply['exit_code']
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Predict Animal Crossing turnip price patterns.')
+    parser.add_argument('--worker', action='store_true',
+                        help='Send the command to the running worker. Runs it here if no worker is listening.')
+    parser.add_argument('--worker-socket', default=WORKER_SOCKET_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    fetch_parser = commands.add_parser('fetch', help='Download the new weeks of both spreadsheets.')
+    fetch_parser.add_argument('--full-refresh', action='store_true', help='Download everything again.')
+    fetch_parser.set_defaults(func=fetch)
+
+    # The same names as classifiers.CLASSIFIER_GETTERS, which isn't imported just to show the choices.
+    classifier_names: tp.List[str] = ['Linear SVM', 'RBF SVM', 'Naive Bayes', 'Random Forest']
+    train_parser = commands.add_parser('train', help='Train, test and save classifiers.')
+    train_parser.add_argument('--classifiers', nargs='+', default=classifier_names, choices=classifier_names)
+    train_parser.add_argument('--train-size', type=float, default=.75)
+    train_parser.add_argument('--min-prices', type=int, default=MIN_NUM_PRICES)
+    train_parser.add_argument('--search', choices=['grid', 'adaptive'], default='grid')
+    train_parser.add_argument('--offline', action='store_true', help='Only use the local snapshots.')
+    train_parser.add_argument('--no-save', action='store_true', help="Don't save the trained models.")
+    train_parser.set_defaults(func=train)
+
+    sweep_parser = commands.add_parser('sweep', help='Run the training sweep. Takes the arguments of scheduler.py.',
+                                       add_help=False)
+    sweep_parser.set_defaults(func=sweep)
+
+    predict_parser = commands.add_parser('predict', help='Predict the pattern of weeks.')
+    predict_parser.add_argument('--prices', nargs='*', default=[], type=_price,
+                                help='Up to 12 prices from Monday morning on, with - for the missing ones.')
+    predict_parser.add_argument('--purchase-price', type=int)
+    predict_parser.add_argument('--previous-pattern', default='')
+    predict_parser.add_argument('--input', help='A JSON file of weeks (- for stdin), in the form the server takes.')
+    predict_parser.add_argument('--model', default='Random Forest', help='The name of the model to use.')
+    predict_parser.add_argument('--best', action='store_true', help='Use the best model instead of the latest.')
+    predict_parser.add_argument('--model-file', help='Use the model saved at this path.')
+    predict_parser.add_argument('--forecaster', action='store_true',
+                                help="Use the game's price model instead of a trained classifier.")
+    predict_parser.set_defaults(func=predict)
+
+    report_parser = commands.add_parser('report', help='Summarize the results of a training run.')
+    report_parser.add_argument('--run-id', help='The run to summarize. Default is the latest.')
+    report_parser.add_argument('--metric', default='test_accuracy',
+                               choices=['test_accuracy', 'recall', 'precision', 'f1', 'sensitivity', 'specificity', 'n_wrong',
+                                        'n_tests'])
+    report_parser.add_argument('--group-by', nargs='+', default=['classifier'],
+                               choices=['run_id', 'classifier', 'min_num_prices', 'train_size'])
+    report_parser.add_argument('--how', default='avg', choices=['avg', 'min', 'max', 'sum', 'count'])
+    report_parser.set_defaults(func=report)
+
+    worker_parser = commands.add_parser('worker', help='Run commands sent with --worker in this process.')
+    worker_parser.add_argument('--socket', default=WORKER_SOCKET_PATH)
+    worker_parser.set_defaults(func=worker)
+
+    check_parser = commands.add_parser('startup-check', help='Check how long each command takes to start.')
+    check_parser.add_argument('commands', nargs='*',
+                              help=f'The commands to check, out of {", ".join(COMMAND_MODULES)}. Default is all.')
+    check_parser.add_argument('--repeat', type=int, default=3)
+    check_parser.set_defaults(func=startup_check)
+    return parser
+
+
+def parse_args(argv: tp.List[str]) -> argparse.Namespace:
+    parser: argparse.ArgumentParser = get_parser()
+    # Only sweep takes arguments it doesn't know about, which are handed to the scheduler.
+    parsed, extra_args = parser.parse_known_args(argv)
+    if extra_args and parsed.command != 'sweep':
+        parser.error(f'unrecognized arguments: {" ".join(extra_args)}')
+    if parsed.command == 'predict' and parsed.input is None:
+        if parsed.purchase_price is None:
+            parser.error('predict needs either --input or --purchase-price (and --prices)')
+        if len(parsed.prices) > N_PRICES:
+            parser.error(f'argument --prices: at most {N_PRICES} prices, got {len(parsed.prices)}')
+    parsed.extra_args = extra_args
+    return parsed
+
+
+def run(argv: tp.List[str]) -> int:
+    parsed: argparse.Namespace = parse_args(argv)
+    return parsed.func(parsed)
+
+
+def main(argv: tp.Union[None, tp.List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    parsed: argparse.Namespace = parse_args(argv)
+    if parsed.worker:
+        # The worker is given everything from the command on, leaving out the options of this process.
+        command_argv: tp.List[str] = argv[argv.index(parsed.command):]
+        stdin: tp.Union[None, str] = sys.stdin.read() if getattr(parsed, 'input', None) == '-' else None
+        exit_code: tp.Union[None, int] = send_to_worker(command_argv, parsed.worker_socket, stdin)
+        if exit_code is None and stdin is not None:
+            # Already read, so it's handed to the command run here instead.
+            sys.stdin = io.StringIO(stdin)
+        if exit_code is not None:
+            return exit_code
+        print(f'No worker is listening on {parsed.worker_socket}, running the command here.', file=sys.stderr)
+    return parsed.func(parsed)
 
 
 if __name__ == '__main__':
-    print("Hello World!")
+    sys.exit(main())
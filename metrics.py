@@ -0,0 +1,145 @@
+"""
+Evaluation metrics built on top of a multiclass confusion matrix, which is counted in a single bincount pass.
+Sensitivity, specificity, precision, and F1 are then all derived from the matrix, for one model or for many
+models (or confidence thresholds) at once.
+"""
+import typing as tp
+
+import numpy as np
+
+# The label given to samples a model abstained on because it wasn't confident enough.
+ABSTAIN_LABEL: int = -100
+
+
+def _label_indexes(values: np.ndarray, labels: np.ndarray) -> np.ndarray:
+    indexes: np.ndarray = np.searchsorted(labels, values)
+    indexes = np.clip(indexes, 0, labels.shape[0] - 1)
+    if not (labels[indexes] == values).all():
+        raise ValueError('Found values that are not in labels.')
+    return indexes
+
+
+def confusion_matrices(truth: np.ndarray, predictions: np.ndarray,
+                       labels: tp.Union[None, np.ndarray] = None) -> tp.Tuple[np.ndarray, np.ndarray]:
+    """
+    Counts the confusion matrix of every row of predictions against the truth in one pass.
+    :param truth: The true labels, shape (n_samples,).
+    :param predictions: The predicted labels, shape (n_samples,) for one model or (n_models, n_samples) for many.
+    :param labels: The labels to count. Defaults to every label in truth and predictions.
+    :return: A tuple of the confusion matrices, shape (n_models, n_labels, n_labels) with the true label on the rows, and the labels in the order they are counted.
+    """
+    truth = np.asarray(truth).reshape(-1)
+    predictions = np.atleast_2d(np.asarray(predictions))
+    labels = np.unique(np.concatenate([truth, predictions.reshape(-1)])) if labels is None else np.sort(labels)
+    n_labels: int = labels.shape[0]
+    n_models: int = predictions.shape[0]
+
+    truth_indexes: np.ndarray = _label_indexes(truth, labels)
+    prediction_indexes: np.ndarray = _label_indexes(predictions, labels)
+    flat: np.ndarray = (np.arange(n_models).reshape(-1, 1) * n_labels + truth_indexes.reshape(1, -1)) * n_labels + \
+        prediction_indexes
+    counts: np.ndarray = np.bincount(flat.reshape(-1), minlength=n_models * n_labels * n_labels)
+    return counts.reshape(n_models, n_labels, n_labels), labels
+
+
+def _safe_divide(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    return np.divide(numerator, denominator, out=np.zeros(numerator.shape, dtype=float), where=denominator != 0)
+
+
+def class_metrics(matrices: np.ndarray) -> tp.Dict[str, np.ndarray]:
+    """
+    Derives the per class metrics from confusion matrices (true label on the rows). Works on any number of leading
+    dimensions, so (n_labels, n_labels) gives arrays of shape (n_labels,) and (n_models, n_labels, n_labels) gives (n_models, n_labels).
+    :return: The true positives, false positives, false negatives, true negatives, support, sensitivity (recall), specificity, precision, and F1 of every class.
+    """
+    matrices = np.asarray(matrices)
+    true_positives: np.ndarray = np.diagonal(matrices, axis1=-2, axis2=-1)
+    support: np.ndarray = matrices.sum(axis=-1)
+    predicted: np.ndarray = matrices.sum(axis=-2)
+    total: np.ndarray = matrices.sum(axis=(-2, -1))[..., np.newaxis]
+
+    false_negatives: np.ndarray = support - true_positives
+    false_positives: np.ndarray = predicted - true_positives
+    true_negatives: np.ndarray = total - true_positives - false_negatives - false_positives
+
+    sensitivity: np.ndarray = _safe_divide(true_positives, true_positives + false_negatives)
+    precision: np.ndarray = _safe_divide(true_positives, true_positives + false_positives)
+    return {'true_positives': true_positives, 'false_positives': false_positives,
+            'false_negatives': false_negatives, 'true_negatives': true_negatives, 'support': support,
+            'sensitivity': sensitivity,
+            'specificity': _safe_divide(true_negatives, true_negatives + false_positives),
+            'precision': precision,
+            'f1': _safe_divide(2 * precision * sensitivity, precision + sensitivity)}
+
+
+def summarize(matrices: np.ndarray, labels: np.ndarray) -> tp.Dict[str, np.ndarray]:
+    """
+    The accuracy and the macro averages (over the classes that show up in the truth) of the per class metrics.
+    """
+    metrics: tp.Dict[str, np.ndarray] = class_metrics(matrices)
+    present: np.ndarray = (metrics['support'] > 0) & (labels != ABSTAIN_LABEL)
+    n_present: np.ndarray = np.maximum(present.sum(axis=-1), 1)
+    summary: tp.Dict[str, np.ndarray] = {
+        'accuracy': _safe_divide(metrics['true_positives'].sum(axis=-1).astype(float),
+                                 np.asarray(matrices).sum(axis=(-2, -1)).astype(float))}
+    for name in ('sensitivity', 'specificity', 'precision', 'f1'):
+        summary[name] = (metrics[name] * present).sum(axis=-1) / n_present
+    return summary
+
+
+def evaluate(truth: np.ndarray, prediction: np.ndarray,
+             labels: tp.Union[None, np.ndarray] = None) -> tp.Dict[str, tp.Any]:
+    """
+    Evaluates a single model's predictions.
+    :return: The accuracy, the macro averaged sensitivity, specificity, precision, and F1 (as floats), the per class metrics (under 'per_class'), the confusion matrix, and its labels.
+    """
+    matrices, labels = confusion_matrices(truth, prediction, labels)
+    output: tp.Dict[str, tp.Any] = {k: float(v[0]) for k, v in summarize(matrices, labels).items()}
+    output['per_class'] = {k: v[0] for k, v in class_metrics(matrices).items()}
+    output['confusion_matrix'] = matrices[0]
+    output['labels'] = labels
+    return output
+
+
+def evaluate_many(truth: np.ndarray, predictions: tp.Union[np.ndarray, tp.Dict[str, np.ndarray]],
+                  labels: tp.Union[None, np.ndarray] = None) -> tp.Dict[str, tp.Dict[str, float]]:
+    """
+    Evaluates the predictions of many models on the same samples in one batch.
+    :param truth: The true labels.
+    :param predictions: The predictions of every model, by the model's name (or a (n_models, n_samples) array, named by index).
+    :return: The summary metrics of every model, by name.
+    """
+    names: tp.List[tp.Any] = list(predictions.keys()) if isinstance(predictions, dict) else \
+        list(range(len(predictions)))
+    stacked: np.ndarray = np.stack([np.asarray(predictions[name]).reshape(-1) for name in names])
+    matrices, labels = confusion_matrices(truth, stacked, labels)
+    summary: tp.Dict[str, np.ndarray] = summarize(matrices, labels)
+    return {name: {k: float(v[i]) for k, v in summary.items()} for i, name in enumerate(names)}
+
+
+def evaluate_thresholds(truth: np.ndarray, probabilities: np.ndarray, classes: np.ndarray,
+                        thresholds: tp.Sequence[float]) -> tp.Dict[float, tp.Dict[str, float]]:
+    """
+    Evaluates a probabilistic model at many confidence thresholds at once. Samples whose highest probability is
+    below a threshold are abstained on, which counts against sensitivity but not against precision.
+    :param truth: The true labels.
+    :param probabilities: The class probabilities from predict_proba, shape (n_samples, n_classes).
+    :param classes: The classes the columns of probabilities belong to (model.classes_).
+    :param thresholds: The confidence thresholds to evaluate.
+    :return: The summary metrics and the coverage (fraction of samples not abstained on) at each threshold.
+    """
+    probabilities = np.asarray(probabilities)
+    best: np.ndarray = probabilities.argmax(axis=1)
+    confidence: np.ndarray = probabilities[np.arange(probabilities.shape[0]), best]
+    predicted: np.ndarray = np.asarray(classes)[best]
+    thresholds_array: np.ndarray = np.asarray(thresholds, dtype=float).reshape(-1, 1)
+    is_confident: np.ndarray = confidence.reshape(1, -1) >= thresholds_array
+    predictions: np.ndarray = np.where(is_confident, predicted.reshape(1, -1), ABSTAIN_LABEL)
+
+    labels: np.ndarray = np.unique(np.concatenate([np.asarray(truth).reshape(-1), np.asarray(classes),
+                                                   [ABSTAIN_LABEL]]))
+    matrices, labels = confusion_matrices(truth, predictions, labels)
+    summary: tp.Dict[str, np.ndarray] = summarize(matrices, labels)
+    coverage: np.ndarray = is_confident.mean(axis=1)
+    return {float(t): {**{k: float(v[i]) for k, v in summary.items()}, 'coverage': float(coverage[i])}
+            for i, t in enumerate(thresholds_array.reshape(-1))}
@@ -0,0 +1,318 @@
+"""
+Index of the models saved in the models directory. Keeps a manifest of every model file (name, timestamp,
+hyperparameters, score, size, and the minimum number of prices it was trained with) so finding the latest or best
+model doesn't require scanning the directory, and keeps recently loaded models in memory.
+
+The hyperparameters, score and minimum number of prices of every model are also saved next to it (as
+<model filename>.json), so the manifest can always be rebuilt from the directory.
+"""
+import collections
+import datetime as dt
+import json
+import os
+import re
+import typing as tp
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where writes to the manifest from different processes aren't locked.
+    fcntl = None
+
+from constants import MODEL_FILEPATH, MODEL_CACHE_BYTES, MODEL_MANIFEST_FILENAME
+from model_format import load_model_file
+
+_model_filename_regex = re.compile(r'^([A-Za-z]+)_(\d{8}_\d{6}(?:_\d{6})?)\.c?mdl$', re.RegexFlag.ASCII)
+
+# Models are saved with microseconds so that models of the same name saved in the same second (like by parallel
+# jobs of a sweep) don't overwrite each other. Older models only have seconds.
+TIMESTAMP_FORMAT: str = '%Y%m%d_%H%M%S_%f'
+SECONDS_TIMESTAMP_FORMAT: str = '%Y%m%d_%H%M%S'
+
+METADATA_EXTENSION: str = '.json'
+_metadata_fields: tp.Tuple[str, ...] = ('params', 'score', 'min_num_prices')
+
+
+class ModelRecord(tp.NamedTuple):
+    filename: str
+    name: str
+    timestamp: str
+    size: int
+    params: tp.Union[None, tp.Dict[str, tp.Any]] = None
+    score: tp.Union[None, float] = None
+    min_num_prices: tp.Union[None, int] = None
+
+    @property
+    def datetime(self) -> dt.datetime:
+        return dt.datetime.strptime(self.timestamp, TIMESTAMP_FORMAT if self.timestamp.count('_') > 1 else
+                                    SECONDS_TIMESTAMP_FORMAT)
+
+
+def parse_model_filename(filename: str) -> tp.Union[None, tp.Tuple[str, str]]:
+    """
+    Gets the name and timestamp out of a model's filename, such as RandomForest_20201121_151848_123456.mdl
+    (or .cmdl for models in the compact format). Older models don't have the microseconds.
+    :return: A tuple of the name and the timestamp, or None if the filename isn't one of a model.
+    """
+    match = _model_filename_regex.match(filename)
+    if not match:
+        return None
+    return match.group(1), match.group(2)
+
+
+def _json_safe(value):
+    """
+    Makes hyperparameters (which tend to be numpy scalars) storable as JSON.
+    """
+    if isinstance(value, dict):
+        return {k: _json_safe(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(v) for v in value]
+    if hasattr(value, 'item'):
+        return value.item()
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+class ModelRegistry:
+    """
+    Manifest-backed index of a directory of saved models with an in-memory LRU cache of loaded models.
+    """
+
+    def __init__(self, model_dir: str = MODEL_FILEPATH, max_cache_bytes: int = MODEL_CACHE_BYTES):
+        """
+        :param model_dir: The directory the models are saved in.
+        :param max_cache_bytes: The largest total size (of the model files) of loaded models to keep in memory.
+        """
+        self.model_dir: str = model_dir
+        self.manifest_path: str = os.path.join(model_dir, MODEL_MANIFEST_FILENAME)
+        self.max_cache_bytes: int = max_cache_bytes
+        self._records: tp.Dict[str, ModelRecord] = self._read_manifest()
+        self._latest: tp.Dict[tp.Tuple[str, tp.Union[None, int]], ModelRecord] = {}
+        self._best: tp.Dict[tp.Tuple[str, tp.Union[None, int]], ModelRecord] = {}
+        self._dir_mtime: tp.Union[None, float] = None
+        self._cache: tp.OrderedDict[str, tp.Tuple[tp.Any, int]] = collections.OrderedDict()
+        self._cache_bytes: int = 0
+        self._sync()
+
+    def _sync(self):
+        """
+        Brings the manifest up to date with the directory. Only lists the directory if it changed since the last sync.
+        """
+        if not os.path.isdir(self.model_dir):
+            return
+        dir_mtime: float = os.stat(self.model_dir).st_mtime
+        if dir_mtime == self._dir_mtime:
+            return
+
+        filenames: tp.Set[str] = set(os.listdir(self.model_dir))
+        changed: bool = False
+        for filename in list(self._records.keys()):
+            if filename not in filenames:
+                del self._records[filename]
+                changed = True
+        for filename in filenames - set(self._records.keys()):
+            parsed = parse_model_filename(filename)
+            if parsed:
+                size: int = os.path.getsize(os.path.join(self.model_dir, filename))
+                self._records[filename] = ModelRecord(filename, parsed[0], parsed[1], size,
+                                                      **self._read_metadata(filename))
+                changed = True
+        if changed or not os.path.exists(self.manifest_path):
+            self._save_manifest()
+        self._rebuild_indexes()
+        self._dir_mtime = os.stat(self.model_dir).st_mtime
+
+    def _get_metadata_path(self, filename: str) -> str:
+        return os.path.join(self.model_dir, filename + METADATA_EXTENSION)
+
+    def _read_metadata(self, filename: str) -> tp.Dict[str, tp.Any]:
+        """
+        :return: The params, score and minimum number of prices saved next to the model, or none of them if it
+        doesn't have any.
+        """
+        try:
+            with open(self._get_metadata_path(filename), 'r') as f:
+                metadata: tp.Dict[str, tp.Any] = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        return {field: metadata.get(field) for field in _metadata_fields}
+
+    def _write_metadata(self, record: ModelRecord):
+        path: str = self._get_metadata_path(record.filename)
+        temp_path: str = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({field: getattr(record, field) for field in _metadata_fields}, f, indent=1)
+        os.replace(temp_path, path)
+
+    def _read_manifest(self) -> tp.Dict[str, ModelRecord]:
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return {r['filename']: ModelRecord(**r) for r in json.load(f)['models']}
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_manifest(self, updated: tp.Iterable[str] = ()):
+        """
+        Writes the manifest, merged with what other processes have written to it since it was read.
+        :param updated: The filenames of the records this process changed, which replace the ones in the manifest.
+        The manifest's records of every other model are kept, since another process may know more about them.
+        """
+        os.makedirs(self.model_dir, exist_ok=True)
+        with open(self.manifest_path + '.lock', 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            merged: tp.Dict[str, ModelRecord] = self._read_manifest()
+            for filename, record in self._records.items():
+                if filename in updated or filename not in merged:
+                    merged[filename] = record
+            self._records = {filename: record for filename, record in merged.items()
+                             if os.path.exists(os.path.join(self.model_dir, filename))}
+            records: tp.List[tp.Dict[str, tp.Any]] = [r._asdict() for r in sorted(self._records.values())]
+            temp_path: str = f'{self.manifest_path}.{os.getpid()}.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump({'models': records}, f, indent=1)
+            os.replace(temp_path, self.manifest_path)
+
+    def _rebuild_indexes(self):
+        self._latest = {}
+        self._best = {}
+        for record in self._records.values():
+            for key in [(record.name, None), (record.name, record.min_num_prices)]:
+                latest: tp.Union[None, ModelRecord] = self._latest.get(key)
+                if latest is None or (record.timestamp, record.filename) > (latest.timestamp, latest.filename):
+                    self._latest[key] = record
+                if record.score is not None:
+                    best: tp.Union[None, ModelRecord] = self._best.get(key)
+                    if best is None or (record.score, record.timestamp) > (best.score, best.timestamp):
+                        self._best[key] = record
+
+    def register(self, filename: str, params: tp.Union[None, tp.Dict[str, tp.Any]] = None,
+                 score: tp.Union[None, float] = None, min_num_prices: tp.Union[None, int] = None) -> ModelRecord:
+        """
+        Adds a model that was just saved to the models directory to the manifest.
+        :param filename: The filename of the model within the models directory.
+        :param params: The hyperparameters the model was trained with.
+        :param score: How well the model did, higher being better. Used to find the best model.
+        :param min_num_prices: The minimum number of prices a week needed to be part of the training data.
+        :return: The record of the model.
+        """
+        parsed = parse_model_filename(filename)
+        if parsed is None:
+            raise ValueError(f'{filename} is not the filename of a model.')
+        size: int = os.path.getsize(os.path.join(self.model_dir, filename))
+        record: ModelRecord = ModelRecord(filename, parsed[0], parsed[1], size, _json_safe(params),
+                                          None if score is None else float(score), min_num_prices)
+        self._records[filename] = record
+        self._write_metadata(record)
+        self._save_manifest(updated=[filename])
+        self._rebuild_indexes()
+        self._dir_mtime = os.stat(self.model_dir).st_mtime
+        return record
+
+    def records(self, model_name: tp.Union[None, str] = None) -> tp.List[ModelRecord]:
+        self._sync()
+        name: tp.Union[None, str] = None if model_name is None else model_name.replace(' ', '')
+        return sorted([r for r in self._records.values() if name is None or r.name == name],
+                      key=lambda r: (r.timestamp, r.filename))
+
+    def latest(self, model_name: str, min_num_prices: tp.Union[None, int] = None) -> ModelRecord:
+        """
+        Gets the most recently saved model of the given name.
+        :param model_name: The name of the model, such as Random Forest.
+        :param min_num_prices: If given, only considers models trained with this minimum number of prices.
+        """
+        self._sync()
+        key: tp.Tuple[str, tp.Union[None, int]] = (model_name.replace(' ', ''), min_num_prices)
+        if key not in self._latest:
+            raise FileNotFoundError(f'No saved models found for {model_name} in {self.model_dir}.')
+        return self._latest[key]
+
+    def best(self, model_name: str, min_num_prices: tp.Union[None, int] = None) -> ModelRecord:
+        """
+        Gets the highest scoring saved model of the given name. Only models registered with a score are considered.
+        :param model_name: The name of the model, such as Random Forest.
+        :param min_num_prices: If given, only considers models trained with this minimum number of prices.
+        """
+        self._sync()
+        key: tp.Tuple[str, tp.Union[None, int]] = (model_name.replace(' ', ''), min_num_prices)
+        if key not in self._best:
+            raise FileNotFoundError(f'No scored models found for {model_name} in {self.model_dir}.')
+        return self._best[key]
+
+    def load(self, filename: str, use_cache: bool = True):
+        """
+        Loads a model, reusing the already loaded model if it is still in the cache.
+        The cached model is shared with everything else that loads it, so it must not be changed (such as by refitting
+        it). Use sklearn.base.clone or use_cache=False to get a model that can be.
+        :param filename: The filename of the model within the models directory.
+        :param use_cache: If false, always loads a new copy of the model from disk.
+        :return: The model.
+        """
+        if use_cache and filename in self._cache:
+            self._cache.move_to_end(filename)
+            return self._cache[filename][0]
+
+        file_path: str = os.path.join(self.model_dir, filename)
+        model = load_model_file(file_path)
+
+        if use_cache:
+            size: int = os.path.getsize(file_path)
+            self._cache[filename] = (model, size)
+            self._cache_bytes += size
+            # Always keep the model that was just loaded, even if it's bigger than the cache.
+            while self._cache_bytes > self.max_cache_bytes and len(self._cache) > 1:
+                _, (_, evicted_size) = self._cache.popitem(last=False)
+                self._cache_bytes -= evicted_size
+        return model
+
+    def clear_cache(self):
+        self._cache.clear()
+        self._cache_bytes = 0
+
+    def prune(self, keep_latest: int = 5, keep_best: int = 5, dry_run: bool = False) -> tp.List[ModelRecord]:
+        """
+        Deletes old model files. For every model name, the most recent and the highest scoring models are kept.
+        :param keep_latest: The number of most recent models of each name to keep.
+        :param keep_best: The number of highest scoring models of each name to keep.
+        :param dry_run: If true, only reports what would be deleted.
+        :return: The records of the models that were (or would be) deleted.
+        """
+        self._sync()
+        by_name: tp.Dict[str, tp.List[ModelRecord]] = collections.defaultdict(list)
+        for record in self._records.values():
+            by_name[record.name].append(record)
+
+        to_delete: tp.List[ModelRecord] = []
+        for records in by_name.values():
+            newest_first: tp.List[ModelRecord] = sorted(records, key=lambda r: (r.timestamp, r.filename), reverse=True)
+            best_first: tp.List[ModelRecord] = sorted([r for r in records if r.score is not None],
+                                                      key=lambda r: r.score, reverse=True)
+            kept: tp.Set[str] = {r.filename for r in newest_first[:keep_latest] + best_first[:keep_best]}
+            to_delete.extend([r for r in records if r.filename not in kept])
+
+        if not dry_run and to_delete:
+            for record in to_delete:
+                os.remove(os.path.join(self.model_dir, record.filename))
+                if os.path.exists(self._get_metadata_path(record.filename)):
+                    os.remove(self._get_metadata_path(record.filename))
+                del self._records[record.filename]
+                if record.filename in self._cache:
+                    self._cache_bytes -= self._cache.pop(record.filename)[1]
+            self._save_manifest()
+            self._rebuild_indexes()
+            self._dir_mtime = os.stat(self.model_dir).st_mtime
+        return sorted(to_delete, key=lambda r: (r.name, r.timestamp))
+
+
+_registries: tp.Dict[str, ModelRegistry] = {}
+
+
+def get_registry(model_dir: str = MODEL_FILEPATH) -> ModelRegistry:
+    """
+    Gets the registry shared by everything in this process for the given directory.
+    """
+    if model_dir not in _registries:
+        _registries[model_dir] = ModelRegistry(model_dir)
+    return _registries[model_dir]
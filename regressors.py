@@ -1,2 +1,257 @@
+"""
+Online regression of the rest of a week's prices. Every half-day has its own linear model that predicts its price
+from the prices seen before it, and the models are updated one price at a time with recursive least squares, so
+a new price is learned from (and a new forecast is made) without going back over the history.
 
+The models are shared by every island. The only state kept per island is the current week, which is bounded by
+keeping just the most recently updated islands.
+"""
+import threading
+import typing as tp
+from collections import OrderedDict
 
+import numpy as np
+
+from island_week_data import IslandWeekBatch, TurnipPattern, N_PRICES, MISSING_PRICE_FEATURE
+
+# The bias, the pattern modifier, then the regression features and whether each price is known.
+N_FEATURES: int = 2 + 2 * N_PRICES
+
+_pattern_codes: tp.List[int] = [TurnipPattern.DECREASING.value[1], TurnipPattern.RANDOM.value[1],
+                                TurnipPattern.HIGH_SPIKE.value[1], TurnipPattern.SMALL_SPIKE.value[1]]
+
+
+def get_pattern_modifiers(previous_pattern_codes: np.ndarray) -> np.ndarray:
+    """
+    The same modifier as IslandWeekBatch.get_pattern_modifiers, but only needing last week's pattern,
+    since this week's pattern is still unknown while its prices come in.
+    """
+    return np.where(np.isin(previous_pattern_codes, _pattern_codes), previous_pattern_codes / 4.0, 5.0 / 4.0)
+
+
+def get_features(prices: np.ndarray, purchase_prices: np.ndarray, modifiers: np.ndarray, half_day: int) -> np.ndarray:
+    """
+    Featurizes weeks to predict one half-day, only using the prices before that half-day.
+    :param prices: Integer matrix of shape (n_rows, 12), 0 where the price is missing.
+    :param purchase_prices: The purchase price of every row.
+    :param modifiers: The pattern modifier of every row.
+    :param half_day: The index of the half-day to predict.
+    :return: The features, shape (n_rows, N_FEATURES).
+    """
+    known: np.ndarray = prices != 0
+    known[:, half_day:] = False
+    relative: np.ndarray = np.where(known, prices - purchase_prices.reshape(-1, 1).astype(float), MISSING_PRICE_FEATURE)
+    relative[:, half_day:] = 0.0
+    return np.hstack([np.ones((len(prices), 1)), modifiers.reshape(-1, 1),
+                      relative * modifiers.reshape(-1, 1), known.astype(float)])
+
+
+class RecursiveLeastSquares:
+    """
+    Linear regression updated one sample at a time, optionally weighing older samples down by a forgetting factor.
+    Forgetting also pulls the weights towards zero a little with every sample, so the covariance of the weights the
+    samples never vary (such as the ones of the prices after the half-day being predicted) stays at the initial
+    variance instead of growing without bound.
+    """
+
+    def __init__(self, n_features: int, forgetting_factor: float = 1.0, initial_variance: float = 1000.0):
+        """
+        :param n_features: The number of features of every sample.
+        :param forgetting_factor: How much the weight of every older sample shrinks with each new sample. 1 (default) never forgets.
+        :param initial_variance: How uncertain the starting (all zero) weights are. Larger values trust the first samples more.
+        """
+        self.forgetting_factor: float = forgetting_factor
+        self.initial_variance: float = initial_variance
+        self.weights: np.ndarray = np.zeros(n_features)
+        self.covariance: np.ndarray = np.eye(n_features) * initial_variance
+        self.n_samples: int = 0
+
+    @property
+    def _ridge(self) -> float:
+        # What is added to the diagonal of the information matrix with every sample, so that it never drops below
+        # what it started at.
+        return (1.0 - self.forgetting_factor) / self.initial_variance
+
+    def update(self, x: np.ndarray, y: float) -> float:
+        """
+        Learns from a single sample.
+        :return: The error of the prediction made before learning from the sample.
+        """
+        if self.forgetting_factor < 1.0:
+            # Forgets in information form, where the information becomes forgetting_factor * information + ridge.
+            shrink: np.ndarray = self.forgetting_factor * np.eye(len(self.weights)) + self._ridge * self.covariance
+            self.covariance = np.linalg.solve(shrink, self.covariance)
+            self.covariance = (self.covariance + self.covariance.T) / 2
+            self.weights = self.weights - self._ridge * (self.covariance @ self.weights)
+        px: np.ndarray = self.covariance @ x
+        gain: np.ndarray = px / (1.0 + x @ px)
+        error: float = y - self.weights @ x
+        self.weights += gain * error
+        self.covariance = self.covariance - np.outer(gain, px)
+        self.n_samples += 1
+        return error
+
+    def fit(self, x: np.ndarray, y: np.ndarray):
+        """
+        Learns from many samples at once. Gives the same model as calling update on every sample in order,
+        but solves it directly instead of sample by sample.
+        """
+        if len(x) == 0:
+            return self
+        identity: np.ndarray = np.eye(len(self.weights))
+        prior_weight: float = self.forgetting_factor ** len(x)
+        decay: np.ndarray = self.forgetting_factor ** np.arange(len(x) - 1, -1, -1, dtype=float)
+        weighted_x: np.ndarray = x * decay.reshape(-1, 1)
+        information: np.ndarray = prior_weight * np.linalg.solve(self.covariance, identity) + weighted_x.T @ x
+        # The ridge added by every update, forgotten along with the samples.
+        information += (1.0 - prior_weight) / self.initial_variance * identity
+        target: np.ndarray = prior_weight * np.linalg.solve(self.covariance, self.weights) + weighted_x.T @ y
+        self.covariance = np.linalg.solve(information, identity)
+        self.covariance = (self.covariance + self.covariance.T) / 2
+        self.weights = np.linalg.solve(information, target)
+        self.n_samples += len(x)
+        return self
+
+    def predict(self, x: np.ndarray) -> np.ndarray:
+        return x @ self.weights
+
+
+class IslandState:
+    """
+    The week currently being streamed in for one island.
+    """
+    __slots__ = ('week_num', 'purchase_price', 'previous_pattern_code', 'prices')
+
+    def __init__(self, week_num: int, purchase_price: int, previous_pattern_code: int):
+        self.week_num: int = week_num
+        self.purchase_price: int = purchase_price
+        self.previous_pattern_code: int = previous_pattern_code
+        self.prices: np.ndarray = np.zeros(N_PRICES, dtype=np.int32)
+
+
+class OnlinePriceRegressor:
+    """
+    Forecasts the rest of the week's prices for many islands as their prices come in.
+    Safe to use from multiple threads.
+    """
+
+    def __init__(self, max_islands: int = 10000, forgetting_factor: float = 1.0, initial_variance: float = 1000.0):
+        """
+        :param max_islands: The number of islands to keep the current week of. The least recently updated are dropped.
+        :param forgetting_factor: Passed on to the model of every half-day.
+        :param initial_variance: Passed on to the model of every half-day.
+        """
+        self.max_islands: int = max_islands
+        self.models: tp.List[RecursiveLeastSquares] = [RecursiveLeastSquares(N_FEATURES, forgetting_factor,
+                                                                             initial_variance)
+                                                       for _ in range(N_PRICES)]
+        self._islands: tp.MutableMapping[tp.Tuple[str, str], IslandState] = OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._islands)
+
+    def fit(self, rows):
+        """
+        Learns from complete or partial weeks, as if every one of their prices had been streamed in order.
+        :param rows: A list of IslandWeekData or an IslandWeekBatch.
+        :return: self
+        """
+        batch: IslandWeekBatch = rows if isinstance(rows, IslandWeekBatch) else IslandWeekBatch.from_rows(rows)
+        modifiers: np.ndarray = get_pattern_modifiers(batch.previous_pattern_codes)
+        with self._lock:
+            for half_day, model in enumerate(self.models):
+                has_target: np.ndarray = batch.prices[:, half_day] != 0
+                prices: np.ndarray = batch.prices[has_target]
+                purchase_prices: np.ndarray = batch.purchase_prices[has_target]
+                x: np.ndarray = get_features(prices, purchase_prices, modifiers[has_target], half_day)
+                model.fit(x, prices[:, half_day] - purchase_prices.astype(float))
+        return self
+
+    def _get_state(self, key: tp.Tuple[str, str], week_num: int, purchase_price: tp.Union[None, int],
+                   previous_pattern: tp.Union[None, TurnipPattern]) -> IslandState:
+        state: tp.Union[None, IslandState] = self._islands.get(key)
+        if state is None or state.week_num != week_num:
+            if purchase_price is None:
+                raise ValueError(f'The purchase price of island {key} for week {week_num} has not been given.')
+            state = IslandState(week_num, purchase_price, TurnipPattern.EMPTY.value[1])
+            self._islands[key] = state
+            if len(self._islands) > self.max_islands:
+                self._islands.popitem(last=False)
+        else:
+            self._islands.move_to_end(key)
+            if purchase_price is not None:
+                state.purchase_price = purchase_price
+        if previous_pattern is not None:
+            state.previous_pattern_code = previous_pattern.value[1]
+        return state
+
+    def update(self, owner: str, island_name: str, week_num: int, half_day: int, price: int,
+               purchase_price: tp.Union[None, int] = None,
+               previous_pattern: tp.Union[None, TurnipPattern] = None) -> np.ndarray:
+        """
+        Learns from a new price of an island and forecasts the rest of its week.
+        :param owner: The owner of the island.
+        :param island_name: The name of the island.
+        :param week_num: The week of the price. A new week starts the island's prices over.
+        :param half_day: The index of the price in the week (0 is Monday morning).
+        :param price: The price.
+        :param purchase_price: The Sunday purchase price. Required for the first price of every week.
+        :param previous_pattern: Last week's pattern, if known.
+        :return: The forecast of the island's week, as from forecast.
+        """
+        with self._lock:
+            state: IslandState = self._get_state((owner, island_name), week_num, purchase_price, previous_pattern)
+            if state.prices[half_day] == 0:
+                modifier: np.ndarray = get_pattern_modifiers(np.asarray([state.previous_pattern_code]))
+                x: np.ndarray = get_features(state.prices.reshape(1, -1), np.asarray([state.purchase_price]), modifier,
+                                             half_day)[0]
+                self.models[half_day].update(x, float(price - state.purchase_price))
+            state.prices[half_day] = price
+            return self._forecast(state)
+
+    def update_many(self, events: tp.Iterable[tp.Tuple]) -> tp.Dict[tp.Tuple[str, str], np.ndarray]:
+        """
+        Learns from many prices in the order given.
+        :param events: Tuples of the arguments to update.
+        :return: The latest forecast of every island that got a new price, keyed by (owner, island name).
+        """
+        forecasts: tp.Dict[tp.Tuple[str, str], np.ndarray] = {}
+        for event in events:
+            forecasts[(event[0], event[1])] = self.update(*event)
+        return forecasts
+
+    def _forecast(self, state: IslandState) -> np.ndarray:
+        return self._forecast_rows(state.prices.reshape(1, -1), np.asarray([state.purchase_price]),
+                                   get_pattern_modifiers(np.asarray([state.previous_pattern_code])))[0]
+
+    def _forecast_rows(self, prices: np.ndarray, purchase_prices: np.ndarray, modifiers: np.ndarray) -> np.ndarray:
+        # Half-days are forecast in order, with every forecast used as a known price by the ones after it,
+        # since the models only learned from weeks where most of the earlier prices were known.
+        forecasts: np.ndarray = prices.astype(float)
+        for half_day, model in enumerate(self.models):
+            missing: np.ndarray = prices[:, half_day] == 0
+            if missing.any():
+                x: np.ndarray = get_features(forecasts[missing], purchase_prices[missing], modifiers[missing], half_day)
+                forecasts[missing, half_day] = purchase_prices[missing] + model.predict(x)
+        return forecasts
+
+    def forecast(self, owner: str, island_name: str) -> tp.Union[None, np.ndarray]:
+        """
+        :return: The island's known prices with the missing ones filled in by the models,
+            or None if the island has no prices in memory.
+        """
+        with self._lock:
+            state: tp.Union[None, IslandState] = self._islands.get((owner, island_name))
+            return None if state is None else self._forecast(state)
+
+    def forecast_batch(self, rows) -> np.ndarray:
+        """
+        Forecasts the missing prices of many weeks at once without learning from them.
+        :param rows: A list of IslandWeekData or an IslandWeekBatch.
+        :return: Float matrix of shape (n_rows, 12) with the known prices and the forecasts of the missing ones.
+        """
+        batch: IslandWeekBatch = rows if isinstance(rows, IslandWeekBatch) else IslandWeekBatch.from_rows(rows)
+        with self._lock:
+            return self._forecast_rows(batch.prices, batch.purchase_prices,
+                                       get_pattern_modifiers(batch.previous_pattern_codes))
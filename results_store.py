@@ -0,0 +1,212 @@
+"""
+Append-only SQLite store of experiment results, indexed by run, minimum number of prices, classifier, and
+training size so the plots can query exactly the results they need instead of loading every results JSON file.
+Results JSON files that aren't in the store yet (such as the ones from before it) are imported whenever it's opened.
+"""
+import datetime as dt
+import json
+import os
+import re
+import sqlite3
+import typing as tp
+
+from constants import RESULTS_DB_PATH, RESULTS_SAVE_PATH
+
+_results_filename_regex = re.compile(r'^(results_\d{8}_\d{6}(?:_\d{6})?)\.json$', re.RegexFlag.ASCII)
+
+# The columns every result has, the rest of a result's values are kept as JSON in the extra column.
+# sensitivity is the metric of the original notebook and the results files it wrote, which (despite its name) is the
+# precision over the training and testing data together. trainer.py writes the recall on the testing data under
+# recall instead, so the two are never mixed up.
+RESULT_COLUMNS: tp.Tuple[str, ...] = ('classifier', 'min_num_prices', 'train_size', 'sensitivity', 'specificity',
+                                      'n_wrong', 'n_tests', 'recall', 'precision', 'f1')
+GROUPABLE_COLUMNS: tp.Tuple[str, ...] = ('run_id', 'classifier', 'min_num_prices', 'train_size')
+METRIC_COLUMNS: tp.Tuple[str, ...] = ('test_accuracy', 'sensitivity', 'specificity', 'n_wrong', 'n_tests', 'recall',
+                                      'precision', 'f1')
+
+_AGGREGATES: tp.Tuple[str, ...] = ('avg', 'min', 'max', 'sum', 'count')
+
+_SCHEMA: str = '''
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    source TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT NOT NULL REFERENCES runs(run_id),
+    classifier TEXT NOT NULL,
+    min_num_prices INTEGER,
+    train_size REAL,
+    sensitivity REAL,
+    specificity REAL,
+    n_wrong INTEGER,
+    n_tests INTEGER,
+    recall REAL,
+    precision REAL,
+    f1 REAL,
+    test_accuracy REAL,
+    best_params TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS results_by_cell ON results (min_num_prices, classifier, train_size);
+CREATE INDEX IF NOT EXISTS results_by_run ON results (run_id);
+'''
+
+
+class ResultsStore:
+    def __init__(self, db_path: str = RESULTS_DB_PATH, results_dir: tp.Union[None, str] = RESULTS_SAVE_PATH):
+        """
+        Opens the store, making it if it doesn't exist yet.
+        :param db_path: Where the database is.
+        :param results_dir: The results JSON files in this directory that aren't in the store yet are imported when it
+        opens, so the results from before the store are in it too. None to not import anything.
+        """
+        self.db_path: str = db_path
+        directory: str = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection: sqlite3.Connection = sqlite3.connect(db_path)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.executescript(_SCHEMA)
+        if results_dir is not None:
+            self.import_json_history(results_dir)
+
+    def close(self):
+        self._connection.close()
+
+    def has_run(self, run_id: str) -> bool:
+        return self._connection.execute('SELECT 1 FROM runs WHERE run_id = ?', (run_id,)).fetchone() is not None
+
+    def append(self, results: tp.List[tp.Dict[str, tp.Any]], run_id: tp.Union[None, str] = None,
+               source: tp.Union[None, str] = None) -> str:
+        """
+        Adds the results of a run, such as the output of trainer.train_all_classifiers.
+        :param results: The results, one dictionary per classifier and training size.
+        :param run_id: The identifier of the run. Defaults to one made from the current time, like the results files.
+        :param source: Where the results came from, such as the JSON file they were imported from.
+        :return: The identifier of the run.
+        """
+        run_id = run_id or f'results_{dt.datetime.now().strftime("%Y%m%d_%H%M%S_%f")}'
+        with self._connection:
+            self._insert(results, run_id, source)
+        return run_id
+
+    def _insert(self, results: tp.List[tp.Dict[str, tp.Any]], run_id: str, source: tp.Union[None, str],
+                skip_existing: bool = False) -> bool:
+        """
+        :param skip_existing: If true, a run that is already in the store is skipped instead of raising an error.
+        :return: Whether the run was inserted.
+        """
+        rows: tp.List[tp.Tuple] = []
+        for result in results:
+            n_tests: tp.Union[None, int] = result.get('n_tests')
+            test_accuracy: tp.Union[None, float] = 1 - result['n_wrong'] / n_tests if n_tests else None
+            extra: tp.Dict[str, tp.Any] = {k: v for k, v in result.items()
+                                           if k not in RESULT_COLUMNS and k != 'best_params'}
+            rows.append((run_id, *[result.get(c) for c in RESULT_COLUMNS], test_accuracy,
+                         json.dumps(result.get('best_params')), json.dumps(extra)))
+        cursor: sqlite3.Cursor = self._connection.execute(
+            f'INSERT {"OR IGNORE " if skip_existing else ""}INTO runs (run_id, created_at, source) VALUES (?, ?, ?)',
+            (run_id, dt.datetime.now().isoformat(), source))
+        if cursor.rowcount == 0:
+            return False
+        self._connection.executemany(
+            f'INSERT INTO results (run_id, {", ".join(RESULT_COLUMNS)}, test_accuracy, best_params, extra) '
+            f'VALUES ({", ".join(["?"] * (len(RESULT_COLUMNS) + 4))})', rows)
+        return True
+
+    def import_json_history(self, results_dir: str = RESULTS_SAVE_PATH) -> tp.List[str]:
+        """
+        Imports every results_*.json file in the directory that hasn't been imported yet.
+        :return: The identifiers of the runs that were imported.
+        """
+        imported: tp.List[str] = []
+        if not os.path.isdir(results_dir):
+            return imported
+        # One transaction for the whole import instead of one per file.
+        with self._connection:
+            for filename in sorted(os.listdir(results_dir)):
+                match = _results_filename_regex.match(filename)
+                if not match or self.has_run(match.group(1)):
+                    continue
+                with open(os.path.join(results_dir, filename), 'r') as f:
+                    results: tp.List[tp.Dict[str, tp.Any]] = json.load(f)
+                # Another process opening the store at the same time may have imported it already.
+                if self._insert(results, match.group(1), filename, skip_existing=True):
+                    imported.append(match.group(1))
+        return imported
+
+    @staticmethod
+    def _where(filters: tp.Dict[str, tp.Any]) -> tp.Tuple[str, tp.List[tp.Any]]:
+        clauses: tp.List[str] = []
+        values: tp.List[tp.Any] = []
+        for column, value in filters.items():
+            if value is None:
+                continue
+            if column not in GROUPABLE_COLUMNS:
+                raise ValueError(f'Can not filter on {column}, only on {", ".join(GROUPABLE_COLUMNS)}.')
+            if isinstance(value, (list, tuple, set)):
+                value = list(value)
+                clauses.append(f'{column} IN ({", ".join(["?"] * len(value))})')
+                values.extend(value)
+            elif column == 'train_size':
+                # Training sizes come from np.arange, so compare them with some tolerance.
+                clauses.append('ABS(train_size - ?) < 1e-6')
+                values.append(value)
+            else:
+                clauses.append(f'{column} = ?')
+                values.append(value)
+        return (f'WHERE {" AND ".join(clauses)}' if clauses else ''), values
+
+    def query(self, run_id=None, classifier=None, min_num_prices=None, train_size=None) -> tp.List[tp.Dict[str, tp.Any]]:
+        """
+        Gets the results matching every given filter. Each filter can be a single value or a list of values.
+        :return: The results, in the same form they were appended in plus their run_id and test_accuracy.
+        """
+        where, values = self._where({'run_id': run_id, 'classifier': classifier, 'min_num_prices': min_num_prices,
+                                     'train_size': train_size})
+        rows = self._connection.execute(f'SELECT * FROM results {where} ORDER BY id', values).fetchall()
+        output: tp.List[tp.Dict[str, tp.Any]] = []
+        for row in rows:
+            result: tp.Dict[str, tp.Any] = {c: row[c] for c in ('run_id',) + RESULT_COLUMNS + ('test_accuracy',)}
+            result['best_params'] = json.loads(row['best_params']) if row['best_params'] else None
+            result.update(json.loads(row['extra']) if row['extra'] else {})
+            output.append(result)
+        return output
+
+    def aggregate(self, metric: str = 'test_accuracy', group_by: tp.Sequence[str] = ('min_num_prices', 'classifier'),
+                  how: str = 'avg', **filters) -> tp.List[tp.Dict[str, tp.Any]]:
+        """
+        Aggregates a metric in the database, such as the average test accuracy per minimum number of prices and classifier.
+        :param metric: One of METRIC_COLUMNS.
+        :param group_by: The columns to group by.
+        :param how: One of avg, min, max, sum, or count.
+        :param filters: The same filters query takes.
+        :return: One dictionary per group with the group's values and the aggregated metric (under the metric's name).
+        """
+        if metric not in METRIC_COLUMNS or how not in _AGGREGATES:
+            raise ValueError(f'Can not aggregate {metric} with {how}.')
+        if any([column not in GROUPABLE_COLUMNS for column in group_by]):
+            raise ValueError(f'Can only group by {", ".join(GROUPABLE_COLUMNS)}.')
+        where, values = self._where(filters)
+        columns: str = ', '.join(group_by)
+        group_clause: str = f'GROUP BY {columns} ORDER BY {columns}' if group_by else ''
+        select: str = f'{columns + ", " if group_by else ""}{how.upper()}({metric}) AS {metric}'
+        rows = self._connection.execute(f'SELECT {select} FROM results {where} {group_clause}', values).fetchall()
+        return [dict(row) for row in rows]
+
+    def run_ids(self) -> tp.List[str]:
+        return [row[0] for row in self._connection.execute('SELECT run_id FROM runs ORDER BY run_id')]
+
+    def latest_run_id(self) -> tp.Union[None, str]:
+        row = self._connection.execute('SELECT run_id FROM runs ORDER BY run_id DESC LIMIT 1').fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def to_dataframe(results: tp.List[tp.Dict[str, tp.Any]]):
+        """
+        Puts the output of query or aggregate into a pandas DataFrame for plotting.
+        """
+        import pandas as pd
+        return pd.DataFrame(results)
@@ -0,0 +1,203 @@
+"""
+Runs the training sweep (every classifier, for every training size, for every minimum number of prices) as
+independent jobs in a process pool. The featurized data is written once and memory mapped read only by every
+worker, finished jobs are checkpointed so an interrupted sweep picks up where it left off, and results are
+written out as soon as each job finishes.
+
+Example: python scheduler.py --min-prices 3 11 --workers 4 --offline
+"""
+import argparse
+import itertools
+import json
+import os
+import typing as tp
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import utility
+from classifiers import CLASSIFIER_GETTERS
+from constants import RESULTS_SAVE_PATH, MIN_NUM_PRICES
+from feature_cache import hash_batch
+from island_week_data import IslandWeekBatch
+
+SWEEP_DIR: str = os.path.join(RESULTS_SAVE_PATH, 'sweep')
+DATASET_INFO_FILENAME: str = 'dataset.json'
+
+_dataset_names: tp.Tuple[str, ...] = ('x', 'y', 'n_known_prices')
+
+
+class Job(tp.NamedTuple):
+    classifier: str
+    train_size: float
+    min_num_prices: int
+
+    @property
+    def job_id(self) -> str:
+        return f'{self.classifier.replace(" ", "")}_{self.train_size:.2f}_{self.min_num_prices}'
+
+
+def expand_jobs(classifiers: tp.Iterable[str], train_sizes: tp.Iterable[float],
+                min_prices: tp.Iterable[int]) -> tp.List[Job]:
+    return [Job(classifier, round(float(train_size), 4), int(min_num_prices))
+            for min_num_prices, train_size, classifier in itertools.product(min_prices, train_sizes, classifiers)]
+
+
+def get_dataset_paths(sweep_dir: str) -> tp.Dict[str, str]:
+    return {name: os.path.join(sweep_dir, f'{name}.npy') for name in _dataset_names}
+
+
+def read_dataset_hash(sweep_dir: str) -> tp.Union[None, str]:
+    """
+    :return: The hash of the rows the dataset in sweep_dir was made from, or None if it doesn't have a whole one.
+    """
+    if not all(os.path.exists(path) for path in get_dataset_paths(sweep_dir).values()):
+        return None
+    try:
+        with open(os.path.join(sweep_dir, DATASET_INFO_FILENAME), 'r') as f:
+            return json.load(f)['hash']
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        return None
+
+
+def write_dataset(rows: utility.RowsType, sweep_dir: str) -> tp.Dict[str, str]:
+    """
+    Featurizes every row once and writes the features as .npy files for the workers to memory map, along with the
+    hash of the rows. The rows are filtered by the minimum number of prices inside of each job.
+    :return: The paths of the files, by name.
+    """
+    batch: IslandWeekBatch = utility.as_batch(rows)
+    os.makedirs(sweep_dir, exist_ok=True)
+    arrays: tp.Dict[str, np.ndarray] = {'x': batch.to_numpy(), 'y': batch.get_current_patterns(),
+                                        'n_known_prices': batch.n_known_prices()}
+    paths: tp.Dict[str, str] = get_dataset_paths(sweep_dir)
+    for name, array in arrays.items():
+        np.save(paths[name], array)
+    with open(os.path.join(sweep_dir, DATASET_INFO_FILENAME), 'w') as f:
+        json.dump({'hash': hash_batch(batch), 'n_rows': len(batch)}, f)
+    return paths
+
+
+_worker_data: tp.Dict[str, np.ndarray] = {}
+
+
+def _init_worker(dataset_paths: tp.Dict[str, str]):
+    for name, path in dataset_paths.items():
+        _worker_data[name] = np.load(path, mmap_mode='r')
+
+
+def run_job(job: Job, save_models: bool = False, search: str = 'grid') -> tp.Dict[str, tp.Any]:
+    """
+    Trains and tests a single classifier, on the dataset loaded into this worker, for a single cell of the sweep.
+    """
+    from trainer import train_all_classifiers
+
+    mask: np.ndarray = _worker_data['n_known_prices'] >= job.min_num_prices
+    x: np.ndarray = np.asarray(_worker_data['x'][mask])
+    y: np.ndarray = np.asarray(_worker_data['y'][mask])
+    # Each job only gets one core, both in the search and in the classifier itself (like the trees of a random
+    # forest), since the parallelism comes from running many jobs at once.
+    name, model, params = CLASSIFIER_GETTERS[job.classifier]()
+    model.set_params(**{param: 1 for param in model.get_params() if param.split('__')[-1] == 'n_jobs'})
+    result: tp.Dict[str, tp.Any] = train_all_classifiers(x, y, job.train_size, save_models=save_models,
+                                                         classifiers=[(name, model, params)],
+                                                         min_num_prices=job.min_num_prices, n_jobs=1,
+                                                         quiet=True, search=search)[0]
+    result['job_id'] = job.job_id
+    return result
+
+
+def load_checkpoint(checkpoint_path: str) -> tp.Dict[str, tp.Dict[str, tp.Any]]:
+    """
+    :return: The results of every job that already finished, by job id.
+    """
+    finished: tp.Dict[str, tp.Dict[str, tp.Any]] = {}
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, 'r') as f:
+            for line in f:
+                # A partially written last line means the sweep was killed while writing it.
+                try:
+                    result: tp.Dict[str, tp.Any] = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                finished[result['job_id']] = result
+    return finished
+
+
+def run_sweep(rows: utility.RowsType, jobs: tp.List[Job], n_workers: int = os.cpu_count() or 1,
+              sweep_dir: str = SWEEP_DIR, save_models: bool = False,
+              search: str = 'grid') -> tp.Iterator[tp.Dict[str, tp.Any]]:
+    """
+    Runs every job that hasn't already been checkpointed in sweep_dir. A sweep that is resumed keeps using the
+    dataset it was started with, so every result of the sweep comes from the same data.
+    :param rows: The data to train and test on.
+    :param jobs: The cells of the sweep to run.
+    :param n_workers: The number of processes to run jobs in.
+    :param sweep_dir: Where the shared dataset and the checkpoint are kept.
+    :param save_models: If true, saves the model from every job to the models directory.
+    :param search: Either 'grid' for an exhaustive grid search or 'adaptive' for search.AdaptiveSearch.
+    :return: A generator of the result of each job as soon as it finishes, starting with the checkpointed ones.
+    """
+    checkpoint_path: str = os.path.join(sweep_dir, 'checkpoint.jsonl')
+    finished: tp.Dict[str, tp.Dict[str, tp.Any]] = load_checkpoint(checkpoint_path)
+    dataset_hash: tp.Union[None, str] = read_dataset_hash(sweep_dir)
+    if finished and dataset_hash is None:
+        raise ValueError(f'The sweep in {sweep_dir} has finished jobs but not the dataset they were trained on, so '
+                         f'it can\'t be resumed. Use a new sweep directory.')
+    if finished and dataset_hash != hash_batch(utility.as_batch(rows)):
+        warnings.warn(f'The data has changed since the sweep in {sweep_dir} was started. Resuming it with the data '
+                      f'it was started with. Use a new sweep directory to use the new data.')
+    remaining: tp.List[Job] = [job for job in jobs if job.job_id not in finished]
+    yield from [finished[job.job_id] for job in jobs if job.job_id in finished]
+    if not remaining:
+        return
+
+    dataset_paths: tp.Dict[str, str] = get_dataset_paths(sweep_dir) if finished else write_dataset(rows, sweep_dir)
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                             initargs=(dataset_paths,)) as executor, open(checkpoint_path, 'a') as checkpoint:
+        futures = {executor.submit(run_job, job, save_models, search): job for job in remaining}
+        for future in as_completed(futures):
+            result: tp.Dict[str, tp.Any] = future.result()
+            checkpoint.write(json.dumps(result) + '\n')
+            checkpoint.flush()
+            yield result
+
+
+def _parse_range(values: tp.List[int]) -> tp.List[int]:
+    if len(values) == 2:
+        return list(range(values[0], values[1] + 1))
+    return values
+
+
+def main(args: tp.Union[None, tp.List[str]] = None):
+    parser = argparse.ArgumentParser(description='Run the training sweep in parallel, resuming any unfinished sweep.')
+    parser.add_argument('--classifiers', nargs='+', default=list(CLASSIFIER_GETTERS.keys()),
+                        choices=list(CLASSIFIER_GETTERS.keys()))
+    parser.add_argument('--train-sizes', nargs='+', type=float, default=list(np.round(np.arange(.1, .91, .1), 2)))
+    parser.add_argument('--min-prices', nargs='+', type=int, default=[MIN_NUM_PRICES],
+                        help='Either a list of values or an inclusive range given as two values, such as 3 11.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--sweep-dir', default=SWEEP_DIR,
+                        help='Where to keep the checkpoint. Use a new directory to start a new sweep.')
+    parser.add_argument('--save-models', action='store_true')
+    parser.add_argument('--search', choices=['grid', 'adaptive'], default='grid',
+                        help='adaptive uses successive halving with cached folds and warm started forests.')
+    parser.add_argument('--offline', action='store_true', help='Only use the local snapshots of the spreadsheets.')
+    parsed = parser.parse_args(args)
+
+    from get_data import get_structured_data
+    rows = get_structured_data(offline=parsed.offline)
+    jobs: tp.List[Job] = expand_jobs(parsed.classifiers, parsed.train_sizes, _parse_range(parsed.min_prices))
+    print(f'Running {len(jobs)} jobs with {parsed.workers} workers.')
+
+    results: tp.List[tp.Dict[str, tp.Any]] = []
+    for result in run_sweep(rows, jobs, parsed.workers, parsed.sweep_dir, parsed.save_models,
+                            parsed.search):
+        results.append(result)
+        print(f'[{len(results)}/{len(jobs)}] {result["job_id"]}: {result["n_wrong"]}/{result["n_tests"]} wrong')
+    utility.save_results(results)
+
+
+if __name__ == '__main__':
+    main()
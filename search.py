@@ -0,0 +1,195 @@
+"""
+Hyperparameter search that is much cheaper than a full grid search over the (name, estimator, params) tuples from
+classifiers.py. Candidates are compared with successive halving, so most of them are only ever fit on a small part
+of the training data, preprocessing that doesn't depend on the hyperparameters (the MinMaxScaler of the SVM pipelines)
+is fit once per fold instead of once per candidate, and forests are grown with warm starts instead of being refit
+from scratch for every number of estimators.
+"""
+import math
+import typing as tp
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.model_selection import ParameterGrid, StratifiedKFold
+from sklearn.pipeline import Pipeline
+
+from constants import CV, RANDOM_STATE, N_JOBS
+
+
+class _FoldData(tp.NamedTuple):
+    train_x: np.ndarray
+    train_y: np.ndarray
+    test_x: np.ndarray
+    test_y: np.ndarray
+
+
+class _FoldCache:
+    """
+    The training and testing data of every fold, for every amount of training data used, with the preprocessing
+    steps of the pipeline already applied.
+    """
+
+    def __init__(self, preprocessing: tp.Union[None, Pipeline], x: np.ndarray, y: np.ndarray,
+                 folds: tp.List[tp.Tuple[np.ndarray, np.ndarray]], random_state: int):
+        self._preprocessing: tp.Union[None, Pipeline] = preprocessing
+        self._x: np.ndarray = x
+        self._y: np.ndarray = y
+        rng: np.random.RandomState = np.random.RandomState(random_state)
+        # The subsets of each fold's training data are prefixes of a fixed shuffle, so bigger ones contain smaller ones.
+        self._folds: tp.List[tp.Tuple[np.ndarray, np.ndarray]] = [(rng.permutation(train), test) for train, test in folds]
+        self._cache: tp.Dict[tp.Tuple[int, int], _FoldData] = {}
+
+    @property
+    def n_folds(self) -> int:
+        return len(self._folds)
+
+    @property
+    def max_resources(self) -> int:
+        return min([train.shape[0] for train, _ in self._folds])
+
+    def get(self, fold: int, n_samples: int) -> _FoldData:
+        key: tp.Tuple[int, int] = (fold, n_samples)
+        if key not in self._cache:
+            train, test = self._folds[fold]
+            train = train[:n_samples]
+            train_x, test_x = self._x[train], self._x[test]
+            if self._preprocessing is not None:
+                preprocessing: Pipeline = clone(self._preprocessing).fit(train_x, self._y[train])
+                train_x, test_x = preprocessing.transform(train_x), preprocessing.transform(test_x)
+            self._cache[key] = _FoldData(train_x, self._y[train], test_x, self._y[test])
+        return self._cache[key]
+
+
+def _score_candidate(estimator, params: tp.Dict[str, tp.Any], data: _FoldData) -> float:
+    try:
+        model = clone(estimator).set_params(**params).fit(data.train_x, data.train_y)
+        return float((model.predict(data.test_x) == data.test_y).mean())
+    except Exception:
+        # Same as GridSearchCV's error_score=np.nan, such as for parameters the installed sklearn doesn't support.
+        return np.nan
+
+
+def _score_warm_started(estimator, params: tp.Dict[str, tp.Any], n_estimators: tp.List[int],
+                        data: _FoldData) -> tp.List[float]:
+    """
+    Grows a single forest through each of the numbers of estimators, scoring it at each size.
+    """
+    try:
+        model = clone(estimator).set_params(**params, warm_start=True)
+        scores: tp.List[float] = []
+        for n in sorted(n_estimators):
+            model.set_params(n_estimators=n).fit(data.train_x, data.train_y)
+            scores.append(float((model.predict(data.test_x) == data.test_y).mean()))
+        return scores
+    except Exception:
+        return [np.nan] * len(n_estimators)
+
+
+class AdaptiveSearch:
+    """
+    Successive halving search with the same interface as GridSearchCV, so it can be dropped into
+    trainer.train_classifier.
+    """
+
+    def __init__(self, estimator, param_grid: tp.Dict[str, tp.List[tp.Any]], cv: int = CV, n_jobs: int = N_JOBS,
+                 factor: int = 3, min_resources: tp.Union[None, int] = None, random_state: int = RANDOM_STATE):
+        """
+        :param estimator: The estimator (or pipeline) to search the hyperparameters of.
+        :param param_grid: The values to try for each hyperparameter, as in classifiers.py.
+        :param cv: The number of stratified folds.
+        :param n_jobs: The number of processes to fit candidates in.
+        :param factor: Only the best 1/factor of the candidates move on to each next round, which uses factor times the data.
+        :param min_resources: The number of training samples used in the first round. Defaults to enough for the number of rounds needed.
+        :param random_state: Seeds the order training samples are added in.
+        """
+        self.estimator = estimator
+        self.param_grid: tp.Dict[str, tp.List[tp.Any]] = param_grid
+        self.cv: int = cv
+        self.n_jobs: int = n_jobs
+        self.factor: int = factor
+        self.min_resources: tp.Union[None, int] = min_resources
+        self.random_state: int = random_state
+
+    def _split_estimator(self, candidates: tp.List[tp.Dict[str, tp.Any]]) -> tp.Tuple[tp.Any, tp.Union[None, Pipeline], str]:
+        """
+        :return: A tuple of the estimator that gets fit per candidate, the preprocessing that can be shared between
+        candidates (None if there isn't any), and the prefix to strip off of the hyperparameter names.
+        """
+        if isinstance(self.estimator, Pipeline) and len(self.estimator.steps) > 1:
+            final_name: str = self.estimator.steps[-1][0]
+            prefix: str = f'{final_name}__'
+            if all([k.startswith(prefix) for candidate in candidates for k in candidate]):
+                return self.estimator.steps[-1][1], Pipeline(self.estimator.steps[:-1]), prefix
+        return self.estimator, None, ''
+
+    def _evaluate(self, estimator, candidates: tp.List[tp.Dict[str, tp.Any]], fold_cache: _FoldCache,
+                  n_samples: int) -> np.ndarray:
+        """
+        :return: The mean score over the folds of every candidate, nan for candidates that failed.
+        """
+        datas: tp.List[_FoldData] = [fold_cache.get(fold, n_samples) for fold in range(fold_cache.n_folds)]
+        parallel: Parallel = Parallel(n_jobs=self.n_jobs)
+        scores: np.ndarray = np.full((len(candidates), fold_cache.n_folds), np.nan)
+
+        can_warm_start: bool = 'warm_start' in estimator.get_params() and \
+            all(['n_estimators' in candidate for candidate in candidates])
+        if can_warm_start:
+            groups: tp.Dict[str, tp.Tuple[tp.Dict[str, tp.Any], tp.List[int]]] = {}
+            for i, candidate in enumerate(candidates):
+                rest: tp.Dict[str, tp.Any] = {k: v for k, v in candidate.items() if k != 'n_estimators'}
+                groups.setdefault(repr(sorted(rest.items(), key=lambda kv: kv[0])), (rest, []))[1].append(i)
+            group_list = list(groups.values())
+            results = parallel(delayed(_score_warm_started)(
+                estimator, rest, [candidates[i]['n_estimators'] for i in indexes], data)
+                for rest, indexes in group_list for data in datas)
+            for g, (rest, indexes) in enumerate(group_list):
+                order: tp.List[int] = sorted(indexes, key=lambda i: candidates[i]['n_estimators'])
+                for fold in range(len(datas)):
+                    scores[order, fold] = results[g * len(datas) + fold]
+        else:
+            results = parallel(delayed(_score_candidate)(estimator, candidate, data)
+                               for candidate in candidates for data in datas)
+            scores = np.asarray(results, dtype=float).reshape(len(candidates), len(datas))
+        return scores.mean(axis=1)
+
+    def fit(self, x: np.ndarray, y: np.ndarray) -> 'AdaptiveSearch':
+        x = np.asarray(x)
+        y = np.asarray(y).reshape(-1)
+        all_candidates: tp.List[tp.Dict[str, tp.Any]] = list(ParameterGrid(self.param_grid))
+        estimator, preprocessing, prefix = self._split_estimator(all_candidates)
+        stripped: tp.List[tp.Dict[str, tp.Any]] = [{k[len(prefix):]: v for k, v in c.items()} for c in all_candidates]
+
+        folds = list(StratifiedKFold(n_splits=self.cv).split(x, y))
+        fold_cache: _FoldCache = _FoldCache(preprocessing, x, y, folds, self.random_state)
+
+        n_rounds: int = max(1, math.ceil(math.log(len(all_candidates), self.factor)) + 1) \
+            if len(all_candidates) > 1 else 1
+        max_resources: int = fold_cache.max_resources
+        min_resources: int = self.min_resources or max(len(np.unique(y)) * 2,
+                                                       max_resources // self.factor ** (n_rounds - 1))
+
+        survivors: np.ndarray = np.arange(len(all_candidates))
+        last_scores: np.ndarray = np.full(len(all_candidates), np.nan)
+        last_round: np.ndarray = np.zeros(len(all_candidates), dtype=int)
+        for round_num in range(n_rounds):
+            is_last: bool = round_num == n_rounds - 1 or survivors.shape[0] == 1
+            n_samples: int = max_resources if is_last else \
+                min(max_resources, min_resources * self.factor ** round_num)
+            scores: np.ndarray = self._evaluate(estimator, [stripped[i] for i in survivors], fold_cache, n_samples)
+            last_scores[survivors] = scores
+            last_round[survivors] = round_num
+            if is_last:
+                break
+            n_keep: int = max(1, math.ceil(survivors.shape[0] / self.factor))
+            # Stable sort so ties keep going to the candidates that come first in the grid.
+            survivors = survivors[np.argsort(-np.nan_to_num(scores, nan=-np.inf), kind='stable')[:n_keep]]
+
+        best_of_last: int = survivors[int(np.argmax(np.nan_to_num(last_scores[survivors], nan=-np.inf)))]
+        self.best_index_: int = int(best_of_last)
+        self.best_params_: tp.Dict[str, tp.Any] = all_candidates[self.best_index_]
+        self.best_score_: float = float(last_scores[self.best_index_])
+        self.cv_results_: tp.Dict[str, tp.Any] = {'params': all_candidates, 'mean_test_score': last_scores,
+                                                  'round': last_round}
+        self.best_estimator_ = clone(self.estimator).set_params(**self.best_params_).fit(x, y)
+        return self
@@ -0,0 +1,294 @@
+"""
+Local HTTP/JSON service that predicts the turnip pattern of island weeks. Requests that arrive at about the same
+time are collected into a micro-batch so the model only runs once per batch, and the model is swapped for a newer
+one from the models directory as soon as one is saved, without stopping the service.
+
+POST /predict  {"prices": [12 prices, null if missing], "purchase_price": 100, "previous_pattern": "decreasing"}
+               (or {"weeks": [...]} with a list of those)
+GET  /metrics  Request latency percentiles, batch size histogram, and error counts.
+GET  /health   The model that is currently being served.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import time
+import traceback
+import typing as tp
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import utility
+from island_week_data import TurnipPattern
+from model_registry import get_registry
+
+
+class ServedModel:
+    """
+    The model currently being served. Checks the model registry for newer models of the same name and swaps them in.
+    """
+
+    def __init__(self, model_name: str):
+        self.model_name: str = model_name
+        self.filename: tp.Union[None, str] = None
+        self.model = None
+
+    def load_latest(self) -> bool:
+        """
+        Loads the latest model of this name if it isn't the one being served already.
+        Meant to be run in an executor since loading can be slow.
+        :return: Whether a new model was swapped in.
+        """
+        filename: str = get_registry().latest(self.model_name).filename
+        if filename == self.filename:
+            return False
+        model = get_registry().load(filename)
+        # Swapping both together means a batch always sees a matching model and filename.
+        self.model, self.filename = model, filename
+        return True
+
+
+class Metrics:
+    def __init__(self, window: int = 10000):
+        self.latencies_ms: tp.Deque[float] = collections.deque(maxlen=window)
+        self.batch_sizes: tp.Counter[int] = collections.Counter()
+        self.n_requests: int = 0
+        # Requests that were rejected as bad (400s).
+        self.n_errors: int = 0
+        # Requests that failed inside of the server (500s).
+        self.n_server_errors: int = 0
+        self.n_model_swaps: int = 0
+
+    def to_dict(self) -> tp.Dict[str, tp.Any]:
+        latencies: np.ndarray = np.asarray(self.latencies_ms)
+        percentiles: tp.Dict[str, float] = {}
+        if latencies.shape[0] > 0:
+            percentiles = {f'p{p}': float(v) for p, v in zip([50, 90, 99, 100],
+                                                              np.percentile(latencies, [50, 90, 99, 100]))}
+        return {'n_requests': self.n_requests, 'n_errors': self.n_errors, 'n_server_errors': self.n_server_errors,
+                'n_model_swaps': self.n_model_swaps,
+                'latency_ms': percentiles,
+                'batch_sizes': {str(k): v for k, v in sorted(self.batch_sizes.items())}}
+
+
+class MicroBatcher:
+    """
+    Collects feature rows from concurrent requests and predicts them together.
+    """
+
+    def __init__(self, served_model: ServedModel, metrics: Metrics, executor: ThreadPoolExecutor,
+                 max_batch_size: int = 256, max_wait_ms: float = 5.0):
+        """
+        :param served_model: The model to predict with.
+        :param metrics: Where to record the batch sizes.
+        :param executor: Where the model runs, so that the event loop isn't blocked.
+        :param max_batch_size: The most rows to predict at once.
+        :param max_wait_ms: How long to wait for more rows after the first row of a batch arrives.
+        """
+        self.served_model: ServedModel = served_model
+        self.metrics: Metrics = metrics
+        self.executor: ThreadPoolExecutor = executor
+        self.max_batch_size: int = max_batch_size
+        self.max_wait_s: float = max_wait_ms / 1000.0
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    async def predict(self, features: np.ndarray) -> tp.List[tp.Tuple[TurnipPattern, tp.Union[None, float], str]]:
+        """
+        Queues feature rows to be predicted in the next batch.
+        :param features: Feature matrix with one row per week.
+        :return: The predicted pattern, its confidence, and the filename of the model that predicted it for every row.
+        """
+        futures: tp.List[asyncio.Future] = []
+        for row in features:
+            future: asyncio.Future = asyncio.get_running_loop().create_future()
+            self._queue.put_nowait((row, future))
+            futures.append(future)
+        return list(await asyncio.gather(*futures))
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch: tp.List[tp.Tuple[np.ndarray, asyncio.Future]] = [await self._queue.get()]
+            deadline: float = loop.time() + self.max_wait_s
+            while len(batch) < self.max_batch_size:
+                timeout: float = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            model, filename = self.served_model.model, self.served_model.filename
+            features: np.ndarray = np.stack([row for row, _ in batch])
+            self.metrics.batch_sizes[len(batch)] += 1
+            try:
+                labels, probabilities = await loop.run_in_executor(
+                    self.executor, utility.predict_in_chunks, model, features, self.max_batch_size)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for i, (_, future) in enumerate(batch):
+                confidence: tp.Union[None, float] = None
+                if probabilities is not None:
+                    confidence = float(probabilities[i, np.searchsorted(model.classes_, labels[i])])
+                if not future.done():
+                    future.set_result((TurnipPattern.from_code(labels[i]), confidence, filename))
+
+
+def weeks_to_features(weeks: tp.List[tp.Dict[str, tp.Any]]) -> np.ndarray:
+    """
+    Featurizes the weeks given in a request the same way the training data was featurized.
+    """
+    return utility.weeks_to_batch(weeks).to_numpy()
+
+
+class PredictionServer:
+    def __init__(self, model_name: str, host: str = '127.0.0.1', port: int = 8588, max_batch_size: int = 256,
+                 max_wait_ms: float = 5.0, reload_interval_s: float = 10.0, n_threads: int = 2):
+        self.host: str = host
+        self.port: int = port
+        self.reload_interval_s: float = reload_interval_s
+        self.metrics: Metrics = Metrics()
+        self.served_model: ServedModel = ServedModel(model_name)
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=n_threads)
+        self.batcher: MicroBatcher = MicroBatcher(self.served_model, self.metrics, self.executor,
+                                                  max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+    async def _watch_for_new_models(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.reload_interval_s)
+            try:
+                if await loop.run_in_executor(self.executor, self.served_model.load_latest):
+                    self.metrics.n_model_swaps += 1
+                    print(f'Now serving {self.served_model.filename}')
+            except Exception as e:
+                # Keep serving the current model if the new one can't be loaded.
+                print(f'Could not load a newer model: {e}')
+
+    async def _route(self, method: str, path: str, body: bytes) -> tp.Tuple[int, tp.Dict[str, tp.Any]]:
+        if method == 'GET' and path == '/metrics':
+            return 200, self.metrics.to_dict()
+        if method == 'GET' and path == '/health':
+            return 200, {'model_name': self.served_model.model_name, 'model': self.served_model.filename}
+        if method == 'POST' and path == '/predict':
+            start: float = time.perf_counter()
+            request: tp.Dict[str, tp.Any] = json.loads(body)
+            is_single: bool = 'weeks' not in request
+            weeks: tp.List[tp.Dict[str, tp.Any]] = [request] if is_single else request['weeks']
+            predictions = await self.batcher.predict(weeks_to_features(weeks))
+            results: tp.List[tp.Dict[str, tp.Any]] = [
+                {'pattern': repr(pattern), 'code': pattern.value[1], 'confidence': confidence, 'model': filename}
+                for pattern, confidence, filename in predictions]
+            self.metrics.n_requests += 1
+            self.metrics.latencies_ms.append((time.perf_counter() - start) * 1000.0)
+            return 200, results[0] if is_single else {'predictions': results}
+        return 404, {'error': f'No route for {method} {path}'}
+
+    async def _read_request(self, reader: asyncio.StreamReader) \
+            -> tp.Union[None, tp.Tuple[str, str, tp.Dict[str, str], bytes]]:
+        """
+        :return: The method, path, headers (with lowercase names) and body of the next request on the connection, or
+        None if the client closed it. Raises ValueError if the request is malformed.
+        """
+        request_line: bytes = await reader.readline()
+        if not request_line:
+            return None
+        parts: tp.List[str] = request_line.decode('latin-1').split()
+        if len(parts) != 3:
+            raise ValueError(f'Malformed request line: {request_line[:100]!r}')
+        method, path, _ = parts
+        headers: tp.Dict[str, str] = {}
+        while True:
+            line: bytes = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+        content_length: str = headers.get('content-length', '0')
+        if not (content_length.isascii() and content_length.isdigit()):
+            raise ValueError(f'Invalid Content-Length: {content_length[:100]}')
+        return method, path, headers, await reader.readexactly(int(content_length))
+
+    @staticmethod
+    async def _write_response(writer: asyncio.StreamWriter, status: int, response: tp.Dict[str, tp.Any],
+                              keep_alive: bool):
+        payload: bytes = json.dumps(response).encode('utf-8')
+        writer.write(f'HTTP/1.1 {status} {"OK" if status == 200 else "Error"}\r\n'
+                     f'Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n'
+                     f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode('latin-1') + payload)
+        await writer.drain()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except ValueError as e:
+                    # Where the next request would start isn't known anymore, so the connection is closed.
+                    self.metrics.n_errors += 1
+                    await self._write_response(writer, 400, {'error': str(e)}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+
+                try:
+                    status, response = await self._route(method, path, body)
+                except (ValueError, KeyError, TypeError) as e:
+                    self.metrics.n_errors += 1
+                    status, response = 400, {'error': str(e)}
+                except Exception as e:
+                    # Anything else is a problem with the server (such as the model failing), not with the request.
+                    # The connection is kept, and the error is counted and logged.
+                    self.metrics.n_server_errors += 1
+                    traceback.print_exc()
+                    status, response = 500, {'error': f'Internal server error: {e}'}
+
+                keep_alive: bool = headers.get('connection', '').lower() != 'close'
+                await self._write_response(writer, status, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        self.served_model.load_latest()
+        print(f'Serving {self.served_model.filename} on http://{self.host}:{self.port}')
+        batcher_task = asyncio.ensure_future(self.batcher.run())
+        watcher_task = asyncio.ensure_future(self._watch_for_new_models())
+        server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher_task.cancel()
+            watcher_task.cancel()
+            self.executor.shutdown(wait=False)
+
+
+def main(args: tp.Union[None, tp.List[str]] = None):
+    parser = argparse.ArgumentParser(description='Serve turnip pattern predictions over HTTP.')
+    parser.add_argument('--model', default='Random Forest', help='The name of the model to serve the latest of.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8588)
+    parser.add_argument('--max-batch-size', type=int, default=256)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0,
+                        help='How long to wait for more requests before predicting a batch.')
+    parser.add_argument('--reload-interval', type=float, default=10.0,
+                        help='How often (in seconds) to check for a newer model.')
+    parsed = parser.parse_args(args)
+    server: PredictionServer = PredictionServer(parsed.model, parsed.host, parsed.port, parsed.max_batch_size,
+                                                parsed.max_wait_ms, parsed.reload_interval)
+    asyncio.run(server.serve())
+
+
+if __name__ == '__main__':
+    main()
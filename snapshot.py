@@ -0,0 +1,146 @@
+"""
+Local snapshots of the spreadsheets so the data can be used without going through the Google Sheets API.
+Raw cell values are stored as gzipped JSON and the parsed rows are stored as an IslandWeekBatch, both keyed
+by the spreadsheet ID and the cell range they came from.
+"""
+import datetime as dt
+import gzip
+import json
+import os
+import re
+import typing as tp
+
+from constants import SNAPSHOT_FILEPATH
+from island_week_data import IslandWeekBatch
+
+_range_regex = re.compile(r'^(?:(?P<sheet>[^!]+)!)?(?P<start_col>[A-Z]+)(?P<start_row>\d*):(?P<end_col>[A-Z]+)(?P<end_row>\d*)$')
+
+
+def split_cell_range(cell_range: str) -> tp.Tuple[str, str, int, str, tp.Union[None, int]]:
+    """
+    Splits an A1 style range (such as Archive!C:S or A5:P10) into its parts.
+    :param cell_range: The range to split.
+    :return: A tuple of the sheet name ('' if there isn't one), the first column, the first row (1 if not given),
+    the last column, and the last row (None if not given).
+    """
+    match = _range_regex.match(cell_range)
+    if not match:
+        raise ValueError(f'Unsupported cell range: {cell_range}')
+    start_row: int = int(match.group('start_row')) if match.group('start_row') else 1
+    end_row: tp.Union[None, int] = int(match.group('end_row')) if match.group('end_row') else None
+    return match.group('sheet') or '', match.group('start_col'), start_row, match.group('end_col'), end_row
+
+
+def range_from_row(cell_range: str, start_row: int, end_row: tp.Union[None, int] = None) -> str:
+    """
+    Restricts a whole-column range such as Archive!C:S so that it starts at the provided (1-based) row.
+    :param cell_range: The whole-column range.
+    :param start_row: The first row that should be in the range.
+    :param end_row: The last row that should be in the range. If None (default), goes to the end of the sheet.
+    :return: The new range, such as Archive!C120:S
+    """
+    if start_row <= 1 and end_row is None:
+        return cell_range
+    sheet, start_col, _, end_col, _ = split_cell_range(cell_range)
+    return f'{sheet + "!" if sheet else ""}{start_col}{start_row}:{end_col}{end_row if end_row is not None else ""}'
+
+
+def is_separator_row(row: tp.List[str]) -> bool:
+    """
+    The spreadsheets separate their weeks with rows that have no values in them.
+    """
+    return all([len(cell) < 1 for cell in row])
+
+
+class SheetSnapshot:
+    """
+    The on-disk snapshot of a single range of a single spreadsheet.
+    """
+
+    def __init__(self, spreadsheet_id: str, cell_range: str, snapshot_dir: str = SNAPSHOT_FILEPATH):
+        self.spreadsheet_id: str = spreadsheet_id
+        self.cell_range: str = cell_range
+        self.snapshot_dir: str = snapshot_dir
+        key: str = f'{spreadsheet_id}_{re.sub(r"[^A-Za-z0-9]+", "-", cell_range)}'
+        self.values_path: str = os.path.join(snapshot_dir, f'{key}.json.gz')
+        self.batch_path: str = os.path.join(snapshot_dir, f'{key}.npz')
+
+    def has_values(self) -> bool:
+        return os.path.exists(self.values_path)
+
+    def load_values(self) -> tp.List[tp.List[str]]:
+        with gzip.open(self.values_path, 'rt', encoding='utf-8') as f:
+            return json.load(f)['values']
+
+    def save_values(self, values: tp.List[tp.List[str]]):
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        contents: tp.Dict[str, tp.Any] = {'spreadsheet_id': self.spreadsheet_id, 'range': self.cell_range,
+                                          'fetched_at': dt.datetime.now().strftime('%Y%m%d_%H%M%S'),
+                                          'values': values}
+        # Write to a temporary file first so an interrupted save never leaves a broken snapshot behind.
+        temp_path: str = self.values_path + '.tmp'
+        with gzip.open(temp_path, 'wt', encoding='utf-8') as f:
+            json.dump(contents, f, separators=(',', ':'))
+        os.replace(temp_path, self.values_path)
+
+    def load_batch(self, parser_version: int) -> tp.Union[None, IslandWeekBatch]:
+        """
+        Loads the parsed rows of the snapshot.
+        :param parser_version: The version of the parser the caller uses. Snapshots parsed by another version are ignored.
+        :return: The parsed rows, or None if there are none (or they are out of date).
+        """
+        if not os.path.exists(self.batch_path):
+            return None
+        batch, metadata = IslandWeekBatch.load(self.batch_path)
+        if metadata.get('parser_version') != parser_version:
+            return None
+        return batch
+
+    def save_batch(self, batch: IslandWeekBatch, parser_version: int):
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        # np.savez appends .npz to paths that do not end with it.
+        temp_path: str = self.batch_path[:-len('.npz')] + '.tmp.npz'
+        batch.save(temp_path, parser_version=parser_version)
+        os.replace(temp_path, self.batch_path)
+
+
+class _FakeRequest:
+    def __init__(self, result: tp.Dict[str, tp.Any]):
+        self._result: tp.Dict[str, tp.Any] = result
+
+    def execute(self) -> tp.Dict[str, tp.Any]:
+        return self._result
+
+
+class FakeSheetsService:
+    """
+    Stands in for the Google Sheets API service object (service.spreadsheets().values().get(...).execute())
+    by serving cell values kept in memory. Useful for tests and for running from snapshots.
+    """
+
+    def __init__(self, sheets: tp.Dict[tp.Tuple[str, str], tp.List[tp.List[str]]]):
+        """
+        :param sheets: The values of each sheet keyed by the spreadsheet ID and its whole-column range (such as Archive!C:S).
+        """
+        self.sheets: tp.Dict[tp.Tuple[str, str], tp.List[tp.List[str]]] = sheets
+        self.requested_ranges: tp.List[tp.Tuple[str, str]] = []
+
+    @classmethod
+    def from_snapshots(cls, snapshots: tp.List[SheetSnapshot]) -> 'FakeSheetsService':
+        return cls({(s.spreadsheet_id, s.cell_range): s.load_values() for s in snapshots})
+
+    def spreadsheets(self) -> 'FakeSheetsService':
+        return self
+
+    def values(self) -> 'FakeSheetsService':
+        return self
+
+    def get(self, spreadsheetId: str, range: str) -> _FakeRequest:
+        self.requested_ranges.append((spreadsheetId, range))
+        sheet, start_col, start_row, end_col, end_row = split_cell_range(range)
+        whole_range: str = f'{sheet + "!" if sheet else ""}{start_col}:{end_col}'
+        values: tp.List[tp.List[str]] = self.sheets[(spreadsheetId, whole_range)][start_row - 1:end_row]
+        # The real API leaves out trailing empty rows.
+        while values and is_separator_row(values[-1]):
+            values = values[:-1]
+        return _FakeRequest({'values': values} if values else {})
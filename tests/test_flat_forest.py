@@ -0,0 +1,71 @@
+"""
+Tests that flat_forest.FlatForest scores exactly like the sklearn forest it was compiled from.
+"""
+import os
+import tempfile
+import typing as tp
+import unittest
+
+import numpy as np
+from sklearn.ensemble import ExtraTreesClassifier, RandomForestClassifier
+
+from flat_forest import FlatForest, load_flat_forest
+
+
+def make_data(n_rows: int, seed: int = 0) -> tp.Tuple[np.ndarray, np.ndarray]:
+    """
+    Rows shaped like the featurized weeks: prices relative to the purchase price, with some missing.
+    """
+    rng: np.random.Generator = np.random.default_rng(seed)
+    x: np.ndarray = rng.normal(0, 40, (n_rows, 12)).round()
+    x[rng.random(x.shape) < 0.3] = 10 ** -5
+    y: np.ndarray = np.where(x[:, 0] > 0, 3, 1) + (x[:, 5] > 10) + (rng.random(n_rows) < 0.1)
+    return x, y
+
+
+class TestFlatForest(unittest.TestCase):
+    configs: tp.Dict[str, tp.Any] = {
+        'default': RandomForestClassifier(n_estimators=20, random_state=0),
+        'shallow': RandomForestClassifier(n_estimators=15, max_depth=3, min_samples_leaf=5, random_state=1),
+        'class weights': RandomForestClassifier(n_estimators=20, class_weight='balanced', max_features=None,
+                                                random_state=2),
+        'bootstrap weights': RandomForestClassifier(n_estimators=10, class_weight='balanced_subsample',
+                                                    random_state=3),
+        'extra trees': ExtraTreesClassifier(n_estimators=20, random_state=4),
+    }
+
+    def test_matches_sklearn(self):
+        x, y = make_data(1500)
+        test_x, _ = make_data(700, seed=1)
+        for name, forest in self.configs.items():
+            with self.subTest(name):
+                forest.fit(x, y)
+                flat_forest: FlatForest = FlatForest.from_forest(forest)
+                np.testing.assert_array_equal(flat_forest.classes_, forest.classes_)
+                # Small chunks so rows are spread over several chunks too.
+                np.testing.assert_array_equal(flat_forest.predict_proba(test_x, chunk_size=64),
+                                              forest.predict_proba(test_x))
+                np.testing.assert_array_equal(flat_forest.predict(test_x), forest.predict(test_x))
+                np.testing.assert_array_equal(flat_forest.predict(test_x[0]), forest.predict(test_x[:1]))
+
+    def test_save_and_load(self):
+        x, y = make_data(500)
+        forest: RandomForestClassifier = RandomForestClassifier(n_estimators=10, random_state=0).fit(x, y)
+        flat_forest: FlatForest = FlatForest.from_forest(forest)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path: str = os.path.join(temp_dir, 'forest.cmdl')
+            flat_forest.save(file_path, metadata={'model_name': 'Flat Random Forest'})
+            for use_mmap in (True, False):
+                with self.subTest(use_mmap=use_mmap):
+                    loaded: FlatForest = load_flat_forest(file_path, use_mmap=use_mmap)
+                    self.assertEqual(loaded.n_trees, flat_forest.n_trees)
+                    np.testing.assert_array_equal(loaded.predict_proba(x), forest.predict_proba(x))
+                    del loaded
+
+    def test_untrained_forest(self):
+        with self.assertRaises(ValueError):
+            FlatForest.from_forest(RandomForestClassifier())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+"""
+Tests of forecaster.TurnipForecaster on weeks simulated the way the game generates them, including the correlated
+rates of the decreasing phases that the forecaster only bounds loosely.
+"""
+import math
+import typing as tp
+import unittest
+
+import numpy as np
+
+from forecaster import TurnipForecaster
+from island_week_data import IslandWeekBatch, TurnipPattern, N_PRICES
+
+
+def _decreasing_rates(rate: float, length: int, min_step: float, max_extra_step: float,
+                      rng: np.random.Generator) -> tp.List[float]:
+    rates: tp.List[float] = []
+    for _ in range(length):
+        rates.append(rate)
+        rate -= min_step + rng.uniform(0, max_extra_step)
+    return rates
+
+
+def simulate_week(pattern: TurnipPattern, base_price: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Draws the prices of a week following Ninji's port of the game's code. Prices that are drawn between 1.4 and
+    the rate of a small spike's peak get one bell taken off, like in the game.
+    """
+    rates: tp.List[float] = []
+    offsets: tp.List[int] = [0] * N_PRICES
+    if pattern == TurnipPattern.RANDOM:
+        decreasing_length_1: int = int(rng.integers(2, 4))
+        high_length_1: int = int(rng.integers(0, 7))
+        high_length_3: int = int(rng.integers(0, 7 - high_length_1))
+        rates += list(rng.uniform(0.9, 1.4, high_length_1))
+        rates += _decreasing_rates(rng.uniform(0.6, 0.8), decreasing_length_1, 0.04, 0.06, rng)
+        rates += list(rng.uniform(0.9, 1.4, 7 - high_length_1 - high_length_3))
+        rates += _decreasing_rates(rng.uniform(0.6, 0.8), 5 - decreasing_length_1, 0.04, 0.06, rng)
+        rates += list(rng.uniform(0.9, 1.4, high_length_3))
+    elif pattern == TurnipPattern.HIGH_SPIKE:
+        spike_start: int = int(rng.integers(1, 8))
+        rates += _decreasing_rates(rng.uniform(0.85, 0.9), spike_start, 0.03, 0.02, rng)
+        rates += [rng.uniform(0.9, 1.4), rng.uniform(1.4, 2.0), rng.uniform(2.0, 6.0), rng.uniform(1.4, 2.0),
+                  rng.uniform(0.9, 1.4)]
+        rates += list(rng.uniform(0.4, 0.9, N_PRICES - len(rates)))
+    elif pattern == TurnipPattern.DECREASING:
+        rates += _decreasing_rates(0.9 - rng.uniform(0, 0.05), N_PRICES, 0.03, 0.02, rng)
+    else:
+        spike_start = int(rng.integers(0, 8))
+        rates += _decreasing_rates(rng.uniform(0.4, 0.9), spike_start, 0.03, 0.02, rng)
+        rates += list(rng.uniform(0.9, 1.4, 2))
+        peak_rate: float = rng.uniform(1.4, 2.0)
+        rates += [rng.uniform(1.4, peak_rate), peak_rate, rng.uniform(1.4, peak_rate)]
+        offsets[spike_start + 2] = offsets[spike_start + 4] = 1
+        rates += _decreasing_rates(rng.uniform(0.4, 0.9), N_PRICES - len(rates), 0.03, 0.02, rng)
+    assert len(rates) == N_PRICES
+    return np.asarray([math.ceil(rate * base_price) - offset for rate, offset in zip(rates, offsets)])
+
+
+class TestTurnipForecaster(unittest.TestCase):
+    patterns: tp.List[TurnipPattern] = [TurnipPattern.DECREASING, TurnipPattern.RANDOM, TurnipPattern.HIGH_SPIKE,
+                                        TurnipPattern.SMALL_SPIKE]
+
+    def simulate(self, n_rows: int, known_rate: float,
+                 seed: int = 0) -> tp.Tuple[IslandWeekBatch, np.ndarray, np.ndarray]:
+        rng: np.random.Generator = np.random.default_rng(seed)
+        pattern_indexes: np.ndarray = rng.integers(len(self.patterns), size=n_rows)
+        base_prices: np.ndarray = rng.integers(90, 111, n_rows)
+        true_prices: np.ndarray = np.stack([simulate_week(self.patterns[i], base_price, rng)
+                                            for i, base_price in zip(pattern_indexes, base_prices)])
+        is_known: np.ndarray = rng.random(true_prices.shape) < known_rate
+        empty: np.ndarray = np.zeros(n_rows, dtype=int)
+        batch: IslandWeekBatch = IslandWeekBatch(np.full(n_rows, 'owner'), np.full(n_rows, 'island'), empty,
+                                                 np.where(is_known, true_prices, 0), base_prices, empty, empty)
+        return batch, true_prices, np.asarray([self.patterns[i].value[1] for i in pattern_indexes])
+
+    def test_bounds_contain_true_prices(self):
+        for known_rate in (0.0, 0.3, 0.6, 1.0):
+            with self.subTest(known_rate=known_rate):
+                batch, true_prices, _ = self.simulate(2000, known_rate, seed=int(known_rate * 10))
+                forecast = TurnipForecaster(chunk_size=500).forecast(batch)
+                self.assertTrue(forecast.is_consistent.all())
+                self.assertTrue((forecast.min_prices <= true_prices).all())
+                self.assertTrue((forecast.max_prices >= true_prices).all())
+                known: np.ndarray = batch.prices != 0
+                np.testing.assert_array_equal(forecast.min_prices[known], true_prices[known])
+                np.testing.assert_array_equal(forecast.max_prices[known], true_prices[known])
+
+    def test_full_weeks_are_mostly_classified(self):
+        batch, _, pattern_codes = self.simulate(1000, 1.0, seed=5)
+        forecast = TurnipForecaster().forecast(batch)
+        np.testing.assert_allclose(forecast.posterior.sum(axis=1), 1.0)
+        self.assertGreater((forecast.pattern_codes == pattern_codes).mean(), 0.95)
+
+    def test_empty_batch(self):
+        forecast = TurnipForecaster().forecast(IslandWeekBatch.empty())
+        self.assertEqual(forecast.min_prices.shape, (0, N_PRICES))
+        self.assertEqual(len(forecast.pattern_codes), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
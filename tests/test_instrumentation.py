@@ -0,0 +1,104 @@
+"""
+Tests of the per-span memory peaks and the counter sources of instrumentation. Tracing is off in the tests, so the
+tracer is used directly.
+"""
+import gc
+import threading
+import tracemalloc
+import typing as tp
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import instrumentation
+
+_MB: int = 1024 ** 2
+
+
+class TestMemoryPeaks(unittest.TestCase):
+    def setUp(self):
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        self.tracer: instrumentation.Tracer = instrumentation.Tracer()
+        patcher = mock.patch.object(instrumentation, 'tracer', self.tracer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_span(self, name: str, func: tp.Callable[[], tp.Any]) -> tp.Dict[str, tp.Any]:
+        with instrumentation._Span(name, {}):
+            func()
+        return next(e['args'] for e in reversed(self.tracer.events) if e['name'] == name)
+
+    def test_nested_spans(self):
+        def outer():
+            kept: np.ndarray = np.ones(4 * _MB // 8)
+            self.run_span('inner', lambda: np.ones(8 * _MB // 8))
+            del kept
+
+        outer_args: tp.Dict[str, tp.Any] = self.run_span('outer', outer)
+        inner_args: tp.Dict[str, tp.Any] = next(e['args'] for e in self.tracer.events if e['name'] == 'inner')
+        self.assertAlmostEqual(inner_args['peak_allocated_mb'], 8, delta=0.5)
+        self.assertAlmostEqual(outer_args['peak_allocated_mb'], 12, delta=0.5)
+        self.assertAlmostEqual(outer_args['allocated_mb'], 0, delta=0.5)
+
+        # A later, smaller span isn't given the peak of the ones before it.
+        after_args: tp.Dict[str, tp.Any] = self.run_span('after', lambda: np.ones(_MB // 8))
+        self.assertAlmostEqual(after_args['peak_allocated_mb'], 1, delta=0.5)
+
+    def test_other_threads_do_not_reset_peaks(self):
+        started: threading.Event = threading.Event()
+        done: threading.Event = threading.Event()
+
+        def background():
+            started.wait()
+            # Its span starts and ends (resetting tracemalloc's peak) while the main thread's span is running.
+            self.run_span('background', lambda: None)
+            done.set()
+
+        def main():
+            array: np.ndarray = np.ones(8 * _MB // 8)
+            del array
+            started.set()
+            done.wait()
+
+        thread: threading.Thread = threading.Thread(target=background)
+        thread.start()
+        main_args: tp.Dict[str, tp.Any] = self.run_span('main', main)
+        thread.join()
+        self.assertAlmostEqual(main_args['peak_allocated_mb'], 8, delta=0.5)
+
+    def test_without_reset_peak(self):
+        # Python 3.8 can't reset the peak, so only spans that raise the peak of the process get one.
+        with mock.patch.object(instrumentation, '_can_reset_peak', False):
+            big_args: tp.Dict[str, tp.Any] = self.run_span('big', lambda: np.ones(8 * _MB // 8))
+            small_args: tp.Dict[str, tp.Any] = self.run_span('small', lambda: np.ones(_MB // 8))
+        self.assertAlmostEqual(big_args['peak_allocated_mb'], 8, delta=0.5)
+        self.assertIsNone(small_args['peak_allocated_mb'])
+        self.assertAlmostEqual(small_args['allocated_mb'], 0, delta=0.5)
+
+
+class _Source:
+    def __init__(self):
+        self.hits: int = 3
+
+    def get_counters(self) -> tp.Dict[str, float]:
+        return {'hits': self.hits}
+
+
+class TestCounterSources(unittest.TestCase):
+    def test_sources_are_held_weakly(self):
+        tracer: instrumentation.Tracer = instrumentation.Tracer()
+        tracer.count('hits', 1)
+        source: _Source = _Source()
+        tracer.add_counter_source(source.get_counters)
+        self.assertEqual(tracer.get_counters(), {'hits': 4})
+
+        del source
+        gc.collect()
+        self.assertEqual(tracer.get_counters(), {'hits': 1})
+        self.assertEqual(tracer.counter_sources, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
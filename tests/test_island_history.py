@@ -0,0 +1,59 @@
+"""
+Tests of island_history.IslandHistory on rows parsed from a spreadsheet.
+"""
+import typing as tp
+import unittest
+
+import numpy as np
+
+from bulk_parser import parse_values_bulk
+from island_history import IslandHistory
+from island_week_data import TurnipPattern
+
+
+def make_row(owner: str, island: str, base_price: int, current_pattern: str,
+             previous_pattern: str = '') -> tp.List[str]:
+    return [owner, island, '100'] + [str(base_price + i) for i in range(12)] + [current_pattern, previous_pattern]
+
+
+class TestIslandHistory(unittest.TestCase):
+    def test_consecutive_separators_keep_previous_week(self):
+        values: tp.List[tp.List[str]] = [
+            make_row('Bob', 'Isle', 90, 'Decreasing'),
+            make_row('Ann', 'Cay', 60, 'Random'),
+            [],
+            [],
+            # Written a bit differently than the week before, and without a previous pattern.
+            make_row('BOB ', 'isle ', 80, 'Small Spike'),
+            [],
+            ['', '', ''],
+            [],
+            make_row('Bob', 'Isle', 70, 'Random'),
+            make_row('Ann', 'Cay', 50, 'Decreasing'),
+        ]
+        batch, _ = parse_values_bulk(values)
+        self.assertEqual(batch.week_nums.tolist(), [0, 0, 2, 5, 5])
+
+        history: IslandHistory = IslandHistory(batch)
+        self.assertEqual(history.n_islands, 2)
+        # Ann has no row in the second week, so her last row has no previous week.
+        self.assertEqual(history.previous_rows.tolist(), [-1, -1, 0, 2, -1])
+        self.assertEqual(history.get_lagged_rows(2).tolist(), [-1, -1, -1, 0, -1])
+        np.testing.assert_array_equal(history.get_lagged_prices(1)[3, 0], np.arange(80, 92))
+
+        self.assertEqual(history.backfill_previous_patterns(), 2)
+        self.assertEqual(batch[2].previous_pattern, TurnipPattern.DECREASING)
+        self.assertEqual(batch[3].previous_pattern, TurnipPattern.SMALL_SPIKE)
+        self.assertEqual(batch[4].previous_pattern, TurnipPattern.EMPTY)
+
+    def test_island_rows_are_in_week_order(self):
+        values: tp.List[tp.List[str]] = [make_row('Bob', 'Isle', 90, 'Decreasing'), [], [],
+                                         make_row('Ann', 'Cay', 60, 'Random'), [],
+                                         make_row('Bob', 'Isle', 70, 'Random')]
+        history: IslandHistory = IslandHistory(parse_values_bulk(values)[0])
+        self.assertEqual(history.get_island_rows('BOB', 'Isle').tolist(), [0, 2])
+        self.assertEqual(history.get_island_rows('Nobody').tolist(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+"""
+Tests that the rows of an IslandWeekBatch behave like the IslandWeekData they stand in for.
+"""
+import unittest
+
+import numpy as np
+
+from island_week_data import IslandWeekBatch
+
+
+def make_batch(n_rows: int, seed: int = 0) -> IslandWeekBatch:
+    rng: np.random.Generator = np.random.default_rng(seed)
+    prices: np.ndarray = rng.integers(1, 200, (n_rows, 12))
+    prices[rng.random((n_rows, 12)) < 0.3] = 0
+    prices[:5] = rng.integers(1, 200, (5, 12))
+    return IslandWeekBatch(np.array([f'owner{i}' for i in range(n_rows)], dtype=object),
+                           np.array([f'island{i}' for i in range(n_rows)], dtype=object), np.arange(n_rows),
+                           prices, rng.integers(90, 110, n_rows), rng.integers(-1, 5, n_rows),
+                           rng.integers(-1, 5, n_rows))
+
+
+class TestIslandWeekRow(unittest.TestCase):
+    def test_rows_match_island_week_data(self):
+        batch: IslandWeekBatch = make_batch(500)
+        for row, data in zip(batch, batch.to_rows()):
+            self.assertEqual(row.is_valid(3), data.is_valid(3))
+            self.assertEqual(row.is_perfect(), data.is_perfect())
+            self.assertEqual(row.has_patterns_populated(), data.has_patterns_populated())
+            self.assertEqual(row.get_pattern_modifier(), data.get_pattern_modifier())
+            np.testing.assert_array_equal(row.to_numpy(), data.to_numpy())
+            np.testing.assert_array_equal(row.to_numpy_regression(), data.to_numpy_regression())
+
+    def test_rows_match_batch(self):
+        batch: IslandWeekBatch = make_batch(500)
+        self.assertEqual([row.is_valid(6) for row in batch], batch.is_valid(6).tolist())
+        self.assertEqual([row.is_perfect() for row in batch], batch.is_perfect().tolist())
+        self.assertEqual([row.get_pattern_modifier() for row in batch], batch.get_pattern_modifiers().tolist())
+        np.testing.assert_array_equal(np.array([row.to_numpy() for row in batch]), batch.to_numpy())
+
+
+if __name__ == '__main__':
+    unittest.main()
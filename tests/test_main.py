@@ -0,0 +1,48 @@
+"""
+Tests that the predict command of main reports bad arguments as usage errors instead of tracebacks.
+"""
+import contextlib
+import io
+import typing as tp
+import unittest
+
+import main
+
+
+class TestPredictArguments(unittest.TestCase):
+    def assert_usage_error(self, argv: tp.List[str], message: str):
+        stderr: io.StringIO = io.StringIO()
+        with contextlib.redirect_stderr(stderr), self.assertRaises(SystemExit) as raised:
+            main.parse_args(argv)
+        self.assertEqual(raised.exception.code, 2)
+        self.assertIn(message, stderr.getvalue())
+
+    def test_invalid_prices(self):
+        for price in ('abc', '0', '-5', '9.5', '²'):
+            with self.subTest(price=price):
+                self.assert_usage_error(['predict', '--purchase-price', '100', '--prices', '90', price],
+                                        f'invalid price: {price!r}')
+
+    def test_too_many_prices(self):
+        self.assert_usage_error(['predict', '--purchase-price', '100', '--prices'] + [str(p) for p in range(80, 94)],
+                                'at most 12 prices, got 14')
+
+    def test_missing_purchase_price(self):
+        self.assert_usage_error(['predict', '--prices', '90'], '--purchase-price')
+
+    def test_missing_prices_are_padded(self):
+        args = main.parse_args(['predict', '--purchase-price', '100', '--prices', '90', '-', '85', 'x'])
+        weeks: tp.List[tp.Dict[str, tp.Any]] = main._read_weeks(args)
+        self.assertEqual(weeks[0]['prices'], [90, None, 85] + [None] * 9)
+        self.assertEqual(weeks[0]['purchase_price'], 100)
+
+    def test_invalid_input_file(self):
+        stderr: io.StringIO = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            exit_code: int = main.run(['predict', '--input', '/nonexistent/weeks.json', '--forecaster'])
+        self.assertEqual(exit_code, 2)
+        self.assertIn('Invalid weeks', stderr.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
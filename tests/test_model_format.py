@@ -0,0 +1,82 @@
+"""
+Tests that models saved in the compact format of model_format load back unchanged.
+"""
+import os
+import pickle
+import tempfile
+import typing as tp
+import unittest
+
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+
+from model_format import dumps_compact, load_compact, load_model_file, loads_compact, save_compact
+
+
+def make_model() -> tp.Dict[str, tp.Any]:
+    rng: np.random.Generator = np.random.default_rng(0)
+    matrix: np.ndarray = rng.normal(size=(50, 12))
+    return {
+        'matrix': matrix,
+        'fortran': np.asfortranarray(rng.integers(0, 100, (30, 7)).astype(np.int32)),
+        # Neither C nor Fortran contiguous.
+        'strided': matrix[::2, 1::3],
+        'small': np.arange(3, dtype=np.int8),
+        'objects': np.asarray(['Random', None, 3], dtype=object),
+        'nested': [np.zeros(0), (np.ones((4, 4, 4), dtype=np.float32), 'name')],
+    }
+
+
+class TestCompactFormat(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._temp_dir.cleanup)
+
+    def assert_same_model(self, loaded: tp.Dict[str, tp.Any], model: tp.Dict[str, tp.Any]):
+        for key in ('matrix', 'fortran', 'strided', 'small', 'objects'):
+            np.testing.assert_array_equal(loaded[key], model[key])
+            self.assertEqual(loaded[key].dtype, model[key].dtype)
+        self.assertTrue(loaded['fortran'].flags.f_contiguous)
+        self.assertEqual(loaded['nested'][0].shape, (0,))
+        np.testing.assert_array_equal(loaded['nested'][1][0], model['nested'][1][0])
+        self.assertEqual(loaded['nested'][1][1], 'name')
+
+    def test_roundtrip(self):
+        model: tp.Dict[str, tp.Any] = make_model()
+        metadata: tp.Dict[str, tp.Any] = {'model_name': 'Test', 'classes': [1, 2, 3]}
+        for compress in (False, True):
+            file_path: str = save_compact(model, os.path.join(self._temp_dir.name, f'model{compress}.cmdl'),
+                                          metadata=metadata, compress=compress)
+            for use_mmap in (True, False):
+                with self.subTest(compress=compress, use_mmap=use_mmap):
+                    loaded, loaded_metadata = load_compact(file_path, use_mmap=use_mmap)
+                    self.assertEqual(loaded_metadata, metadata)
+                    self.assert_same_model(loaded, model)
+                    # The arrays are views into the file's contents rather than copies.
+                    self.assertFalse(loaded['matrix'].flags.writeable)
+                    del loaded
+
+    def test_sklearn_model(self):
+        rng: np.random.Generator = np.random.default_rng(1)
+        x: np.ndarray = rng.normal(size=(200, 12))
+        y: np.ndarray = (x[:, 0] > 0).astype(int) + (x[:, 1] > 0)
+        model: LogisticRegression = LogisticRegression().fit(x, y)
+
+        compact_path: str = save_compact(model, os.path.join(self._temp_dir.name, 'model.cmdl'))
+        pickle_path: str = os.path.join(self._temp_dir.name, 'model.mdl')
+        with open(pickle_path, 'wb') as f:
+            pickle.dump(model, f)
+        for file_path in (compact_path, pickle_path):
+            with self.subTest(file_path=os.path.basename(file_path)):
+                np.testing.assert_array_equal(load_model_file(file_path).predict_proba(x), model.predict_proba(x))
+
+    def test_invalid_files(self):
+        with self.assertRaises(ValueError):
+            loads_compact(pickle.dumps(make_model()))
+        contents: bytes = dumps_compact(make_model()).replace(b'"format_version": 1', b'"format_version": 9')
+        with self.assertRaises(ValueError):
+            loads_compact(contents)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+Tests of the levenshtein distance and of utility.PatternResolver, which matches dirty pattern labels to the
+closest whitelisted string.
+"""
+import typing as tp
+import unittest
+
+import numpy as np
+
+import utility
+from island_week_data import TurnipPattern
+from utility import PatternResolver, _levenshtein_distance
+
+
+class TestLevenshteinDistance(unittest.TestCase):
+    def test_distance(self):
+        self.assertEqual(_levenshtein_distance('kitten', 'sitting'), (3, True))
+        self.assertEqual(_levenshtein_distance('sitting', 'kitten'), (3, True))
+        self.assertEqual(_levenshtein_distance('', 'spike'), (5, True))
+        self.assertEqual(_levenshtein_distance('spike', 'spike', max_distance=0), (0, True))
+
+    def test_cutoff_in_both_orders(self):
+        # The shorter string first goes through the swap, which used to drop the cutoff.
+        for str1, str2 in [('d', 'decreasing'), ('decreasing', 'd'), ('kitten', 'sitting'), ('sitting', 'kitten'),
+                           ('', 'spike')]:
+            with self.subTest(str1=str1, str2=str2):
+                self.assertEqual(_levenshtein_distance(str1, str2, max_distance=2), (2, False))
+        self.assertEqual(_levenshtein_distance('kitten', 'sitting', max_distance=3), (3, True))
+
+
+class TestPatternResolver(unittest.TestCase):
+    def test_labels(self):
+        resolver: PatternResolver = PatternResolver(utility._pattern_whitelists)
+        expected: tp.Dict[str, TurnipPattern] = {
+            '': TurnipPattern.EMPTY,
+            'Decreasing': TurnipPattern.DECREASING,
+            'd': TurnipPattern.DECREASING,
+            'BIG SPIKEE': TurnipPattern.HIGH_SPIKE,
+            'Fluctuatin': TurnipPattern.RANDOM,
+            'ls 100%': TurnipPattern.SMALL_SPIKE,
+            # Too far from everything, which used to be matched to 'd' since the cutoff never applied.
+            'qqqqqqqqqq': TurnipPattern.UNKNOWN,
+            # Too short to be matched by distance.
+            'xyz': TurnipPattern.UNKNOWN,
+        }
+        for label, pattern in expected.items():
+            with self.subTest(label=label):
+                self.assertEqual(resolver.resolve(label), pattern)
+        self.assertEqual(PatternResolver(utility._pattern_whitelists, use_distance_metric=False).resolve('Fluctuatin'),
+                         TurnipPattern.UNKNOWN)
+
+    def test_ties_go_to_first_pattern(self):
+        whitelists: tp.Dict[TurnipPattern, tp.Set[str]] = {TurnipPattern.RANDOM: {'abcd'},
+                                                           TurnipPattern.DECREASING: {'abce'}}
+        self.assertEqual(PatternResolver(whitelists).resolve('abcx'), TurnipPattern.RANDOM)
+        reversed_whitelists: tp.Dict[TurnipPattern, tp.Set[str]] = dict(reversed(list(whitelists.items())))
+        self.assertEqual(PatternResolver(reversed_whitelists).resolve('abcx'), TurnipPattern.DECREASING)
+        # Closer matches still win over earlier patterns.
+        self.assertEqual(PatternResolver(whitelists).resolve('abcee'), TurnipPattern.DECREASING)
+
+    def test_matches_brute_force(self):
+        # The BK-tree should find the same closest string as comparing against every whitelisted string.
+        whitelists: tp.Dict[TurnipPattern, tp.Set[str]] = utility._pattern_whitelists
+        priorities: tp.Dict[str, tp.Tuple[int, TurnipPattern]] = {}
+        for priority, (pattern, words) in enumerate(whitelists.items()):
+            for word in words:
+                priorities.setdefault(word, (priority, pattern))
+        resolver: PatternResolver = PatternResolver(whitelists)
+        rng: np.random.Generator = np.random.default_rng(0)
+        alphabet: tp.List[str] = list('adegiklmnoprstu %')
+        for _ in range(500):
+            word: str = rng.choice(sorted(priorities))
+            label: str = ''.join(c if rng.random() > 0.3 else rng.choice(alphabet) for c in word)
+            label += ''.join(rng.choice(alphabet, int(rng.integers(0, 3))))
+            distances: tp.List[tp.Tuple[int, int, str]] = [(_levenshtein_distance(label, w)[0], priorities[w][0], w)
+                                                           for w in priorities]
+            distance, _, closest = min(distances)
+            if label in priorities:
+                expected: TurnipPattern = priorities[label][1]
+            elif len(label) >= resolver.max_distance and distance <= resolver.max_distance:
+                expected = priorities[closest][1]
+            else:
+                expected = TurnipPattern.UNKNOWN
+            self.assertEqual(resolver.resolve(label), expected, label)
+
+    def test_resolve_codes(self):
+        resolver: PatternResolver = PatternResolver(utility._pattern_whitelists)
+        labels: np.ndarray = np.asarray(['random', '', 'Decreasing', 'random', 'qqqqqqqqqq', 'big spike'])
+        self.assertEqual(resolver.resolve_codes(labels).tolist(), [2, 0, 1, 2, -1, 3])
+        # Each distinct label is only resolved once.
+        self.assertEqual(resolver.cache_info().misses, 5)
+        self.assertEqual(resolver.resolve_many(labels.tolist()),
+                         [TurnipPattern.from_code(code) for code in [2, 0, 1, 2, -1, 3]])
+        self.assertEqual(resolver.cache_info().misses, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
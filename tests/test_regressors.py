@@ -0,0 +1,43 @@
+"""
+Tests that regressors.RecursiveLeastSquares learns the same model in bulk as it does one sample at a time.
+"""
+import unittest
+
+import numpy as np
+
+from regressors import RecursiveLeastSquares
+
+
+class TestRecursiveLeastSquares(unittest.TestCase):
+    def test_fit_matches_update(self):
+        rng: np.random.Generator = np.random.default_rng(0)
+        x: np.ndarray = rng.normal(0, 1, (300, 6))
+        # The last feature never varies, like the prices after the half-day being predicted.
+        x[:, -1] = 0
+        y: np.ndarray = x @ rng.normal(0, 1, 6) + rng.normal(0, 0.1, 300)
+        for forgetting_factor in (1.0, 0.99):
+            with self.subTest(forgetting_factor=forgetting_factor):
+                sequential: RecursiveLeastSquares = RecursiveLeastSquares(6, forgetting_factor=forgetting_factor)
+                for sample_x, sample_y in zip(x, y):
+                    sequential.update(sample_x, sample_y)
+
+                bulk: RecursiveLeastSquares = RecursiveLeastSquares(6, forgetting_factor=forgetting_factor)
+                # Starts from a model that already learned some samples, like one picked back up after a week.
+                for sample_x, sample_y in zip(x[:50], y[:50]):
+                    bulk.update(sample_x, sample_y)
+                bulk.fit(x[50:], y[50:])
+
+                self.assertEqual(bulk.n_samples, sequential.n_samples)
+                np.testing.assert_allclose(bulk.weights, sequential.weights, rtol=1e-9, atol=1e-9)
+                np.testing.assert_allclose(bulk.covariance, sequential.covariance, rtol=1e-9, atol=1e-9)
+                np.testing.assert_allclose(bulk.predict(x[:10]), sequential.predict(x[:10]), rtol=1e-9, atol=1e-9)
+
+    def test_fit_without_samples(self):
+        model: RecursiveLeastSquares = RecursiveLeastSquares(3)
+        model.fit(np.zeros((0, 3)), np.zeros(0))
+        self.assertEqual(model.n_samples, 0)
+        np.testing.assert_array_equal(model.weights, np.zeros(3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+"""
+Tests of results_store.ResultsStore, including importing the results JSON files from before the store.
+"""
+import json
+import os
+import sqlite3
+import tempfile
+import typing as tp
+import unittest
+
+from results_store import ResultsStore
+
+
+def make_results(classifiers: tp.Sequence[str], min_num_prices: int) -> tp.List[tp.Dict[str, tp.Any]]:
+    return [{'classifier': classifier, 'min_num_prices': min_num_prices, 'train_size': train_size,
+             'n_wrong': i + int(10 * train_size), 'n_tests': 20, 'sensitivity': 0.5, 'specificity': 0.75,
+             'best_params': {'alpha': i}}
+            for i, classifier in enumerate(classifiers) for train_size in (0.25, 0.5, 0.75)]
+
+
+class TestResultsStore(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.results_dir: str = self._temp_dir.name
+        self.db_path: str = os.path.join(self.results_dir, 'results.sqlite3')
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def open(self) -> ResultsStore:
+        store: ResultsStore = ResultsStore(self.db_path, results_dir=self.results_dir)
+        self.addCleanup(store.close)
+        return store
+
+    def write_results_file(self, run_id: str, results: tp.List[tp.Dict[str, tp.Any]]):
+        with open(os.path.join(self.results_dir, f'{run_id}.json'), 'w') as f:
+            json.dump(results, f)
+
+    def test_append_and_query(self):
+        store: ResultsStore = self.open()
+        run_id: str = store.append(make_results(['A', 'B'], 3))
+        self.assertEqual(store.run_ids(), [run_id])
+
+        results: tp.List[tp.Dict[str, tp.Any]] = store.query(classifier='B', train_size=0.5)
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['best_params'], {'alpha': 1})
+        self.assertAlmostEqual(results[0]['test_accuracy'], 1 - 6 / 20)
+
+        groups: tp.List[tp.Dict[str, tp.Any]] = store.aggregate('n_wrong', group_by=('classifier',), how='max')
+        self.assertEqual(groups, [{'classifier': 'A', 'n_wrong': 7}, {'classifier': 'B', 'n_wrong': 8}])
+        with self.assertRaises(sqlite3.IntegrityError):
+            store.append(make_results(['A'], 3), run_id=run_id)
+
+    def test_imports_json_history_when_opened(self):
+        self.write_results_file('results_20201121_163822', make_results(['A'], 5))
+        self.write_results_file('results_20201123_145600', make_results(['A', 'B'], 3))
+        store: ResultsStore = self.open()
+        self.assertEqual(store.run_ids(), ['results_20201121_163822', 'results_20201123_145600'])
+        self.assertEqual(store.latest_run_id(), 'results_20201123_145600')
+        self.assertEqual(len(store.query(min_num_prices=[3, 5])), 9)
+
+        # Only the files that are new since are imported when it's opened again.
+        self.write_results_file('results_20201124_101010_123456', make_results(['B'], 4))
+        store = self.open()
+        self.assertEqual(len(store.run_ids()), 3)
+        self.assertEqual(len(store.query()), 12)
+        self.assertEqual(store.import_json_history(self.results_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
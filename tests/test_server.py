@@ -0,0 +1,56 @@
+"""
+Tests that server.PredictionServer answers malformed requests instead of dropping the connection.
+"""
+import asyncio
+import json
+import typing as tp
+import unittest
+
+from server import PredictionServer
+
+
+class TestMalformedRequests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server: PredictionServer = PredictionServer('Random Forest')
+        self._listener = await asyncio.start_server(self.server._handle_connection, '127.0.0.1', 0)
+        self.port: int = self._listener.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self._listener.close()
+        await self._listener.wait_closed()
+        self.server.executor.shutdown(wait=False)
+
+    async def send(self, request: bytes) -> tp.Tuple[int, tp.Dict[str, tp.Any]]:
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        writer.write(request)
+        await writer.drain()
+        response: bytes = await asyncio.wait_for(reader.read(), 5)
+        writer.close()
+        head, _, body = response.partition(b'\r\n\r\n')
+        return int(head.split(b' ')[1]), json.loads(body)
+
+    async def test_malformed_request_line(self):
+        status, response = await self.send(b'GARBAGE\r\n\r\n')
+        self.assertEqual(status, 400)
+        self.assertIn('request line', response['error'])
+
+    async def test_invalid_content_length(self):
+        for content_length in (b'abc', b'-5'):
+            with self.subTest(content_length=content_length):
+                status, response = await self.send(b'POST /predict HTTP/1.1\r\nContent-Length: ' + content_length +
+                                                   b'\r\n\r\n')
+                self.assertEqual(status, 400)
+                self.assertIn('Content-Length', response['error'])
+        self.assertEqual(self.server.metrics.n_errors, 2)
+
+    async def test_bad_json(self):
+        status, _ = await self.send(b'POST /predict HTTP/1.1\r\nContent-Length: 4\r\nConnection: close\r\n\r\n{bad')
+        self.assertEqual(status, 400)
+
+    async def test_unknown_route(self):
+        status, _ = await self.send(b'GET /nothing HTTP/1.1\r\nConnection: close\r\n\r\n')
+        self.assertEqual(status, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
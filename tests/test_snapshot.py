@@ -0,0 +1,199 @@
+"""
+Tests of the local snapshots and the incremental refresh of get_data.get_snapshot_data, using
+snapshot.FakeSheetsService in place of the Google Sheets API.
+"""
+import os
+import tempfile
+import typing as tp
+import unittest
+
+import numpy as np
+
+from bulk_parser import parse_values_bulk
+from constants import MADDOX_KNIGHT_SPREADSHEET_ID, MADDOX_KNIGHT_CELL_RANGE
+from get_data import get_snapshot_data, iter_raw_data
+from island_week_data import IslandWeekBatch
+from snapshot import FakeSheetsService, SheetSnapshot, split_cell_range, range_from_row, is_separator_row
+
+
+def make_week(week_num: int, n_islands: int, base_price: int = 90) -> tp.List[tp.List[str]]:
+    """
+    Makes the rows of one week of the community spreadsheet, without the separator after it.
+    """
+    rows: tp.List[tp.List[str]] = []
+    for i in range(n_islands):
+        prices: tp.List[str] = [str(base_price + week_num + i + j) for j in range(12)]
+        rows.append([f'owner{week_num}_{i}', f'island{i}', str(100 + i)] + prices + ['Decreasing', 'Fluctuating'])
+    return rows
+
+
+def make_sheet(islands_per_week: tp.List[int]) -> tp.List[tp.List[str]]:
+    """
+    Makes the rows of a community spreadsheet with a separator after every week but the last.
+    """
+    rows: tp.List[tp.List[str]] = []
+    for week_num, n_islands in enumerate(islands_per_week):
+        if week_num > 0:
+            rows.append([])
+        rows.extend(make_week(week_num, n_islands))
+    return rows
+
+
+def make_service(values: tp.List[tp.List[str]]) -> FakeSheetsService:
+    return FakeSheetsService({(MADDOX_KNIGHT_SPREADSHEET_ID, MADDOX_KNIGHT_CELL_RANGE): values})
+
+
+def assert_batches_equal(test: unittest.TestCase, actual: IslandWeekBatch, expected: IslandWeekBatch):
+    test.assertEqual(len(actual), len(expected))
+    for column in IslandWeekBatch._columns:
+        np.testing.assert_array_equal(getattr(actual, column), getattr(expected, column), err_msg=column)
+
+
+class TestCellRanges(unittest.TestCase):
+    def test_split_cell_range(self):
+        self.assertEqual(split_cell_range('Archive!C:S'), ('Archive', 'C', 1, 'S', None))
+        self.assertEqual(split_cell_range('A5:P10'), ('', 'A', 5, 'P', 10))
+        with self.assertRaises(ValueError):
+            split_cell_range('not a range')
+
+    def test_range_from_row(self):
+        self.assertEqual(range_from_row('Archive!C:S', 1), 'Archive!C:S')
+        self.assertEqual(range_from_row('Archive!C:S', 120), 'Archive!C120:S')
+        self.assertEqual(range_from_row('A:P', 3, 7), 'A3:P7')
+
+    def test_is_separator_row(self):
+        self.assertTrue(is_separator_row([]))
+        self.assertTrue(is_separator_row(['', '']))
+        self.assertFalse(is_separator_row(['', 'a']))
+
+
+class TestFakeSheetsService(unittest.TestCase):
+    def test_leaves_out_trailing_empty_rows(self):
+        values: tp.List[tp.List[str]] = [['a'], [], ['b'], [], []]
+        service: FakeSheetsService = make_service(values)
+        result = service.spreadsheets().values().get(spreadsheetId=MADDOX_KNIGHT_SPREADSHEET_ID,
+                                                     range='Archive!C1:S4').execute()
+        self.assertEqual(result, {'values': [['a'], [], ['b']]})
+        result = service.spreadsheets().values().get(spreadsheetId=MADDOX_KNIGHT_SPREADSHEET_ID,
+                                                     range='Archive!C4:S').execute()
+        self.assertEqual(result, {})
+
+    def test_block_downloads_keep_separators(self):
+        # Blocks that end on separators lose them, since the API leaves out trailing empty rows. A block of only a
+        # separator looks like the end of the sheet, so the blocks are at least two rows.
+        values: tp.List[tp.List[str]] = make_sheet([3, 2, 4, 1])
+        expected, _ = parse_values_bulk(values)
+        for rows_per_request in range(2, len(values) + 2):
+            with self.subTest(rows_per_request=rows_per_request):
+                downloaded: tp.List[tp.List[str]] = list(iter_raw_data(make_service(values),
+                                                                       rows_per_request=rows_per_request))
+                self.assertEqual(downloaded, values)
+                assert_batches_equal(self, parse_values_bulk(downloaded)[0], expected)
+
+    def test_separators_give_week_numbers(self):
+        values: tp.List[tp.List[str]] = make_sheet([2, 3]) + [[], ['', '', ''], []] + make_week(2, 2)
+        batch, report = parse_values_bulk(values)
+        self.assertEqual(batch.week_nums.tolist(), [0, 0, 1, 1, 1, 4, 4])
+        self.assertEqual(report.n_separators, 4)
+        self.assertEqual(report.n_rejected, 0)
+
+
+class TestIncrementalRefresh(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.snapshot_dir: str = self._temp_dir.name
+        self.snapshot: SheetSnapshot = SheetSnapshot(MADDOX_KNIGHT_SPREADSHEET_ID, MADDOX_KNIGHT_CELL_RANGE,
+                                                     snapshot_dir=self.snapshot_dir)
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def get(self, service: tp.Union[None, FakeSheetsService], full_refresh: bool = False) -> IslandWeekBatch:
+        return get_snapshot_data(service, snapshot_dir=self.snapshot_dir, full_refresh=full_refresh)
+
+    def test_first_download_saves_snapshot(self):
+        values: tp.List[tp.List[str]] = make_sheet([3, 2])
+        service: FakeSheetsService = make_service(values)
+        batch: IslandWeekBatch = self.get(service)
+
+        assert_batches_equal(self, batch, parse_values_bulk(values)[0])
+        self.assertEqual(service.requested_ranges, [(MADDOX_KNIGHT_SPREADSHEET_ID, MADDOX_KNIGHT_CELL_RANGE)])
+        self.assertEqual(self.snapshot.load_values(), values)
+        self.assertTrue(os.path.exists(self.snapshot.batch_path))
+
+    def test_only_downloads_from_last_week(self):
+        old_values: tp.List[tp.List[str]] = make_sheet([3, 2])
+        self.get(make_service(old_values))
+
+        # The last week gets another island, and a new week starts.
+        new_values: tp.List[tp.List[str]] = make_sheet([3, 3, 2])
+        service: FakeSheetsService = make_service(new_values)
+        batch: IslandWeekBatch = self.get(service)
+
+        # Rows 1 to 3 are the first week and row 4 is its separator, so the refresh starts at row 5.
+        self.assertEqual(service.requested_ranges, [(MADDOX_KNIGHT_SPREADSHEET_ID, 'Archive!C5:S')])
+        assert_batches_equal(self, batch, parse_values_bulk(new_values)[0])
+        self.assertEqual(self.snapshot.load_values(), new_values)
+
+    def test_refresh_without_changes(self):
+        values: tp.List[tp.List[str]] = make_sheet([2, 2, 2])
+        first: IslandWeekBatch = self.get(make_service(values))
+        second: IslandWeekBatch = self.get(make_service(values))
+        assert_batches_equal(self, second, first)
+        self.assertEqual(self.snapshot.load_values(), values)
+
+    def test_refresh_after_trailing_separator(self):
+        # The snapshot ends with a separator, so the week after it is new and every week before it is finished.
+        old_values: tp.List[tp.List[str]] = make_sheet([2, 2]) + [[]]
+        self.snapshot.save_values(old_values)
+
+        new_values: tp.List[tp.List[str]] = make_sheet([2, 2, 3])
+        service: FakeSheetsService = make_service(new_values)
+        batch: IslandWeekBatch = self.get(service)
+
+        self.assertEqual(service.requested_ranges, [(MADDOX_KNIGHT_SPREADSHEET_ID, 'Archive!C7:S')])
+        assert_batches_equal(self, batch, parse_values_bulk(new_values)[0])
+        self.assertEqual(batch.week_nums.tolist(), [0, 0, 1, 1, 2, 2, 2])
+
+    def test_refresh_ignores_outdated_parsed_rows(self):
+        values: tp.List[tp.List[str]] = make_sheet([2, 2])
+        self.get(make_service(values))
+        # A batch parsed by another version of the parser is parsed again from the raw values.
+        IslandWeekBatch.empty().save(self.snapshot.batch_path, parser_version=-1)
+        batch: IslandWeekBatch = self.get(make_service(values))
+        assert_batches_equal(self, batch, parse_values_bulk(values)[0])
+
+    def test_full_refresh_downloads_everything(self):
+        self.get(make_service(make_sheet([2, 2])))
+        # Rows already in the snapshot that changed are only picked up by a full refresh.
+        changed_values: tp.List[tp.List[str]] = make_sheet([1, 2])
+        service: FakeSheetsService = make_service(changed_values)
+        batch: IslandWeekBatch = self.get(service, full_refresh=True)
+
+        self.assertEqual(service.requested_ranges, [(MADDOX_KNIGHT_SPREADSHEET_ID, MADDOX_KNIGHT_CELL_RANGE)])
+        assert_batches_equal(self, batch, parse_values_bulk(changed_values)[0])
+
+    def test_offline(self):
+        with self.assertRaises(FileNotFoundError):
+            self.get(None)
+        values: tp.List[tp.List[str]] = make_sheet([2, 3])
+        online: IslandWeekBatch = self.get(make_service(values))
+        assert_batches_equal(self, self.get(None), online)
+
+
+class TestBatchListCompatibility(unittest.TestCase):
+    def test_batch_acts_like_a_list_of_rows(self):
+        batch: IslandWeekBatch = parse_values_bulk(make_sheet([2, 1]))[0]
+        rows = batch.to_rows()
+        self.assertEqual([str(row) for row in batch], [str(row) for row in rows])
+        self.assertEqual(str(batch[-1]), str(rows[-1]))
+        self.assertEqual(len([row for row in batch if row.has_patterns_populated()]), 3)
+
+        combined = rows[:1] + batch
+        self.assertIsInstance(combined, IslandWeekBatch)
+        self.assertEqual([str(row) for row in combined], [str(row) for row in rows[:1] + rows])
+        self.assertEqual(len(batch + rows[:1]), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
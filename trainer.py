@@ -0,0 +1,97 @@
+"""
+Trains and tests the classifiers. Pulled out of the trainer notebook so that the sweep scheduler can use it too.
+"""
+import typing as tp
+
+import numpy as np
+from sklearn.model_selection import GridSearchCV, train_test_split
+
+import instrumentation
+import utility
+from classifiers import get_all_classifiers
+from constants import RANDOM_STATE, N_JOBS, MIN_NUM_PRICES
+from metrics import evaluate
+from search import AdaptiveSearch
+
+
+def train_classifier(class_name, classifier, params, train_x, train_y, test_x, test_y, cv, save_model=True,
+                     n_jobs: int = N_JOBS, min_num_prices: int = MIN_NUM_PRICES, quiet: bool = False,
+                     search: str = 'grid'):
+    """
+    Finds the best hyperparameters for the classifier, then tests it.
+    :param search: Either 'grid' for an exhaustive GridSearchCV or 'adaptive' for search.AdaptiveSearch.
+    :return: A tuple of the number of tests it got wrong, the number of tests, the metrics on the tests (see metrics.evaluate), and the best hyperparameters.
+    """
+    log: tp.Callable = (lambda *a: None) if quiet else print
+    log(f'Optimizing parameters...')
+    param_keys = '\n'.join([k for k in params.keys()])
+    log(f'List of parameters: \n{param_keys}')
+    search_cls = AdaptiveSearch if search == 'adaptive' else GridSearchCV
+    grid = search_cls(classifier, params, cv=cv, n_jobs=n_jobs)
+    with instrumentation.span(f'{search} search', classifier=class_name, n_samples=train_x.shape[0]):
+        grid.fit(train_x, train_y)
+    # Both searches already refit the best parameters on all of the training data.
+    model = grid.best_estimator_
+    log(f'Optimal Parameters Found to be: ')
+    log('\n'.join([f'{k}: {v}' for k, v in grid.best_params_.items()]))
+
+    log(f'Testing Classifier with {test_x.shape[0]} samples.')
+    with instrumentation.span('test', classifier=class_name, n_samples=test_x.shape[0]):
+        y_pred = model.predict(test_x)
+    n_tests = test_y.shape[0]
+    num_wrong = (y_pred != test_y).sum()
+
+    if save_model:
+        filepath, _ = utility.save_model(class_name, model, params=grid.best_params_,
+                                         score=1 - num_wrong / n_tests, min_num_prices=min_num_prices)
+        log(f'Model was saved to: {filepath}')
+
+    test_metrics = evaluate(test_y, y_pred)
+
+    log(f'Got {num_wrong}/{n_tests} ({num_wrong / n_tests:.2%}) tests wrong for {class_name}.')
+
+    return num_wrong, n_tests, test_metrics, grid.best_params_
+
+
+def split_data(x: np.ndarray, y: np.ndarray, train_percent: float) -> tp.Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, int]:
+    """
+    Splits the data so that every class shows up at least twice in the training data, which cross validation needs.
+    :return: A tuple of the training features, testing features, training labels, testing labels, and the number of folds to use.
+    """
+    cv = 1
+    n_iterations = 0
+    while cv == 1:
+        train_x, test_x, train_y, test_y = train_test_split(x, y, train_size=train_percent,
+                                                            random_state=RANDOM_STATE + n_iterations)
+        cv = utility.get_max_cv(train_y)
+        n_iterations += 1
+    return train_x, test_x, train_y.reshape(-1), test_y.reshape(-1), cv
+
+
+@instrumentation.timed()
+def train_all_classifiers(x, y, train_percent, save_models=True, classifiers=None, min_num_prices: int = MIN_NUM_PRICES,
+                          n_jobs: int = N_JOBS, quiet: bool = False, search: str = 'grid'):
+    log: tp.Callable = (lambda *a: None) if quiet else print
+    train_x, test_x, train_y, test_y, cv = split_data(x, y, train_percent)
+    log(f'Using CV: {cv}')
+    history = []
+
+    for class_name, classifier, params in (classifiers or get_all_classifiers()):
+        log(f'Training/Testing {class_name}')
+        num_wrong, n_tests, test_metrics, best_params = train_classifier(
+            class_name, classifier, params, train_x, train_y, test_x, test_y, cv, save_model=save_models,
+            n_jobs=n_jobs, min_num_prices=min_num_prices, quiet=quiet, search=search)
+        last_result = {'classifier': class_name, 'min_num_prices': min_num_prices,
+                       'recall': test_metrics['sensitivity'], 'specificity': test_metrics['specificity'],
+                       'precision': test_metrics['precision'], 'f1': test_metrics['f1'],
+                       'n_wrong': int(num_wrong), 'n_tests': int(n_tests),
+                       'best_params': {k: _to_builtin(v) for k, v in best_params.items()},
+                       'train_size': float(train_percent)}
+        history.append(last_result)
+        log('')
+    log('\n'.join(['\n'.join([f'{k}: {v}' for k, v in result.items()]) for result in history]))
+    return history
+
+
+def _to_builtin(value):
+    return value.item() if hasattr(value, 'item') else value
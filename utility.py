@@ -2,16 +2,22 @@
 Utility file to help determine different aspects about the data.
 """
 import datetime as dt
+import functools
 import json
 import os
 import pickle
 import re
 import typing as tp
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 
-from constants import MIN_NUM_PRICES, MODEL_FILEPATH, RESULTS_SAVE_PATH
-from island_week_data import TurnipPattern, IslandWeekData
+import instrumentation
+from constants import MIN_NUM_PRICES, MODEL_FILEPATH, RESULTS_SAVE_PATH, PREDICTION_CHUNK_SIZE
+from island_week_data import TurnipPattern, IslandWeekData, IslandWeekBatch
+from model_format import save_compact, COMPACT_MODEL_EXTENSION
+from model_registry import get_registry, TIMESTAMP_FORMAT
+from results_store import ResultsStore
 
 
 def _levenshtein_distance(str1: str, str2: str, max_distance: int = -1) -> tp.Tuple[int, bool]:
@@ -32,12 +38,16 @@ def _levenshtein_distance(str1: str, str2: str, max_distance: int = -1) -> tp.Tu
 
     # Make the str2 be the shortest string.
     if len(str1) < len(str2):
-        return _levenshtein_distance(str2, str1)
+        return _levenshtein_distance(str2, str1, max_distance=max_distance)
+
+    # The distance is at least the difference in length, so don't bother if that's already too far.
+    if -1 < max_distance < len(str1) - len(str2):
+        return max_distance, False
 
     # Stop early in the event that the shortest string
     # doesn't even have anything in it.
     if len(str2) == 0:
-        if -1 < max_distance < len(str2):
+        if -1 < max_distance < len(str1):
             return max_distance, False
         else:
             return len(str1), True
@@ -64,6 +74,9 @@ def _levenshtein_distance(str1: str, str2: str, max_distance: int = -1) -> tp.Tu
             if not should_continue:
                 return max_distance, False
 
+    if -1 < max_distance < previous_row[-1]:
+        return max_distance, False
+
     return previous_row[-1], True
 
 
@@ -75,6 +88,135 @@ _pattern_whitelists: tp.Dict[TurnipPattern, tp.Set[str]] = {
 }
 
 
+class _BKTree:
+    """
+    Burkhard-Keller tree over a set of strings using the levenshtein distance, so that finding every string within
+    a distance of the query only has to compare against a small part of the strings.
+    """
+
+    def __init__(self):
+        self._root: tp.Union[None, tp.Tuple[str, tp.Dict[int, tp.Any]]] = None
+
+    def add(self, word: str):
+        if self._root is None:
+            self._root = (word, {})
+            return
+        node_word, children = self._root
+        while True:
+            distance, _ = _levenshtein_distance(word, node_word)
+            if distance == 0:
+                return
+            if distance not in children:
+                children[distance] = (word, {})
+                return
+            node_word, children = children[distance]
+
+    def search(self, query: str, max_distance: int) -> tp.List[tp.Tuple[int, str]]:
+        """
+        Finds every string in the tree that is within max_distance of the query.
+        :return: A list of (distance, string) tuples.
+        """
+        if self._root is None:
+            return []
+        found: tp.List[tp.Tuple[int, str]] = []
+        to_visit: tp.List[tp.Tuple[str, tp.Dict[int, tp.Any]]] = [self._root]
+        while to_visit:
+            node_word, children = to_visit.pop()
+            # Only children with an edge in [distance - max_distance, distance + max_distance] can be close enough,
+            # so the distance to this node doesn't need to be known exactly past the largest edge.
+            limit: int = max_distance + max(children.keys(), default=0)
+            distance, is_complete = _levenshtein_distance(query, node_word, max_distance=limit)
+            if not is_complete:
+                continue
+            if distance <= max_distance:
+                found.append((distance, node_word))
+            to_visit.extend([child for edge, child in children.items()
+                             if distance - max_distance <= edge <= distance + max_distance])
+        return found
+
+
+class PatternResolver:
+    """
+    Resolves the possibly dirty pattern strings in the raw data to TurnipPatterns. Whitelisted strings are found
+    with a single dictionary lookup, everything else goes through a BK-tree of the whitelists, and every resolved
+    string is kept in a bounded LRU cache since the same labels show up over and over again.
+    """
+
+    def __init__(self, whitelists: tp.Dict[TurnipPattern, tp.Set[str]], use_distance_metric: bool = True,
+                 max_distance: int = 4, cache_size: int = 4096):
+        """
+        :param whitelists: The strings that are known to mean each pattern.
+        :param use_distance_metric: If true (default), strings not in the whitelists are matched to the closest whitelisted string.
+        :param max_distance: The largest distance a string can be from a whitelisted string to be matched to it.
+        :param cache_size: The number of resolved strings to remember.
+        """
+        self.use_distance_metric: bool = use_distance_metric
+        self.max_distance: int = max_distance
+        self._exact_matches: tp.Dict[str, TurnipPattern] = {}
+        # Ties in distance go to the pattern that comes first in the whitelists.
+        self._priorities: tp.Dict[str, int] = {}
+        self._tree: _BKTree = _BKTree()
+        for priority, (pattern, words) in enumerate(whitelists.items()):
+            for word in sorted(words):
+                self._exact_matches.setdefault(word, pattern)
+                self._priorities.setdefault(word, priority)
+                self._tree.add(word)
+        self._resolve_cached = functools.lru_cache(maxsize=cache_size)(self._resolve)
+        instrumentation.add_counter_source(self._get_cache_counters)
+
+    def _resolve(self, pattern_str: str) -> TurnipPattern:
+        if len(pattern_str) == 0:
+            return TurnipPattern.EMPTY
+
+        in_str: str = pattern_str.lower()
+
+        if in_str in self._exact_matches:
+            return self._exact_matches[in_str]
+
+        if self.use_distance_metric and len(in_str) >= self.max_distance:
+            instrumentation.count('fuzzy pattern searches')
+            matches: tp.List[tp.Tuple[int, str]] = self._tree.search(in_str, self.max_distance)
+            if matches:
+                instrumentation.count('fuzzy pattern matches')
+                _, closest = min(matches, key=lambda m: (m[0], self._priorities[m[1]], m[1]))
+                return self._exact_matches[closest]
+
+        instrumentation.count('unknown patterns')
+        return TurnipPattern.UNKNOWN
+
+    def resolve(self, pattern_str: str) -> TurnipPattern:
+        return self._resolve_cached(pattern_str)
+
+    def resolve_many(self, pattern_strs: tp.Iterable[str]) -> tp.List[TurnipPattern]:
+        """
+        Resolves a whole column of pattern strings, only resolving each distinct string once.
+        """
+        pattern_strs = list(pattern_strs)
+        resolved: tp.Dict[str, TurnipPattern] = {s: self.resolve(s) for s in set(pattern_strs)}
+        return [resolved[s] for s in pattern_strs]
+
+    def resolve_codes(self, pattern_strs: np.ndarray) -> np.ndarray:
+        """
+        Resolves a numpy array of pattern strings to an array of the codes of their patterns.
+        """
+        labels, inverse = np.unique(np.asarray(pattern_strs, dtype=str), return_inverse=True)
+        # As str, since lru_cache keys numpy strings differently than the str labels get_pattern resolves.
+        codes: np.ndarray = np.asarray([self.resolve(str(label)).value[1] for label in labels], dtype=np.int8)
+        return codes[inverse.reshape(-1)]
+
+    def cache_info(self):
+        return self._resolve_cached.cache_info()
+
+    def _get_cache_counters(self) -> tp.Dict[str, int]:
+        info = self.cache_info()
+        return {'pattern cache hits': info.hits, 'pattern cache misses': info.misses}
+
+
+@functools.lru_cache(maxsize=None)
+def get_pattern_resolver(use_distance_metric: bool = True, max_distance: int = 4) -> PatternResolver:
+    return PatternResolver(_pattern_whitelists, use_distance_metric=use_distance_metric, max_distance=max_distance)
+
+
 def get_pattern(pattern_str: str, use_distance_metric: bool = True, max_distance: int = 4) -> TurnipPattern:
     """
     Uses a series of whitelists and the levenshtein distance metric to determine what type of pattern the input string is meant to be.
@@ -82,87 +224,220 @@ def get_pattern(pattern_str: str, use_distance_metric: bool = True, max_distance
     An example is: Large Spike is the actual pattern, but the user put in BIIIIIG SPIKE.
     :param pattern_str: The possibly dirty pattern string that is in the raw data.
     :param use_distance_metric: If true (default), function will use distance metric in calculations. Won't otherwise.
-    :param max_distance: The distance the distance metric will stop at if all values pass this. Default is 4 and won't be used if use_distance_metric is False.
+    :param max_distance: The largest distance a string can be from a whitelisted string to be matched to it. Default is 4 and won't be used if use_distance_metric is False.
     :return: The appropriate TurnipPattern for the input string, Empty if pattern_str is empty, or Unknown if it cannot be determined otherwise.
     """
-    if len(pattern_str) == 0:
-        return TurnipPattern.EMPTY
+    return get_pattern_resolver(use_distance_metric, max_distance).resolve(pattern_str)
 
-    in_str: str = pattern_str.lower()
 
-    for k, v in _pattern_whitelists.items():
-        if in_str in v:
-            return k
+def resolve_pattern_codes(pattern_strs: np.ndarray, use_distance_metric: bool = True, max_distance: int = 4) -> np.ndarray:
+    return get_pattern_resolver(use_distance_metric, max_distance).resolve_codes(pattern_strs)
 
-    if use_distance_metric and len(in_str) >= max_distance:
-        for k, v in _pattern_whitelists.items():
-            # If any of the distances between the values and the in_str are within the maximum distance,
-            # return the key.
-            if any([_levenshtein_distance(val, in_str, max_distance=max_distance)[1] for val in v]):
-                return k
 
-    return TurnipPattern.UNKNOWN
+RowsType = tp.Union[tp.List[IslandWeekData], IslandWeekBatch]
 
 
-def island_data_to_numpy(rows: tp.List[IslandWeekData], is_perfect: bool = False) -> tp.Tuple[np.ndarray, tp.List[IslandWeekData]]:
-    if is_perfect:
-        out_rows = [row for row in rows if row.is_perfect()]
-    else:
-        out_rows = [row for row in rows if row.is_valid(MIN_NUM_PRICES)]
-    return np.asarray([row.to_numpy() for row in out_rows]), out_rows
+def as_batch(rows: RowsType) -> IslandWeekBatch:
+    """
+    Gets the rows as an IslandWeekBatch, converting them only if they are not one already.
+    :param rows: Either a list of IslandWeekData or an IslandWeekBatch.
+    :return: The rows as an IslandWeekBatch.
+    """
+    return rows if isinstance(rows, IslandWeekBatch) else IslandWeekBatch.from_rows(rows)
 
 
-def island_data_get_current_patterns(rows: tp.List[IslandWeekData], is_perfect: bool = False) -> np.ndarray:
-    if is_perfect:
-        return np.asarray([[row.current_pattern.value[1]] for row in rows if row.is_perfect()])
-    else:
-        return np.asarray([[row.current_pattern.value[1]] for row in rows if row.is_valid(MIN_NUM_PRICES)])
+def _select_rows(rows: RowsType, mask: np.ndarray) -> RowsType:
+    if isinstance(rows, IslandWeekBatch):
+        return rows[mask]
+    return [rows[i] for i in np.flatnonzero(mask)]
+
+
+def _get_mask(batch: IslandWeekBatch, is_perfect: bool, min_prices: int) -> np.ndarray:
+    return batch.is_perfect() if is_perfect else batch.is_valid(min_prices)
+
+
+def island_data_to_numpy(rows: RowsType, is_perfect: bool = False,
+                         min_prices: int = MIN_NUM_PRICES) -> tp.Tuple[np.ndarray, RowsType]:
+    batch: IslandWeekBatch = as_batch(rows)
+    mask: np.ndarray = _get_mask(batch, is_perfect, min_prices)
+    return batch[mask].to_numpy(), _select_rows(rows, mask)
 
 
-def get_perfect_data(rows: tp.List[IslandWeekData]) -> tp.Tuple[np.ndarray, tp.List[IslandWeekData], np.ndarray]:
-    rows_np, pruned_rows = island_data_to_numpy(rows, is_perfect=True)
-    return rows_np, pruned_rows, island_data_get_current_patterns(rows, is_perfect=True)
+def island_data_get_current_patterns(rows: RowsType, is_perfect: bool = False,
+                                     min_prices: int = MIN_NUM_PRICES) -> np.ndarray:
+    batch: IslandWeekBatch = as_batch(rows)
+    return batch[_get_mask(batch, is_perfect, min_prices)].get_current_patterns()
 
 
-def get_all_data(rows: tp.List[IslandWeekData]) -> tp.Tuple[np.ndarray, tp.List[IslandWeekData], np.ndarray]:
-    rows_np, pruned_rows = island_data_to_numpy(rows, is_perfect=False)
-    return rows_np, pruned_rows, island_data_get_current_patterns(rows, is_perfect=False)
+def _get_data(rows: RowsType, is_perfect: bool, min_prices: int) -> tp.Tuple[np.ndarray, RowsType, np.ndarray]:
+    batch: IslandWeekBatch = as_batch(rows)
+    mask: np.ndarray = _get_mask(batch, is_perfect, min_prices)
+    selected: IslandWeekBatch = batch[mask]
+    return selected.to_numpy(), _select_rows(rows, mask), selected.get_current_patterns()
 
 
-def save_model(model_name: str, model) -> tp.Tuple[str, str]:
-    date_str: str = dt.datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename: str = f'{model_name.replace(" ", "")}_{date_str}.mdl'
+@instrumentation.timed()
+def get_perfect_data(rows: RowsType) -> tp.Tuple[np.ndarray, RowsType, np.ndarray]:
+    return _get_data(rows, True, MIN_NUM_PRICES)
+
+
+@instrumentation.timed()
+def get_all_data(rows: RowsType, min_prices: int = MIN_NUM_PRICES) -> tp.Tuple[np.ndarray, RowsType, np.ndarray]:
+    return _get_data(rows, False, min_prices)
+
+
+@instrumentation.timed()
+def save_model(model_name: str, model, params: tp.Union[None, tp.Dict[str, tp.Any]] = None,
+               score: tp.Union[None, float] = None, min_num_prices: int = MIN_NUM_PRICES,
+               compact: bool = False) -> tp.Tuple[str, str]:
+    """
+    Saves the model into the models directory and records it in the model registry.
+    :param model_name: The name of the model, such as Random Forest.
+    :param model: The trained model.
+    :param params: The hyperparameters the model was trained with.
+    :param score: How well the model did, higher being better.
+    :param min_num_prices: The minimum number of prices a week needed to be part of the training data.
+    :param compact: If true, saves the model in the memory mappable format of model_format instead of as a pickle.
+    sklearn forests still copy their trees when loaded from it, so compile them with flat_forest instead.
+    :return: A tuple of the path to the saved model and its filename.
+    """
+    date_str: str = dt.datetime.now().strftime(TIMESTAMP_FORMAT)
+    extension: str = COMPACT_MODEL_EXTENSION if compact else '.mdl'
+    filename: str = f'{model_name.replace(" ", "")}_{date_str}{extension}'
     file_path: str = os.path.join(MODEL_FILEPATH, filename)
-    with open(file_path, 'wb') as f:
-        pickle.dump(model, f)
+    if compact:
+        save_compact(model, file_path, metadata={'model_name': model_name, 'min_num_prices': min_num_prices})
+    else:
+        with open(file_path, 'wb') as f:
+            pickle.dump(model, f)
+    get_registry().register(filename, params=params, score=score, min_num_prices=min_num_prices)
     return file_path, filename
 
 
-def load_model(filename: str):
-    with open(os.path.join(MODEL_FILEPATH, filename), 'rb') as f:
-        return pickle.load(f)
+@instrumentation.timed()
+def load_model(filename: str, use_cache: bool = True):
+    return get_registry().load(filename, use_cache=use_cache)
 
 
 def get_most_recent_model_filename(model_name: str) -> str:
-    actual_name_in_path: str = model_name.replace(" ", "")
-    regex_obj = re.compile(r'([A-Za-z]+)_(\d{4}\d{2}\d{2}_\d{2}\d{2}\d{2}).mdl', re.RegexFlag.ASCII)
-    model_files: tp.List[str] = [f for f in os.listdir(MODEL_FILEPATH) if actual_name_in_path in f]
-    matches: tp.List[tp.Tuple[re.Match, str]] = [(regex_obj.match(f), f) for f in model_files]
-    dates: tp.List[tp.Tuple[dt.datetime, str]] = [(dt.datetime.strptime(match.group(2), '%Y%m%d_%H%M%S'), f) for match, f in matches if match]
-    return sorted(dates, key=lambda d: d[0])[-1][1]
+    return get_registry().latest(model_name).filename
+
+
+def get_best_model_filename(model_name: str, min_num_prices: tp.Union[None, int] = None) -> str:
+    return get_registry().best(model_name, min_num_prices=min_num_prices).filename
 
 
 def get_max_cv(y: np.ndarray) -> int:
     return min(np.unique(y, return_counts=True)[1])
 
 
-def populate_current_pattern(rows: tp.List[IslandWeekData], best_classifier) -> tp.List[IslandWeekData]:
-    return [row.predict_current_pattern(best_classifier) if not row.has_patterns_populated() else row for row in rows]
+@instrumentation.timed()
+def predict_in_chunks(model, x: np.ndarray, chunk_size: int = PREDICTION_CHUNK_SIZE, n_threads: int = 1,
+                      with_confidence: bool = True) -> tp.Tuple[np.ndarray, tp.Union[None, np.ndarray]]:
+    """
+    Runs the model over a feature matrix a fixed number of rows at a time, optionally across a thread pool.
+    :param model: The trained classifier.
+    :param x: The feature matrix, one row per sample.
+    :param chunk_size: The number of rows to give to the model at a time.
+    :param n_threads: The number of threads to predict the chunks with.
+    :param with_confidence: If true (default), also gets the probability of every class from the model's predict_proba.
+    :return: A tuple of the predicted labels and the class probabilities (ordered like model.classes_). The probabilities are None if they weren't asked for or the model can't provide them.
+    """
+    use_proba: bool = with_confidence and hasattr(model, 'predict_proba')
+    if x.shape[0] == 0:
+        return np.zeros(0, dtype=int), (np.zeros((0, len(model.classes_))) if use_proba else None)
+
+    def predict_chunk(start: int) -> tp.Tuple[np.ndarray, tp.Union[None, np.ndarray]]:
+        chunk: np.ndarray = x[start:start + chunk_size]
+        return model.predict(chunk), (model.predict_proba(chunk) if use_proba else None)
+
+    starts: tp.List[int] = list(range(0, x.shape[0], chunk_size))
+    if n_threads > 1 and len(starts) > 1:
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            results = list(executor.map(predict_chunk, starts))
+    else:
+        results = [predict_chunk(start) for start in starts]
+
+    labels: np.ndarray = np.concatenate([labels for labels, _ in results])
+    probabilities: tp.Union[None, np.ndarray] = np.concatenate([p for _, p in results]) if use_proba else None
+    return labels, probabilities
+
+
+def predict_patterns(rows: RowsType, model, chunk_size: int = PREDICTION_CHUNK_SIZE,
+                     n_threads: int = 1) -> tp.Tuple[tp.List[TurnipPattern], tp.Union[None, np.ndarray]]:
+    """
+    Predicts the current pattern of every row at once.
+    :param rows: The rows to predict the patterns of.
+    :param model: The trained classifier.
+    :param chunk_size: The number of rows to give to the model at a time.
+    :param n_threads: The number of threads to predict with.
+    :return: A tuple of the predicted patterns and the confidence of each prediction (the probability the model gave to the predicted pattern), or None if the model can't provide probabilities.
+    """
+    labels, probabilities = predict_in_chunks(model, as_batch(rows).to_numpy(), chunk_size, n_threads)
+    patterns: tp.List[TurnipPattern] = [TurnipPattern.from_code(label) for label in labels]
+    if probabilities is None:
+        return patterns, None
+    return patterns, probabilities[np.arange(labels.shape[0]), np.searchsorted(model.classes_, labels)]
+
+
+@instrumentation.timed()
+def populate_current_pattern(rows: RowsType, best_classifier, chunk_size: int = PREDICTION_CHUNK_SIZE,
+                             n_threads: int = 1, return_confidences: bool = False):
+    """
+    Predicts the current pattern of every row that doesn't have both of its patterns populated, all in one batch.
+    :param rows: The rows to fill in, either a list of IslandWeekData or an IslandWeekBatch. Changed in place.
+    :param best_classifier: The trained classifier.
+    :param chunk_size: The number of rows to give to the model at a time.
+    :param n_threads: The number of threads to predict with.
+    :param return_confidences: If true, also returns the confidences of the predictions.
+    :return: The rows, or if return_confidences is true, a tuple of the rows, the indexes of the rows that were predicted, and the confidences of those predictions (None if the model can't provide them).
+    """
+    batch: IslandWeekBatch = as_batch(rows)
+    indexes: np.ndarray = np.flatnonzero(~batch.has_patterns_populated())
+    patterns, confidences = predict_patterns(batch[indexes], best_classifier, chunk_size, n_threads)
+
+    if isinstance(rows, IslandWeekBatch):
+        rows.current_pattern_codes[indexes] = [p.value[1] for p in patterns]
+    else:
+        for index, pattern in zip(indexes, patterns):
+            rows[index].current_pattern = pattern
+
+    if return_confidences:
+        return rows, indexes, confidences
+    return rows
+
+
+def weeks_to_batch(weeks: tp.List[tp.Dict[str, tp.Any]]) -> IslandWeekBatch:
+    """
+    Builds a batch out of weeks given as dictionaries, such as the ones sent to the prediction server:
+    {"prices": [12 prices, None if missing], "purchase_price": 100, "previous_pattern": "decreasing"}.
+    The owner and island_name are optional.
+    """
+    rows: tp.List[IslandWeekData] = []
+    for week in weeks:
+        prices: tp.List[tp.Union[None, int]] = [int(p) if p else None for p in week['prices']]
+        if len(prices) != 12:
+            raise ValueError('Each week needs exactly 12 prices (null for the missing ones).')
+        previous_pattern: TurnipPattern = get_pattern(week.get('previous_pattern') or '')
+        rows.append(IslandWeekData(week.get('owner', ''), week.get('island_name', ''), 0, prices,
+                                   int(week['purchase_price']), previous_pattern, TurnipPattern.UNKNOWN))
+    return IslandWeekBatch.from_rows(rows)
 
 
 def save_results(results):
-    date_str: str = dt.datetime.now().strftime('%Y%m%d_%H%M%S')
+    # Down to the microsecond, so results saved in the same second don't overwrite each other.
+    date_str: str = dt.datetime.now().strftime(TIMESTAMP_FORMAT)
     filename: str = f'results_{date_str}.json'
+
+    # The results go in the queryable store first, under the same name as the file, so a run that is already in it
+    # fails before the file is written.
+    store: ResultsStore = ResultsStore()
+    try:
+        store.append(results, run_id=f'results_{date_str}', source=filename)
+    finally:
+        store.close()
+
+    os.makedirs(RESULTS_SAVE_PATH, exist_ok=True)
     file_path: str = os.path.join(RESULTS_SAVE_PATH, filename)
     with open(file_path, 'w') as f:
         json.dump(results, f, indent=4)
@@ -175,9 +450,9 @@ def load_results(filename: str):
 
 
 def get_most_recent_results() -> str:
-    regex_obj = re.compile(r'results_(\d{4}\d{2}\d{2}_\d{2}\d{2}\d{2})\.json', re.RegexFlag.ASCII)
+    regex_obj = re.compile(r'results_(\d{8}_\d{6}(?:_\d{6})?)\.json', re.RegexFlag.ASCII)
     result_files: tp.List[str] = os.listdir(RESULTS_SAVE_PATH)
     matches: tp.List[tp.Tuple[re.Match, str]] = [(regex_obj.match(file), file) for file in result_files]
-    dates: tp.List[tp.Tuple[dt.datetime, str]] = [(dt.datetime.strptime(match.group(1), '%Y%m%d_%H%M%S'), file) for
-                                                  match, file in matches]
+    # Older results only have seconds, which still sort before any result saved later.
+    dates: tp.List[tp.Tuple[str, str]] = [(match.group(1), file) for match, file in matches if match]
     return sorted(dates, key=lambda df: df[0])[-1][1]